@@ -0,0 +1,79 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+Local record of the images baked with bake-ami, one per region and
+virtualization type, with the hadoop and jdk versions installed in them.
+"""
+import json
+import os
+import time
+
+DEFAULT_MANIFEST_FILE = os.path.join(os.path.expanduser('~'), '.yarn-ec2', 'amis.json')
+
+class AmiManifest(object):
+    """
+    Baked images keyed by region and virtualization type, stored as json.
+
+    Parameters
+    ----------
+    path: the file the manifest is stored in
+    """
+    def __init__(self, path=DEFAULT_MANIFEST_FILE):
+        self.path = path
+
+    @staticmethod
+    def _key(region, virt):
+        return '%s/%s' % (region, virt)
+
+    def _load(self):
+        try:
+            with open(self.path) as fi:
+                return json.load(fi)
+        except (IOError, ValueError):
+            return {}
+
+    def _save(self, data):
+        dirname = os.path.dirname(self.path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        tmp = '%s.%d.tmp' % (self.path, os.getpid())
+        with open(tmp, 'w') as fo:
+            json.dump(data, fo, indent=2, sort_keys=True)
+        os.rename(tmp, self.path)
+
+    def get(self, region, virt, hadoop_dir=None, jdk_dir=None):
+        """
+        Returns the image id baked for region and virt, None if there is none
+        or if it does not have the given hadoop and jdk versions.
+        """
+        entry = self._load().get(self._key(region, virt))
+        if entry is None:
+            return None
+        if ((hadoop_dir is not None and entry['hadoop_dir'] != hadoop_dir) or
+            (jdk_dir is not None and entry['jdk_dir'] != jdk_dir)):
+            return None
+        return entry['ami']
+
+    def put(self, region, virt, ami, name, hadoop_dir, jdk_dir):
+        data = self._load()
+        data[self._key(region, virt)] = {
+            'ami': ami, 'name': name, 'time': time.time(),
+            'hadoop_dir': hadoop_dir, 'jdk_dir': jdk_dir
+        }
+        self._save(data)
+
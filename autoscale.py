@@ -0,0 +1,364 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+Grow and shrink the slaves of a cluster from the demand the YARN
+ResourceManager reports, and replay recorded demand traces against a
+simulated cluster to compare scaling policies.
+"""
+import calendar
+import json
+import math
+import sys
+import time
+from boto.exception import EC2ResponseError
+import ec2_util
+import yarn_util
+
+class ScalePolicy(object):
+    """
+    Decide when to add or remove slaves.
+
+    Slaves are added when containers stay pending for scale_up_after seconds,
+    enough to run the pending containers. Slaves that run no container for
+    idle_after seconds are removed, while nothing is pending. No decision is
+    taken during cooldown seconds after the last one.
+
+    Parameters
+    ----------
+    min_slaves: the number of slaves never to go below
+    max_slaves: the number of slaves never to go above
+    containers_per_slave: the number of containers a new slave runs
+    scale_up_after: seconds containers must stay pending before adding slaves
+    idle_after: seconds a slave must stay idle before it is removed
+    cooldown: seconds to wait after an action before taking the next one
+    max_step: the maximum number of slaves added or removed at once
+    """
+    def __init__(self, min_slaves=0, max_slaves=20, containers_per_slave=1,
+                 scale_up_after=60, idle_after=300, cooldown=300, max_step=10):
+        self.min_slaves = min_slaves
+        self.max_slaves = max_slaves
+        self.containers_per_slave = max(1, containers_per_slave)
+        self.scale_up_after = scale_up_after
+        self.idle_after = idle_after
+        self.cooldown = cooldown
+        self.max_step = max_step
+        self.pending_since = None
+        self.idle_since = {}
+        self.last_action = None
+
+    def decide(self, now, pending, nodes, launching):
+        """
+        Returns ('add', count), ('remove', hosts) or None.
+
+        Parameters
+        ----------
+        now: the current time in seconds
+        pending: the number of containers waiting for resources
+        nodes: dict of the running slaves' host names to their container counts
+        launching: the number of slaves launched that did not join yet
+        """
+        for host in list(self.idle_since.keys()):
+            if nodes.get(host, 1) > 0:
+                del self.idle_since[host]
+        for host, containers in nodes.items():
+            if containers == 0:
+                self.idle_since.setdefault(host, now)
+        if pending > 0:
+            if self.pending_since is None:
+                self.pending_since = now
+        else:
+            self.pending_since = None
+
+        if self.last_action is not None and now - self.last_action < self.cooldown:
+            return None
+        size = len(nodes) + launching
+        decision = None
+        if size < self.min_slaves:
+            decision = ('add', self.min_slaves - size)
+        elif pending > 0 and now - self.pending_since >= self.scale_up_after:
+            count = int(math.ceil(float(pending) / self.containers_per_slave)) - launching
+            count = min(count, self.max_step, self.max_slaves - size)
+            if count > 0:
+                decision = ('add', count)
+        elif pending == 0 and size > self.min_slaves:
+            idle = sorted((t, h) for h, t in self.idle_since.items()
+                          if now - t >= self.idle_after)
+            hosts = [h for t, h in idle][:min(self.max_step, size - self.min_slaves)]
+            if hosts:
+                decision = ('remove', hosts)
+                for h in hosts:
+                    del self.idle_since[h]
+        if decision is not None:
+            self.last_action = now
+        return decision
+
+
+class Autoscaler(object):
+    """
+    Apply a ScalePolicy to a cluster every interval seconds.
+
+    The cluster provides observe(), returning a dict with the pending and
+    allocated container counts, the running slaves as a dict of host name to
+    container count (nodes), the number of slaves still launching and the raw
+    ResourceManager metrics if any, as well as add(count) and remove(hosts).
+
+    Parameters
+    ----------
+    policy: the ScalePolicy
+    cluster: the cluster to observe and scale
+    interval: seconds between two observations
+    record: optional file object the observed demand is appended to, as a
+        trace that simulate() replays
+    out: where to log observations and actions, None for quiet
+    """
+    def __init__(self, policy, cluster, interval=30, record=None, out=sys.stdout):
+        self.policy = policy
+        self.cluster = cluster
+        self.interval = interval
+        self.record = record
+        self.out = out
+
+    def log(self, now, msg):
+        if self.out is not None:
+            self.out.write('[%s] %s\n' % (time.strftime('%H:%M:%S', time.gmtime(now)), msg))
+            self.out.flush()
+
+    def step(self, now):
+        obs = self.cluster.observe()
+        metrics = obs.get('metrics')
+        msg = 'slaves=%d launching=%d allocated=%d pending=%d' % (
+            len(obs['nodes']), obs['launching'], obs['allocated'], obs['pending'])
+        if metrics:
+            msg += ' mem=%d/%dMB vcores=%d/%d apps-pending=%d' % (
+                metrics['allocatedMB'], metrics['totalMB'],
+                metrics['allocatedVirtualCores'], metrics['totalVirtualCores'],
+                metrics['appsPending'])
+        self.log(now, msg)
+        if self.record is not None:
+            self.record.write(json.dumps({'time': now,
+                                          'demand': obs['allocated'] + obs['pending']}) + '\n')
+            self.record.flush()
+        decision = self.policy.decide(now, obs['pending'], obs['nodes'], obs['launching'])
+        if decision is None:
+            return None
+        action, arg = decision
+        if action == 'add':
+            self.log(now, 'adding %d slave(s)' % arg)
+            self.cluster.add(arg)
+        else:
+            self.log(now, 'removing %d idle slave(s): %s' % (len(arg), ', '.join(arg)))
+            self.cluster.remove(arg)
+        return decision
+
+    def run(self):
+        while True:
+            start = time.time()
+            try:
+                self.step(start)
+            except IOError as e:
+                # the master may be restarting, try again on the next round
+                self.log(start, 'cannot reach the resource manager: %s' % e)
+            except EC2ResponseError as e:
+                self.log(start, 'EC2 returned %s: %s' % (e.error_code, e.error_message))
+            except (ValueError, KeyError) as e:
+                self.log(start, 'unexpected answer from the resource manager: %r' % e)
+            time.sleep(max(0, self.interval - (time.time() - start)))
+
+
+def _launch_time(inst):
+    try:
+        return calendar.timegm(time.strptime(inst.launch_time[:19], '%Y-%m-%dT%H:%M:%S'))
+    except (TypeError, ValueError):
+        return time.time()
+
+class Ec2Cluster(object):
+    """
+    The slaves of a running cluster, observed through the ResourceManager
+    of its master and scaled through EC2.
+
+    Parameters
+    ----------
+    conn: the EC2 connection
+    opts: the parsed options, providing cluster_name and the ssh settings
+    launch: function (count) launching count slaves, e.g. with launch_slaves
+    decommission_timeout: seconds running containers get to finish on removed slaves
+    join_timeout: seconds after which a slave that did not join is no longer
+        counted as launching
+    changed: optional function called after slaves were added or removed
+    """
+    def __init__(self, conn, opts, launch, decommission_timeout=600, join_timeout=900,
+                 changed=None):
+        self.conn = conn
+        self.opts = opts
+        self.launch = launch
+        self.changed = changed or (lambda: None)
+        self.decommission_timeout = decommission_timeout
+        self.join_timeout = join_timeout
+        self.master = None
+        self.slaves = {}
+
+    def observe(self):
+        master_nodes, slave_nodes = ec2_util.retry_ec2_call(
+            lambda: ec2_util.get_existing_cluster(self.conn, self.opts.cluster_name,
+                                                  die_on_error=False))
+        if not master_nodes:
+            raise IOError('no master found for cluster %s' % self.opts.cluster_name)
+        self.master = yarn_util.active_master(master_nodes).public_dns_name
+        metrics = yarn_util.get_cluster_metrics(self.master)
+        rm_nodes = yarn_util.get_nodes(self.master)
+        self.slaves = dict((yarn_util.short_host(s.private_dns_name), s)
+                           for s in slave_nodes if s.private_dns_name)
+        known = set()
+        nodes = {}
+        for node in rm_nodes:
+            host = node['nodeHostName']
+            known.add(yarn_util.short_host(host))
+            if node['state'] == 'RUNNING' and yarn_util.short_host(host) in self.slaves:
+                nodes[host] = node['numContainers']
+        now = time.time()
+        launching = len([s for s in slave_nodes
+                         if yarn_util.short_host(s.private_dns_name or '') not in known and
+                         now - _launch_time(s) < self.join_timeout])
+        # a pending application waits for its AM container, which containersPending counts
+        return {'pending': metrics.get('containersPending', 0),
+                'allocated': metrics['containersAllocated'],
+                'nodes': nodes, 'launching': launching, 'metrics': metrics}
+
+    def add(self, count):
+        self.launch(count)
+        self.changed()
+
+    def remove(self, hosts):
+        slaves = [self.slaves[yarn_util.short_host(h)] for h in hosts]
+        yarn_util.decommission_slaves(self.conn, self.opts, self.master, slaves,
+                                      self.decommission_timeout)
+        self.changed()
+
+
+def load_trace(fname):
+    """
+    Load a demand trace, json lines with the time in seconds and the demand
+    in containers, as recorded by Autoscaler. Returns the sorted list of
+    (seconds since the start, demand).
+    """
+    points = []
+    with open(fname) as fi:
+        for line in fi:
+            if line.strip():
+                rec = json.loads(line)
+                points.append((float(rec['time']), int(rec['demand'])))
+    points.sort()
+    if not points:
+        raise ValueError('empty trace %s' % fname)
+    return [(t - points[0][0], d) for t, d in points]
+
+class SimulatedCluster(object):
+    """
+    Stand-in for the ResourceManager and EC2 that replays a demand trace.
+
+    New slaves join boot_time seconds after they are added. The demand is
+    packed onto the oldest slaves first, what does not fit is pending.
+    Removed slaves stop running and costing immediately.
+    """
+    def __init__(self, trace, containers_per_slave, slaves=0, boot_time=300):
+        self.trace = trace
+        self.containers_per_slave = containers_per_slave
+        self.boot_time = boot_time
+        self.now = 0.0
+        self.next_id = 0
+        self.nodes = []
+        self.launching = []
+        self.demand = 0
+        self.assigned = {}
+        self.node_seconds = 0.0
+        self.pending_seconds = 0.0
+        self.peak_slaves = 0
+        self.actions = 0
+        for i in range(slaves):
+            self.nodes.append(self._new_host())
+        self._assign()
+
+    def _new_host(self):
+        self.next_id += 1
+        return 'sim-slave-%d' % self.next_id
+
+    def _demand_at(self, now):
+        demand = 0
+        for t, d in self.trace:
+            if t > now:
+                break
+            demand = d
+        return demand
+
+    def _assign(self):
+        left = self.demand
+        self.assigned = {}
+        for host in self.nodes:
+            self.assigned[host] = min(left, self.containers_per_slave)
+            left -= self.assigned[host]
+        self.pending = left
+
+    def advance(self, now):
+        dt = now - self.now
+        self.node_seconds += dt * (len(self.nodes) + len(self.launching))
+        self.pending_seconds += dt * self.pending
+        self.now = now
+        for ready, host in list(self.launching):
+            if ready <= now:
+                self.launching.remove((ready, host))
+                self.nodes.append(host)
+        self.demand = self._demand_at(now)
+        self._assign()
+        self.peak_slaves = max(self.peak_slaves, len(self.nodes) + len(self.launching))
+
+    def observe(self):
+        return {'pending': self.pending, 'allocated': self.demand - self.pending,
+                'nodes': dict(self.assigned), 'launching': len(self.launching),
+                'metrics': None}
+
+    def add(self, count):
+        self.actions += 1
+        for i in range(count):
+            self.launching.append((self.now + self.boot_time, self._new_host()))
+
+    def remove(self, hosts):
+        self.actions += 1
+        for host in hosts:
+            self.nodes.remove(host)
+        self._assign()
+
+def simulate(policy, trace, containers_per_slave, slaves=0, boot_time=300,
+             interval=30, out=None):
+    """
+    Replay trace against a SimulatedCluster scaled by policy.
+
+    Returns a dict with the slave hours used, the container hours spent
+    pending, the peak number of slaves and the number of scaling actions.
+    """
+    cluster = SimulatedCluster(trace, containers_per_slave, slaves, boot_time)
+    scaler = Autoscaler(policy, cluster, interval, out=out)
+    end = trace[-1][0] + interval
+    now = 0.0
+    while now <= end:
+        cluster.advance(now)
+        scaler.step(now)
+        now += interval
+    return {'slave_hours': cluster.node_seconds / 3600.0,
+            'pending_container_hours': cluster.pending_seconds / 3600.0,
+            'peak_slaves': cluster.peak_slaves,
+            'actions': cluster.actions}
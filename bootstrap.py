@@ -8,13 +8,21 @@ Installing minimum dependencies
 """
 import sys
 import os
+import calendar
 import logging
+import hashlib
 import subprocess
+import json
+import re
+import urllib2
 import xml.etree.ElementTree as ElementTree
-import xml.dom.minidom as minidom
+from xml.sax.saxutils import escape as xml_escape
 import socket
+import threading
 import time
 import pwd
+import shutil
+import signal
 
 ###---------------------------------------------------##
 #  Configuration Section, will be modified by script  #
@@ -44,6 +52,58 @@ master_r_packages = [
 # download link of hadoop.
 hadoop_url = 'http://apache.claz.org/hadoop/common/hadoop-2.8.0/hadoop-2.8.0.tar.gz'
 hadoop_dir = 'hadoop-2.8.0'
+# download link of the jdk.
+jdk_url = 'http://download.oracle.com/otn-pub/java/jdk/8u131-b11/d54c1d3a095b4ff2b6607d096fa80163/jdk-8u131-linux-x64.tar.gz'
+jdk_dir = 'jdk1.8.0_131'
+# download link of zookeeper, run on the masters of a high availability cluster.
+zookeeper_url = 'http://apache.claz.org/zookeeper/zookeeper-3.4.10/zookeeper-3.4.10.tar.gz'
+zookeeper_dir = 'zookeeper-3.4.10'
+
+# container sizing profiles, see compute_sizing
+#  container_vcores: vcores of a container, 0 for one container per node
+#  heap_fraction: part of the container memory given to the jvm heap
+#  min_overhead_mb: memory kept outside of the heap at least
+#  reduce_factor, am_factor: reducer and application master size in containers
+sizing_profiles = {
+    'mapreduce': {'container_vcores': 1, 'heap_fraction': 0.8, 'min_overhead_mb': 0,
+                  'reduce_factor': 2, 'am_factor': 2},
+    'spark': {'container_vcores': 4, 'heap_fraction': 0.9, 'min_overhead_mb': 384,
+              'reduce_factor': 1, 'am_factor': 0.25},
+    'ml': {'container_vcores': 4, 'heap_fraction': 0.6, 'min_overhead_mb': 1024,
+           'reduce_factor': 1, 'am_factor': 0.25},
+    'memory-heavy': {'container_vcores': 0, 'heap_fraction': 0.85, 'min_overhead_mb': 1024,
+                     'reduce_factor': 1, 'am_factor': 0.125}
+}
+# granularity of container memory, containers are multiples of it
+alloc_unit_mb = 256
+# vcores kept for the resource manager and namenode on the master
+master_reserved_vcores = 2
+
+# format the local disks concurrently, with lazy initialization of inode tables and journal
+disk_parallel_format = True
+disk_mkfs_opts = '-m 0 -E lazy_itable_init=1,lazy_journal_init=1'
+disk_mount_opts = 'noatime,nodiratime'
+# MB written to each disk at startup to measure its throughput, 0 to skip
+disk_benchmark_mb = 256
+
+# the master downloads the tarballs once and serves them to the slaves on this port,
+# slaves only go to the download links above when the master does not have them.
+# it is outside the port ranges the master group opens to the internet, the slaves
+# reach it through the rule of their own group.
+artifact_port = 7070
+artifact_dir = 'artifacts'
+
+# seconds between two polls of the spot interruption notice on spot slaves
+spot_watch_interval = 5
+# seconds the containers of a slave with a spot interruption notice get to finish,
+# the instance is reclaimed two minutes after the notice
+spot_decommission_timeout = 90
+# seconds before the instance is reclaimed that its nodemanager is stopped, so that
+# the containers left are rescheduled at once rather than after the liveness timeout
+spot_nm_stop_margin = 10
+
+# seconds the masters of a high availability cluster wait to learn the host names of each other
+masters_wait_timeout = 900
 
 # customized installation script.
 # See optional installation scripts for options.
@@ -52,6 +112,10 @@ def custom_master_install():
     #install_r()
     pass
 
+# apt repositories the customized installations need, they are added
+# before the package lists are updated, so that apt updates them once.
+apt_repositories = ['ppa:ubuntu-toolchain-r/test']
+
 # customized installation script for all nodes.
 def custom_all_nodes_install():
     install_gcc()
@@ -63,6 +127,13 @@ def custom_all_nodes_install():
 USER_NAME = 'ubuntu'
 # setup variables
 MASTER = os.getenv('MY_MASTER_DNS', '')
+# host names of all the masters, in order, when the cluster has more than one
+MASTERS = []
+# number of masters launched together, the ones of a high availability cluster
+# learn the host names of each other from MASTERS_FILE
+NUM_MASTERS = 1
+# whether the masters also run the namenode in high availability, not only the resource manager
+NAMENODE_HA = False
 # node type the type of current node
 NODE_TYPE = os.getenv('MY_NODE_TYPE', 'm3.xlarge')
 NODE_VMEM = int(os.getenv('MY_NODE_VMEM', str(1024*15)))
@@ -71,8 +142,23 @@ AWS_ID = os.getenv('AWS_ACCESS_KEY_ID', 'undefined')
 AWS_KEY = os.getenv('AWS_SECRET_ACCESS_KEY', 'undefined')
 JAVA_HOME = os.getenv('JAVA_HOME')
 HADOOP_HOME = os.getenv('HADOOP_HOME')
-DISK_LIST = [('xvd' + chr(ord('b') + i)) for i in range(10)]
+DISK_LIST = [('xvd' + chr(ord('b') + i)) for i in range(24)]
+# how the local disks are used: 'jbod' mounts each disk separately,
+# 'raid0' stripes them into a single volume
+DISK_LAYOUT = 'jbod'
+# container sizing profile of the cluster, a key of sizing_profiles
+SIZING_PROFILE = 'mapreduce'
 ENVIRON = os.environ.copy()
+# stop the bootstrap at the first failed command instead of logging and going on
+FAIL_FAST = False
+# identifier of the launch request this node belongs to, used to group timing reports
+LAUNCH_ID = ''
+# only install the software and stop the machine, to make an image of it (bake-ami)
+BAKE_IMAGE = False
+# phases of the bootstrap as (name, start time, end time)
+TIMELINE = []
+# can point to a fake metadata endpoint for testing
+METADATA_URL = os.getenv('YARN_EC2_METADATA_URL', 'http://169.254.169.254/latest/meta-data')
 
 ###--------------------------------##
 #  Optional installation scripts.  #
@@ -80,9 +166,8 @@ ENVIRON = os.environ.copy()
 def install_r():
     if master_r_packages:
         sudo("apt-key adv --keyserver keyserver.ubuntu.com --recv-keys E084DAB9")
-        sudo("echo deb https://cran.r-project.org/bin/linux/ubuntu trusty/ >>/etc/apt/sources.list")
-        sudo('apt-get -y update')
-        sudo('apt-get -y install %s' % (' '.join(master_r_packages)))
+        add_apt_repository("'deb https://cran.r-project.org/bin/linux/ubuntu trusty/'")
+        install_packages(master_r_packages)
 
 
 def install_spark():
@@ -98,191 +183,644 @@ def install_xgboost():
     run('cd xgboost; cp make/config.mk .; echo USE_S3=1 >> config.mk; make -j4')
 
 ### Script section ###
-def run(cmd):
+class CommandError(Exception):
+    pass
+
+def run_once(cmd, timeout=None):
+    print cmd
+    tstart = time.time()
+    logging.info('Command %s starts' % cmd)
+    proc = subprocess.Popen(cmd, shell=True, env = ENVIRON,
+                            stdout=subprocess.PIPE, stderr = subprocess.STDOUT,
+                            preexec_fn=os.setsid)
+    timer = None
+    if timeout is not None:
+        # kill the whole process group, the shell may have spawned children
+        def kill():
+            try:
+                os.killpg(proc.pid, signal.SIGKILL)
+            except OSError:
+                pass
+        timer = threading.Timer(timeout, kill)
+        timer.start()
+    for line in iter(proc.stdout.readline, ''):
+        sys.stdout.write(line)
+        logging.info('| %s' % line.rstrip())
+    retcode = proc.wait()
+    if timer is not None:
+        timer.cancel()
+    tend = time.time()
+    msg = ('Command %s exits with %d, start=%.3f end=%.3f elapsed=%g secs' %
+           (cmd, retcode, tstart, tend, tend - tstart))
+    if retcode != 0:
+        logging.error(msg)
+    else:
+        logging.info(msg)
+    return retcode
+
+def run(cmd, timeout=None, retries=0, check=True):
+    """
+    run a shell command, streaming its output to the log line by line
+
+    Parameters
+    ----------
+    cmd: the shell command
+    timeout: seconds after which the command is killed, None for no limit
+    retries: number of times a failed command is tried again
+    check: whether a failure stops the bootstrap in fail fast mode
+
+    Returns the exit code of the last try
+    """
+    for tries in range(retries + 1):
+        try:
+            retcode = run_once(cmd, timeout)
+        except Exception as e:
+            print(str(e))
+            logging.error('Exception running: %s' % cmd)
+            logging.error(str(e))
+            retcode = -1
+        if retcode == 0:
+            break
+        if tries < retries:
+            time.sleep(2 ** tries)
+            logging.info('Retrying command %s' % cmd)
+    if retcode != 0 and check and FAIL_FAST:
+        raise CommandError('Command %s returns %d' % (cmd, retcode))
+    return retcode
+
+def sudo(cmd, timeout=None, retries=0):
+    return run('sudo %s' % cmd, timeout, retries)
+
+def record_phase(name, tstart, tend):
+    TIMELINE.append((name, tstart, tend))
+    logging.info('phase %s finishes in %g secs' % (name, tend - tstart))
+
+def get_metadata(path, default=''):
     try:
-        print cmd
-        logging.info(cmd)
-        proc = subprocess.Popen(cmd, shell=True, env = ENVIRON,
-                                stdout=subprocess.PIPE, stderr = subprocess.PIPE)
-        out, err = proc.communicate()
-        retcode = proc.poll()
-        if retcode != 0:
-            logging.error('Command %s returns %d' % (cmd,retcode))
-            logging.error(out)
-            logging.error(err)
-        else:
-            print out
-    except Exception as e:
-        print(str(e))
-        logging.error('Exception running: %s' % cmd)
-        logging.error(str(e))
-        pass
+        return urllib2.urlopen('%s/%s' % (METADATA_URL, path), timeout=2).read()
+    except Exception:
+        return default
+
+def boot_offset():
+    """
+    seconds since the machine booted, so that the timeline covers the time before bootstrap
+    """
+    try:
+        return float(open('/proc/uptime').read().split()[0])
+    except Exception:
+        return 0.0
+
+def timeline_report(is_master, tstart, offset):
+    """
+    machine readable timing report of the bootstrap of this node
+    """
+    phases = [{'name': name, 'start': t0 - tstart, 'end': t1 - tstart}
+              for name, t0, t1 in sorted(TIMELINE, key=lambda x: x[1])]
+    join = [p['end'] for p in phases if p['name'] == 'start-daemons']
+    return {
+        'host': socket.getfqdn(),
+        'instance_id': get_metadata('instance-id'),
+        'instance_type': NODE_TYPE,
+        'launch_id': LAUNCH_ID,
+        'role': 'master' if is_master else 'slave',
+        'start': tstart,
+        'boot_offset': offset,
+        'phases': phases,
+        'time_to_join': offset + join[0] if join else None,
+        'disk_layout': DISK_LAYOUT,
+        'disk_count': len(get_devices()),
+        'disk_write_mb_s': disk_throughput(),
+        'baked_image': baked_image()
+    }
+
+def report_timeline(report):
+    """
+    write the timing report locally and into the master's hdfs, where yarn_ec2.py stats reads it
+    """
+    with open('bootstrap_timeline.json', 'w') as fo:
+        fo.write(json.dumps(report) + '\n')
+    hadoop = '%s/bin/hadoop fs' % HADOOP_HOME
+    run('%s -mkdir -p /yarn-ec2/stats && %s -put -f bootstrap_timeline.json /yarn-ec2/stats/%s.json'
+        % (hadoop, hadoop, report['host']), retries=3, check=False)
+
+def run_steps(steps):
+    """
+    run installation steps as a dependency graph,
+    each step starts in its own thread once the steps it depends on finished.
 
-def sudo(cmd):
-    run('sudo %s' % cmd)
+    Parameters
+    ----------
+    steps: list of (name, dependencies, function)
+
+    Returns the dict of step name to the return value of its function
+    """
+    done = dict((name, threading.Event()) for name, _, _ in steps)
+    results = {}
+    failed = []
+    def worker(name, deps, func):
+        for d in deps:
+            done[d].wait()
+        tstart = time.time()
+        try:
+            if FAIL_FAST and any(d in failed for d in deps):
+                raise CommandError('dependency failed')
+            results[name] = func()
+        except Exception as e:
+            failed.append(name)
+            logging.error('step %s failed: %s' % (name, str(e)))
+        record_phase(name, tstart, time.time())
+        done[name].set()
+    threads = [threading.Thread(target=worker, args=step) for step in steps]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    if failed and FAIL_FAST:
+        raise CommandError('steps failed: %s' % ', '.join(failed))
+    return results
 
 ### Installation helpers ###
+# apt runs one at a time, and the package lists are only
+# updated again when the sources changed since the last update.
+APT_LOCK = threading.RLock()
+APT_UPDATED = [False]
+APT_REPOSITORIES = set()
+
+def apt_update():
+    with APT_LOCK:
+        if not APT_UPDATED[0]:
+            sudo('apt-get -y update', retries=2)
+            APT_UPDATED[0] = True
+
+def add_apt_repository(repo):
+    with APT_LOCK:
+        if repo in APT_REPOSITORIES:
+            return
+        sudo('add-apt-repository -y %s' % repo)
+        APT_REPOSITORIES.add(repo)
+        APT_UPDATED[0] = False
+
+def add_apt_repositories(repos):
+    for repo in repos:
+        add_apt_repository(repo)
+
 def install_packages(pkgs):
-    sudo('apt-get -y update')
-    sudo('apt-get -y install %s' % (' '.join(pkgs)))
+    with APT_LOCK:
+        apt_update()
+        sudo('apt-get -y install %s' % (' '.join(pkgs)), retries=2)
 
 # install g++4.9, needed for regex match.
 def install_gcc():
-    sudo('add-apt-repository -y ppa:ubuntu-toolchain-r/test')
-    sudo('apt-get -y update')
-    sudo('apt-get -y install g++-4.9')
+    add_apt_repository('ppa:ubuntu-toolchain-r/test')
+    install_packages(['g++-4.9'])
+
+def file_checksum(fname):
+    sha = hashlib.sha256()
+    with open(fname, 'rb') as fi:
+        for chunk in iter(lambda: fi.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def fetch_artifact(url, fname, mirror, wget_opts=''):
+    """
+    download an artifact into the artifact directory and checksum it
 
-def install_java():
+    Parameters
+    ----------
+    url: the upstream download link
+    fname: the name of the artifact
+    mirror: the url of the master's artifact server, None on the master
+    wget_opts: extra options to pass to wget for the upstream link
+
+    Returns the path of the downloaded file
+    """
+    if not os.path.isdir(artifact_dir):
+        os.makedirs(artifact_dir)
+    path = os.path.join(artifact_dir, fname)
+    if mirror is not None:
+        # the checksum is published last, so a missing one means a miss
+        if (run('wget -q -T 10 -O %s.sha256 %s/%s.sha256' % (path, mirror, fname),
+                check=False) == 0 and
+            run('wget -q -T 10 -O %s %s/%s' % (path, mirror, fname),
+                timeout=600, check=False) == 0 and
+            open(path + '.sha256').read().strip() == file_checksum(path)):
+            logging.info('fetched %s from %s' % (fname, mirror))
+            return path
+        logging.info('%s is not available from %s, using %s' % (fname, mirror, url))
+        run('rm -f %s %s.sha256' % (path, path))
+    if run('wget %s -O %s.part %s' % (wget_opts, path, url), timeout=1800, retries=2) != 0:
+        run('rm -f %s.part' % path)
+        raise IOError('failed to download %s' % url)
+    os.rename(path + '.part', path)
+    with open(path + '.sha256.part', 'w') as fo:
+        fo.write(file_checksum(path) + '\n')
+    os.rename(path + '.sha256.part', path + '.sha256')
+    return path
+
+def artifact_mirror(is_master):
+    if is_master or MASTER == '':
+        return None
+    return 'http://%s:%d' % (MASTER, artifact_port)
+
+def artifact_server_cmd():
+    return ('pgrep -f "SimpleHTTPServer %d" > /dev/null || (cd %s && '
+            'nohup python -m SimpleHTTPServer %d > /dev/null 2>&1 &)' %
+            (artifact_port, os.path.abspath(artifact_dir), artifact_port))
+
+def install_tarball(url, fname, is_master, wget_opts=''):
+    path = fetch_artifact(url, fname, artifact_mirror(is_master), wget_opts)
+    run('tar xf %s' % path)
+    # the master keeps the tarballs to serve them to the slaves
+    if not is_master:
+        run('rm -f %s %s.sha256' % (path, path))
+
+def download_java(is_master):
+    if not os.path.exists(jdk_dir):
+        install_tarball(jdk_url, os.path.basename(jdk_url), is_master,
+                        '--no-check-certificate --no-cookies'
+                        ' --header \"Cookie: oraclelicense=accept-securebackup-cookie\"')
+
+def download_hadoop(is_master):
+    if not os.path.exists(hadoop_dir):
+        install_tarball(hadoop_url, os.path.basename(hadoop_url), is_master)
+
+def download_zookeeper(is_master):
+    if not os.path.exists(zookeeper_dir):
+        install_tarball(zookeeper_url, os.path.basename(zookeeper_url), is_master)
+
+def install_java(is_master):
     """
     install java and setup environment variables
     Returns environment variables that needs to be exported
     """
-    if not os.path.exists('jdk1.8.0_131'):
-        run('wget --no-check-certificate --no-cookies'\
-                ' --header \"Cookie: oraclelicense=accept-securebackup-cookie\"'\
-                ' http://download.oracle.com/otn-pub/java/jdk/8u131-b11/d54c1d3a095b4ff2b6607d096fa80163/jdk-8u131-linux-x64.tar.gz')
-        run('tar xf jdk-8u131-linux-x64.tar.gz')
-        run('rm -f jdk-8u131-linux-x64.tar.gz')
+    download_java(is_master)
     global JAVA_HOME
     if JAVA_HOME is None:
-        JAVA_HOME = os.path.abspath('jdk1.8.0_131')
+        JAVA_HOME = os.path.abspath(jdk_dir)
     return [('JAVA_HOME', JAVA_HOME)]
 
 
-def install_hadoop(is_master):
-    def update_site(fname, rmap):
-        """
-        update the site script
-        """
-        try:
-            tree = ElementTree.parse(fname)
-            root = tree.getroot()
-        except Exception:
-            cfg = ElementTree.Element("configuration")
-            tree = ElementTree.ElementTree(cfg)
-            root = tree.getroot()
-        rset = set()
-        for prop in root.getiterator('property'):
-            prop = dict((p.tag, p) for p in prop)
-            name = prop['name'].text.strip()
-            if name in rmap:
-                prop['value'].text = str(rmap[name])
-                rset.add(name)
-        for name, text in rmap.iteritems():
-            if name in rset:
-                continue
-            prop = ElementTree.SubElement(root, 'property')
-            ElementTree.SubElement(prop, 'name').text = name
-            ElementTree.SubElement(prop, 'value').text = str(text)
-        rough_string = ElementTree.tostring(root, 'utf-8')
-        reparsed = minidom.parseString(rough_string)
-        pretty = reparsed.toprettyxml(indent='\t')
-        fo = open(fname, 'w')
-        fo.write(pretty)
-        fo.close()
-
-    def setup_hadoop_site(master, hadoop_dir, hdfs_dir, vcpu, vmem):
-        """
-        setup hadoop side given the parameters
-
-        Parameters
-        ----------
-        master: the dns to master uri
-        hadoop_dir: the directory to store temp files
-        hdfs_dir: the directories for hdfs
-        vcpu: the number of cpus current machine have
-        vmem: the memory(MB) current machine have
-        """
-        if vmem < 4 * 1024:
-            reserved_ram = 256
-        elif vmem < 8 * 1024:
-            reserved_ram = 1 * 1024
-        elif vmem < 24 * 1024 :
-            reserved_ram = 2 * 1024
-        elif vmem < 48 * 1024:
-            reserved_ram = 2 * 1024
-        elif vmem < 64 * 1024:
-            reserved_ram = 6 * 1024
-        else:
-            reserved_ram = 8 * 1024
-        ram_per_container = (vmem - reserved_ram) / vcpu
-
-        if is_master:
-            vcpu = vcpu - 2
-
-        tmp_dir = hadoop_dir[0]
-        core_site = {
-            'fs.defaultFS': 'hdfs://%s:9000/' % master,
-            'fs.s3n.impl': 'org.apache.hadoop.fs.s3native.NativeS3FileSystem',
-            'hadoop.tmp.dir': tmp_dir
-        }
-        if AWS_ID != 'undefined':
-            core_site['fs.s3n.awsAccessKeyId'] = AWS_ID
-            core_site['fs.s3n.awsSecretAccessKey'] = AWS_KEY
-
-        update_site('%s/etc/hadoop/core-site.xml' % HADOOP_HOME, core_site)
-        hdfs_site = {
-            'dfs.data.dir': ','.join(['%s/data' % d for d in hdfs_dir]),
-            'dfs.permissions': 'false',
-            'dfs.replication': '1'
-        }
-        update_site('%s/etc/hadoop/hdfs-site.xml' % HADOOP_HOME, hdfs_site)
-        yarn_site = {
-            'yarn.resourcemanager.resource-tracker.address': '%s:8025' % master,
-            'yarn.resourcemanager.scheduler.address': '%s:8030' % master,
-            'yarn.resourcemanager.address': '%s:8032' % master,
-            'yarn.scheduler.minimum-allocation-mb': 512,
-            'yarn.scheduler.maximum-allocation-mb': 640000,
-            'yarn.scheduler.minimum-allocation-vcores': 1,
-            'yarn.scheduler.maximum-allocation-vcores': 32,
-            'yarn.nodemanager.resource.memory-mb': vcpu * ram_per_container,
-            'yarn.nodemanager.resource.cpu-vcores': vcpu,
-            'yarn.log-aggregation-enable': 'true',
-            'yarn.nodemanager.vmem-check-enabled': 'false',
-            'yarn.nodemanager.aux-services': 'mapreduce_shuffle',
-            'yarn.nodemanager.aux-services.mapreduce.shuffle.class': 'org.apache.hadoop.mapred.ShuffleHandler',
-            'yarn.nodemanager.remote-app-log-dir': os.path.join(tmp_dir, 'logs'),
-            'yarn.nodemanager.log-dirs': os.path.join(tmp_dir, 'userlogs'),
-            'yarn.nodemanager.local-dirs': ','.join(['%s/yarn/nm-local-dir' % d for d in hadoop_dir])
-        }
-        update_site('%s/etc/hadoop/yarn-site.xml' % HADOOP_HOME, yarn_site)
-        mapred_site = {
-            'mapreduce.application.classpath' : ':'.join(['$HADOOP_MAPRED_HOME/share/hadoop/mapreduce/*',
-                                                          '$HADOOP_MAPRED_HOME/share/hadoop/mapreduce/lib/*',
-                                                          '$HADOOP_MAPRED_HOME/share/hadoop/tools/lib/*']),
-            'yarn.app.mapreduce.am.resource.mb': 2 * ram_per_container,
-            'yarn.app.mapreduce.am.command-opts': '-Xmx%dm' % int(0.8 * 2 * ram_per_container),
-            'mapreduce.framework.name': 'yarn',
-            'mapreduce.map.cpu.vcores': 1,
-            'mapreduce.map.memory.mb': ram_per_container,
-            'mapreduce.map.java.opts': '-Xmx%dm' % int(0.8 * ram_per_container),
-            'mapreduce.reduce.cpu.vcores': 1,
-            'mapreduce.reduce.memory.mb': 2 * ram_per_container,
-            'mapreduce.reduce.java.opts': '-Xmx%dm' % int(0.8 * ram_per_container)
-        }
-        update_site('%s/etc/hadoop/mapred-site.xml' % HADOOP_HOME, mapred_site)
-        capacity_site = {
-            'yarn.scheduler.capacity.resource-calculator': 'org.apache.hadoop.yarn.util.resource.DominantResourceCalculator'
-        }
-        update_site('%s/etc/hadoop/capacity-scheduler.xml' % HADOOP_HOME, capacity_site)
-        fo = open('%s/etc/hadoop/hadoop-env.sh' % HADOOP_HOME, 'w')
-        fo.write('export HADOOP_CLASSPATH=$HADOOP_CLASSPATH:$HADOOP_PREFIX/share/hadoop/tools/lib/*\n')
-        fo.write('export HADOOP_LOG_DIR=%s/log\n' % tmp_dir)
-        fo.write('export YARN_LOG_DIR=%s/log\n' % tmp_dir)
-        fo.write('export JAVA_HOME=\"%s\"\n' % JAVA_HOME)
-        fo.close()
-        fo = open('%s/etc/hadoop/slaves' % HADOOP_HOME, 'w')
-        fo.write(master + '\n')
-        fo.close()
+def reserved_ram(vmem):
+    """
+    memory(MB) kept for the os and the hadoop daemons on a node with vmem MB
+    """
+    if vmem < 4 * 1024:
+        return 256
+    elif vmem < 8 * 1024:
+        return 1 * 1024
+    elif vmem < 48 * 1024:
+        return 2 * 1024
+    elif vmem < 64 * 1024:
+        return 6 * 1024
+    else:
+        return 8 * 1024
 
+def compute_sizing(vcpu, vmem, is_master, profile='mapreduce'):
+    """
+    compute the yarn resources and container sizes of a node
+
+    Parameters
+    ----------
+    vcpu: the number of cpus of the node
+    vmem: the memory(MB) of the node
+    is_master: whether the node also runs the master daemons
+    profile: the name of the sizing profile in sizing_profiles
+
+    Returns a dict of the resources in MB and vcores
+    """
+    p = sizing_profiles[profile]
+    def align(mb):
+        return max(alloc_unit_mb, int(mb) / alloc_unit_mb * alloc_unit_mb)
+    def heap(mb):
+        overhead = max(p['min_overhead_mb'], (1 - p['heap_fraction']) * mb)
+        return int(max(mb / 2, mb - overhead))
+    mem_per_vcore = (vmem - reserved_ram(vmem)) / vcpu
+    nm_vcores = vcpu
+    if is_master:
+        nm_vcores = max(1, vcpu - master_reserved_vcores)
+    nm_memory = nm_vcores * mem_per_vcore
+    container_vcores = min(p['container_vcores'] or nm_vcores, nm_vcores)
+    container_mb = min(align(mem_per_vcore * container_vcores), align(nm_memory))
+    reduce_mb = min(align(p['reduce_factor'] * container_mb), align(nm_memory))
+    am_mb = min(max(align(p['am_factor'] * container_mb), 1024), align(nm_memory))
+    return {
+        'profile': profile,
+        'nm_memory_mb': nm_memory,
+        'nm_vcores': nm_vcores,
+        'min_alloc_mb': alloc_unit_mb,
+        'max_container_mb': align(nm_memory),
+        'container_mb': container_mb,
+        'container_vcores': container_vcores,
+        'containers': min(nm_memory / container_mb, nm_vcores / container_vcores),
+        'heap_mb': heap(container_mb),
+        'overhead_mb': container_mb - heap(container_mb),
+        'reduce_mb': reduce_mb,
+        'reduce_heap_mb': heap(reduce_mb),
+        'am_mb': am_mb,
+        'am_heap_mb': heap(am_mb)
+    }
+
+### Hadoop configuration ###
+# network topology script of hadoop, in the configuration directory
+TOPOLOGY_SCRIPT = 'topology.sh'
+# properties of the site files this script manages, kept to drop the ones it no longer sets
+SITE_STATE = 'yarn-ec2-site.json'
+# id of the resource manager cluster and of the hdfs name service of a high availability cluster
+HA_CLUSTER_ID = 'yarn-ec2'
+ZOOKEEPER_PORT = 2181
+JOURNALNODE_PORT = 8485
+
+def zookeeper_quorum(masters):
+    return ','.join('%s:%d' % (m, ZOOKEEPER_PORT) for m in masters)
+
+def resourcemanager_ha_config(masters):
+    """
+    yarn-site properties running a resource manager on each of the masters, with
+    automatic failover through zookeeper and the state of the applications kept in it
+    """
+    rm_ids = ['rm%d' % (i + 1) for i in range(len(masters))]
+    props = {
+        'yarn.resourcemanager.ha.enabled': True,
+        'yarn.resourcemanager.cluster-id': HA_CLUSTER_ID,
+        'yarn.resourcemanager.ha.rm-ids': rm_ids,
+        'yarn.resourcemanager.recovery.enabled': True,
+        'yarn.resourcemanager.store.class':
+            'org.apache.hadoop.yarn.server.resourcemanager.recovery.ZKRMStateStore',
+        'yarn.resourcemanager.zk-address': zookeeper_quorum(masters)
+    }
+    for rm_id, host in zip(rm_ids, masters):
+        props['yarn.resourcemanager.hostname.%s' % rm_id] = host
+        props['yarn.resourcemanager.resource-tracker.address.%s' % rm_id] = '%s:8025' % host
+        props['yarn.resourcemanager.scheduler.address.%s' % rm_id] = '%s:8030' % host
+        props['yarn.resourcemanager.address.%s' % rm_id] = '%s:8032' % host
+        props['yarn.resourcemanager.webapp.address.%s' % rm_id] = '%s:8088' % host
+    return props
+
+def namenode_ha_config(masters, hdfs_dir):
+    """
+    hdfs-site properties running an active and a standby namenode on the first two masters,
+    sharing their edits through journal nodes on all the masters
+    """
+    ns = HA_CLUSTER_ID
+    props = {
+        'dfs.nameservices': ns,
+        'dfs.ha.namenodes.%s' % ns: ['nn1', 'nn2'],
+        'dfs.namenode.shared.edits.dir': 'qjournal://%s/%s' % (
+            ';'.join('%s:%d' % (m, JOURNALNODE_PORT) for m in masters), ns),
+        'dfs.journalnode.edits.dir': '%s/journal' % hdfs_dir[0],
+        'dfs.client.failover.proxy.provider.%s' % ns:
+            'org.apache.hadoop.hdfs.server.namenode.ha.ConfiguredFailoverProxyProvider',
+        'dfs.ha.automatic-failover.enabled': True,
+        # the journal nodes only accept the edits of one namenode, no need to kill the other
+        'dfs.ha.fencing.methods': 'shell(/bin/true)'
+    }
+    for nn_id, host in zip(['nn1', 'nn2'], masters):
+        props['dfs.namenode.rpc-address.%s.%s' % (ns, nn_id)] = '%s:9000' % host
+        props['dfs.namenode.http-address.%s.%s' % (ns, nn_id)] = '%s:50070' % host
+    return props
+
+def hadoop_config(master, hadoop_dir, hdfs_dir, sizing, masters=None, namenode_ha=False):
+    """
+    the hadoop configuration of a node, as a dict of site file name to its properties;
+    values can be strings, numbers, booleans or lists, see format_value
+
+    Parameters
+    ----------
+    master: the dns to master uri
+    hadoop_dir: the directories to store temp files
+    hdfs_dir: the directories for hdfs
+    sizing: the container sizing, see compute_sizing
+    masters: the host names of all the masters when there is more than one,
+        for the high availability setup of the resource manager
+    namenode_ha: whether the namenode is highly available too, needs masters
+    """
+    ha = masters is not None and len(masters) > 1
+    tmp_dir = hadoop_dir[0]
+    core_site = {
+        'fs.defaultFS': 'hdfs://%s:9000/' % master,
+        'fs.s3n.impl': 'org.apache.hadoop.fs.s3native.NativeS3FileSystem',
+        'hadoop.tmp.dir': tmp_dir,
+        # racks are availability zones, see topology
+        'net.topology.script.file.name': '%s/etc/hadoop/%s' % (HADOOP_HOME, TOPOLOGY_SCRIPT)
+    }
+    if AWS_ID != 'undefined':
+        core_site['fs.s3n.awsAccessKeyId'] = AWS_ID
+        core_site['fs.s3n.awsSecretAccessKey'] = AWS_KEY
+    hdfs_site = {
+        'dfs.data.dir': ['%s/data' % d for d in hdfs_dir],
+        'dfs.permissions': False,
+        'dfs.replication': 1
+    }
+    yarn_site = {
+        'yarn.resourcemanager.resource-tracker.address': '%s:8025' % master,
+        'yarn.resourcemanager.scheduler.address': '%s:8030' % master,
+        'yarn.resourcemanager.address': '%s:8032' % master,
+        'yarn.resourcemanager.nodes.exclude-path': '%s/etc/hadoop/yarn.exclude' % HADOOP_HOME,
+        'yarn.scheduler.minimum-allocation-mb': sizing['min_alloc_mb'],
+        'yarn.scheduler.maximum-allocation-mb': 640000,
+        'yarn.scheduler.minimum-allocation-vcores': 1,
+        'yarn.scheduler.maximum-allocation-vcores': 32,
+        'yarn.nodemanager.resource.memory-mb': sizing['nm_memory_mb'],
+        'yarn.nodemanager.resource.cpu-vcores': sizing['nm_vcores'],
+        'yarn.log-aggregation-enable': True,
+        'yarn.nodemanager.vmem-check-enabled': False,
+        'yarn.nodemanager.aux-services': 'mapreduce_shuffle',
+        'yarn.nodemanager.aux-services.mapreduce.shuffle.class': 'org.apache.hadoop.mapred.ShuffleHandler',
+        'yarn.nodemanager.remote-app-log-dir': os.path.join(tmp_dir, 'logs'),
+        'yarn.nodemanager.log-dirs': os.path.join(tmp_dir, 'userlogs'),
+        'yarn.nodemanager.local-dirs': ['%s/yarn/nm-local-dir' % d for d in hadoop_dir]
+    }
+    mapred_site = {
+        'mapreduce.application.classpath': ':'.join(['$HADOOP_MAPRED_HOME/share/hadoop/mapreduce/*',
+                                                     '$HADOOP_MAPRED_HOME/share/hadoop/mapreduce/lib/*',
+                                                     '$HADOOP_MAPRED_HOME/share/hadoop/tools/lib/*']),
+        'yarn.app.mapreduce.am.resource.mb': sizing['am_mb'],
+        'yarn.app.mapreduce.am.command-opts': '-Xmx%dm' % sizing['am_heap_mb'],
+        'mapreduce.framework.name': 'yarn',
+        'mapreduce.map.cpu.vcores': sizing['container_vcores'],
+        'mapreduce.map.memory.mb': sizing['container_mb'],
+        'mapreduce.map.java.opts': '-Xmx%dm' % sizing['heap_mb'],
+        'mapreduce.reduce.cpu.vcores': sizing['container_vcores'],
+        'mapreduce.reduce.memory.mb': sizing['reduce_mb'],
+        'mapreduce.reduce.java.opts': '-Xmx%dm' % sizing['reduce_heap_mb']
+    }
+    capacity_site = {
+        'yarn.scheduler.capacity.resource-calculator': 'org.apache.hadoop.yarn.util.resource.DominantResourceCalculator'
+    }
+    if ha:
+        for prop in ['resource-tracker.address', 'scheduler.address', 'address']:
+            del yarn_site['yarn.resourcemanager.%s' % prop]
+        yarn_site.update(resourcemanager_ha_config(masters))
+    if ha and namenode_ha:
+        core_site['fs.defaultFS'] = 'hdfs://%s' % HA_CLUSTER_ID
+        core_site['ha.zookeeper.quorum'] = zookeeper_quorum(masters)
+        hdfs_site.update(namenode_ha_config(masters, hdfs_dir))
+    elif ha:
+        core_site['fs.defaultFS'] = 'hdfs://%s:9000/' % masters[0]
+    return {'core-site.xml': core_site,
+            'hdfs-site.xml': hdfs_site,
+            'yarn-site.xml': yarn_site,
+            'mapred-site.xml': mapred_site,
+            'capacity-scheduler.xml': capacity_site}
+
+def format_value(value):
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (list, tuple)):
+        return ','.join(format_value(v) for v in value)
+    return str(value)
+
+def read_site(fname):
+    """
+    properties of a site file as a list of (name, value), empty if it does not exist
+    """
+    try:
+        root = ElementTree.parse(fname).getroot()
+    except (IOError, ElementTree.ParseError):
+        return []
+    props = []
+    for prop in root.iter('property'):
+        name = prop.findtext('name')
+        if name:
+            props.append((name.strip(), (prop.findtext('value') or '').strip()))
+    return props
+
+def render_site(props):
+    lines = ['<?xml version="1.0" encoding="utf-8"?>', '<configuration>']
+    for name, value in props:
+        lines += ['\t<property>',
+                  '\t\t<name>%s</name>' % xml_escape(name),
+                  '\t\t<value>%s</value>' % xml_escape(value),
+                  '\t</property>']
+    lines.append('</configuration>')
+    return '\n'.join(lines) + '\n'
+
+def write_if_changed(fname, content):
+    """
+    atomically replace the content of fname, unless it has this content already
+
+    Returns whether the file was written
+    """
+    if os.path.exists(fname) and file_checksum(fname) == hashlib.sha256(content).hexdigest():
+        return False
+    tmp = '%s.%d.tmp' % (fname, os.getpid())
+    with open(tmp, 'w') as fo:
+        fo.write(content)
+    os.rename(tmp, fname)
+    return True
+
+def apply_site_config(conf_dir, config):
+    """
+    render the site files of config into conf_dir, keeping the properties of the
+    existing files that the config does not set, and writing only the files that change
+
+    Returns the changes as a list of (file, property, old value, new value),
+    with None for a value that is not set
+    """
+    state_file = os.path.join(conf_dir, SITE_STATE)
+    try:
+        with open(state_file) as fi:
+            managed = json.load(fi)
+    except (IOError, ValueError):
+        managed = {}
+    changes = []
+    for fname, props in sorted(config.items()):
+        path = os.path.join(conf_dir, fname)
+        old = read_site(path)
+        dropped = set(managed.get(fname, [])) - set(props)
+        new = ([(k, v) for k, v in old if k not in props and k not in dropped] +
+               [(k, format_value(v)) for k, v in sorted(props.items())])
+        old_map, new_map = dict(old), dict(new)
+        for k in sorted(set(old_map) | set(new_map)):
+            if old_map.get(k) != new_map.get(k):
+                changes.append((fname, k, old_map.get(k), new_map.get(k)))
+        if write_if_changed(path, render_site(new)):
+            logging.info('wrote %s' % path)
+        managed[fname] = sorted(props)
+    write_if_changed(state_file, json.dumps(managed, indent=2, sort_keys=True))
+    for fname, k, old, new in changes:
+        logging.info('%s: %s %s -> %s' % (fname, k, old, new))
+    return changes
+
+def setup_hadoop_site(is_master, master, hadoop_dir, hdfs_dir, vcpu, vmem):
+    """
+    setup hadoop side given the parameters
+
+    Parameters
+    ----------
+    is_master: whether this node is the master
+    master: the dns to master uri
+    hadoop_dir: the directory to store temp files
+    hdfs_dir: the directories for hdfs
+    vcpu: the number of cpus current machine have
+    vmem: the memory(MB) current machine have
+
+    Returns the property changes, see apply_site_config,
+    and the names of the other configuration files that changed
+    """
+    sizing = compute_sizing(vcpu, vmem, is_master, SIZING_PROFILE)
+    conf_dir = '%s/etc/hadoop' % HADOOP_HOME
+    changes = apply_site_config(conf_dir, hadoop_config(master, hadoop_dir, hdfs_dir, sizing,
+                                                        MASTERS, NAMENODE_HA))
+    # hosts being decommissioned, see yarn_util.py
+    open('%s/yarn.exclude' % conf_dir, 'a').close()
+    # for the launchers of non mapreduce jobs, e.g. spark executor sizes
+    write_if_changed('%s/yarn-ec2-sizing.json' % conf_dir,
+                     json.dumps(sizing, indent=2, sort_keys=True))
+    tmp_dir = hadoop_dir[0]
+    files = {
+        'hadoop-env.sh': ''.join([
+            'export HADOOP_CLASSPATH=$HADOOP_CLASSPATH:$HADOOP_PREFIX/share/hadoop/tools/lib/*\n',
+            'export HADOOP_LOG_DIR=%s/log\n' % tmp_dir,
+            'export YARN_LOG_DIR=%s/log\n' % tmp_dir,
+            'export JAVA_HOME=\"%s\"\n' % JAVA_HOME]),
+        'slaves': master + '\n',
+        TOPOLOGY_SCRIPT: '#!/bin/bash\nexec python %s topology "$@"\n' %
+                         os.path.abspath(BOOTSTRAP_COPY)
+    }
+    written = [f for f, content in sorted(files.items())
+               if write_if_changed('%s/%s' % (conf_dir, f), content)]
+    os.chmod('%s/%s' % (conf_dir, TOPOLOGY_SCRIPT), 0755)
+    if is_master and len(MASTERS) > 1 and setup_zookeeper(MASTERS):
+        written.append('zoo.cfg')
+    return changes, written
+
+# zookeeper keeps its data on the root volume, the data disks are formatted by startup.sh
+ZOOKEEPER_DATA = 'zookeeper-data'
+
+def zookeeper_config(masters, data_dir):
+    """
+    zoo.cfg of an ensemble running on the masters
+    """
+    lines = ['tickTime=2000',
+             'initLimit=10',
+             'syncLimit=5',
+             'dataDir=%s' % data_dir,
+             'clientPort=%d' % ZOOKEEPER_PORT,
+             'autopurge.snapRetainCount=3',
+             'autopurge.purgeInterval=24']
+    lines += ['server.%d=%s:2888:3888' % (i + 1, m) for i, m in enumerate(masters)]
+    return '\n'.join(lines) + '\n'
+
+def setup_zookeeper(masters):
+    """
+    write the zookeeper configuration and the id of this master in the ensemble
+
+    Returns whether the configuration changed
+    """
+    data_dir = os.path.abspath(ZOOKEEPER_DATA)
+    if not os.path.isdir(data_dir):
+        os.makedirs(data_dir)
+    write_if_changed('%s/myid' % data_dir, '%d\n' % (master_index() + 1))
+    return write_if_changed('%s/conf/zoo.cfg' % os.path.abspath(zookeeper_dir),
+                            zookeeper_config(masters, data_dir))
+
+def install_hadoop(is_master):
     def run_install():
-        if not os.path.exists('hadoop-2.8.0'):
-            run('wget %s' % hadoop_url)
-            run('tar xf hadoop-2.8.0.tar.gz')
-            run('rm -f hadoop-2.8.0.tar.gz')
-            global HADOOP_HOME
+        download_hadoop(is_master)
+        global HADOOP_HOME
         if HADOOP_HOME is None:
-            HADOOP_HOME = os.path.abspath('hadoop-2.8.0')
+            HADOOP_HOME = os.path.abspath(hadoop_dir)
         env = [('HADOOP_HOME', HADOOP_HOME)]
         env += [('HADOOP_PREFIX', HADOOP_HOME)]
         env += [('HADOOP_MAPRED_HOME', HADOOP_HOME)]
@@ -291,8 +829,8 @@ def install_hadoop(is_master):
         env += [('YARN_HOME', HADOOP_HOME)]
         env += [('YARN_CONF_DIR', '%s/etc/hadoop' % HADOOP_HOME)]
         env += [('HADOOP_CONF_DIR', '%s/etc/hadoop' % HADOOP_HOME)]
-        disks = ['/disk/%s' % d for d in DISK_LIST if os.path.exists('/dev/%s' % d)]
-        setup_hadoop_site(MASTER,
+        disks = get_data_disks()
+        setup_hadoop_site(is_master, MASTER,
                           ['%s/hadoop' % d for d in disks],
                           ['%s/hadoop/dfs' % d for d in disks],
                           NODE_VCPU, NODE_VMEM)
@@ -302,22 +840,79 @@ def install_hadoop(is_master):
 
 def regsshkey(fname):
     for dns in (open(fname).readlines() + ['localhost', '0.0.0.0']):
-        try:
-            run('ssh-keygen -R %s' % dns.strip())
-        except:
-            pass
+        run('ssh-keygen -R %s' % dns.strip(), check=False)
         run('ssh-keyscan %s >> ~/.ssh/known_hosts' % dns.strip())
 
+# written in images made by bake-ami, with the versions installed in them
+BAKED_MARKER = '.yarn-ec2-baked'
+
+def baked_image():
+    """
+    whether this node runs from an image baked with the current hadoop and jdk
+    """
+    try:
+        with open(BAKED_MARKER) as fi:
+            marker = json.load(fi)
+    except (IOError, ValueError):
+        return False
+    return (marker.get('hadoop_dir') == hadoop_dir and marker.get('jdk_dir') == jdk_dir and
+            os.path.exists(hadoop_dir) and os.path.exists(jdk_dir))
+
+def bake_image():
+    """
+    install everything that does not depend on the cluster, then stop the
+    machine so that bake-ami makes an image of it
+    """
+    pkgs = master_apt_packages + node_apt_packages + ['mdadm']
+    run_steps([
+        ('apt-repositories', [], lambda: add_apt_repositories(apt_repositories)),
+        ('apt', ['apt-repositories'], lambda: install_packages(pkgs)),
+        ('jdk', [], lambda: download_java(False)),
+        ('hadoop-download', [], lambda: download_hadoop(False)),
+        ('custom', ['apt'], custom_all_nodes_install)])
+    with open(BAKED_MARKER, 'w') as fo:
+        json.dump({'hadoop_dir': hadoop_dir, 'jdk_dir': jdk_dir, 'time': time.time()}, fo)
+    # the nodes start their own log
+    run('rm -f bootstrap.log')
+    sudo('shutdown -h now')
+
 # main script to install all dependencies
-def install_main(is_master):
+def install_main(is_master, baked=False):
     if is_master:
-        install_packages(master_apt_packages + node_apt_packages)
+        pkgs = master_apt_packages + node_apt_packages
     else:
-        install_packages(node_apt_packages)
+        pkgs = node_apt_packages
+    if DISK_LAYOUT == 'raid0':
+        pkgs = pkgs + ['mdadm']
+    # the packages and the tarballs are independent, fetch them concurrently;
+    # the site configuration needs both java and hadoop in place.
+    site_deps = ['jdk', 'hadoop-download']
+    steps = []
+    # the masters of a high availability cluster run zookeeper, and need the host
+    # names of each other to write their configuration
+    if is_master and (NUM_MASTERS > 1 or len(MASTERS) > 1):
+        steps.append(('zookeeper', [], lambda: download_zookeeper(is_master)))
+        site_deps.append('zookeeper')
+        if not MASTERS:
+            steps.append(('masters', [], wait_for_masters))
+            site_deps.append('masters')
+    steps += [
+        ('jdk', [], lambda: install_java(is_master)),
+        ('hadoop-download', [], lambda: download_hadoop(is_master)),
+        ('site-xml', site_deps, lambda: install_hadoop(is_master))]
+    # baked images have the packages already, java and hadoop are found in place
+    if not baked:
+        steps += [
+            ('apt-repositories', [], lambda: add_apt_repositories(apt_repositories)),
+            ('apt', ['apt-repositories'], lambda: install_packages(pkgs))]
+    if is_master:
+        steps.append(('artifact-server', ['jdk', 'hadoop-download'],
+                      lambda: run(artifact_server_cmd())))
+    results = run_steps(steps)
 
     env = []
-    env += install_java()
-    env += install_hadoop(is_master)
+    env += results.get('jdk', [])
+    env += results.get('site-xml', [])
     path = ['$HADOOP_HOME/bin', '$HADOOP_HOME/sbin', '$JAVA_HOME/bin']
     env += [('LD_LIBRARY_PATH', '$HADOOP_HOME/native/lib')]
     env += [('LD_LIBRARY_PATH', '${LD_LIBRARY_PATH}:$HADOOP_HDFS_HOME/lib/native:$JAVA_HOME/jre/lib/amd64/server')]
@@ -353,76 +948,596 @@ def install_main(is_master):
     regsshkey('%s/etc/hadoop/slaves' % HADOOP_HOME)
     # end of instalation.
 
+# startup.sh appends the begin and end time of its phases to this file
+STARTUP_PHASES = 'startup_phases.txt'
+
+def phase_marker(name):
+    return 'echo "%s $(date +%%s.%%N)" >> %s' % (name, os.path.abspath(STARTUP_PHASES))
+
+def read_startup_phases():
+    if not os.path.exists(STARTUP_PHASES):
+        return
+    marks = {}
+    for l in open(STARTUP_PHASES):
+        name, t = l.split()
+        marks.setdefault(name, []).append(float(t))
+    for name, ts in marks.items():
+        if len(ts) == 2:
+            record_phase(name, ts[0], ts[1])
+
+def get_devices():
+    return ['/dev/%s' % d for d in DISK_LIST if os.path.exists('/dev/%s' % d)]
+
+def get_data_disks():
+    """
+    mount points of the local disks under the current layout
+    """
+    devices = get_devices()
+    if not devices:
+        # ebs only instance types, keep the data on the root volume
+        return ['/disk/root']
+    if DISK_LAYOUT == 'raid0' and len(devices) > 1:
+        return ['/disk/md0']
+    return ['/disk/%s' % os.path.basename(d) for d in devices]
+
+# label of the file systems this script makes, only disks without it are formatted
+DISK_LABEL = 'yarn-ec2'
+
+def disk_setup_cmds():
+    """
+    commands to format and mount the local disks; disks already mounted or holding a
+    file system of ours are kept as they are, unless startup.sh runs with --force-clean
+    """
+    devices = get_devices()
+    cmds = ['setup_disk() {',
+            '    if [ $FORCE_CLEAN == 0 ] && mountpoint -q $2; then return; fi',
+            '    sudo umount $1',
+            '    if [ $FORCE_CLEAN == 1 ] || [ "$(sudo blkid -o value -s LABEL $1)" != "%s" ]; then' %
+            DISK_LABEL,
+            '        sudo mkfs -t ext4 -L %s %s $1' % (DISK_LABEL, disk_mkfs_opts),
+            '    fi',
+            '    sudo mkdir -p $2',
+            '    sudo mount -o %s $1 $2' % disk_mount_opts,
+            '}']
+    if DISK_LAYOUT == 'raid0' and len(devices) > 1:
+        create = ('yes | sudo mdadm --create /dev/md0 --level=0 --raid-devices=%d %s' %
+                  (len(devices), ' '.join(devices)))
+        cmds += ['if [ $FORCE_CLEAN == 0 ] && [ ! -b /dev/md0 ]; then',
+                 '    sudo mdadm --stop --scan',
+                 '    sudo mdadm --assemble /dev/md0 %s' % ' '.join(devices),
+                 'fi',
+                 'if [ $FORCE_CLEAN == 1 ] || [ ! -b /dev/md0 ]; then',
+                 '    sudo umount /dev/md0 %s' % ' '.join(devices),
+                 '    sudo mdadm --stop /dev/md0',
+                 '    %s' % create,
+                 'fi']
+        targets = ['/dev/md0']
+    else:
+        targets = devices
+    setup = ['setup_disk %s %s' % (dev, mnt) for dev, mnt in zip(targets, get_data_disks())]
+    if disk_parallel_format and len(setup) > 1:
+        cmds += ['%s &' % c for c in setup] + ['wait']
+    else:
+        cmds += setup
+    return cmds
+
+# startup.sh writes the dd summary of each disk into this file
+DISK_THROUGHPUT = 'disk_throughput.txt'
+
+def disk_benchmark_cmds(disks):
+    """
+    commands measuring the write throughput of all disks at once
+    """
+    if disk_benchmark_mb == 0 or not disks:
+        return []
+    out = os.path.abspath(DISK_THROUGHPUT)
+    cmds = ['rm -f %s' % out]
+    for d in disks:
+        cmds.append('(dd if=/dev/zero of=%s/tmp/dd.bench bs=1M count=%d oflag=direct 2>&1 |'
+                    ' grep copied >> %s; rm -f %s/tmp/dd.bench) &' % (d, disk_benchmark_mb, out, d))
+    cmds.append('wait')
+    return cmds
+
+def disk_throughput():
+    """
+    aggregate write throughput (MB/s) of the disks measured by startup.sh
+    """
+    if not os.path.exists(DISK_THROUGHPUT):
+        return None
+    nbytes, secs = 0, 0.0
+    for l in open(DISK_THROUGHPUT):
+        m = re.match(r'^(\d+) bytes.* copied, ([\d.]+) s', l)
+        if m:
+            nbytes += int(m.group(1))
+            secs = max(secs, float(m.group(2)))
+    if secs == 0:
+        return None
+    return nbytes / secs / 1e6
+
 # Make startup script for bulding
 def make_startup_script(is_master):
     assert JAVA_HOME is not None
     assert HADOOP_HOME is not None
     assert NODE_VCPU is not None
     assert NODE_VMEM is not None
-    disks = []
-    cmds = []
+    disks = get_data_disks()
+    cmds = ['FORCE_CLEAN=0',
+            '[ "$1" == "--force-clean" ] && FORCE_CLEAN=1',
+            'rm -f %s' % STARTUP_PHASES]
 
+    # the disks are formatted again, stop what uses them
+    cmds.append('if [ $FORCE_CLEAN == 1 ]; then')
     if is_master:
-        cmds.append('$HADOOP_HOME/sbin/stop-all.sh')
-
-    for d in DISK_LIST:
-        if os.path.exists('/dev/%s' % d):
-            cmds.append('sudo umount /dev/%s' % d)
-            cmds.append('sudo mkfs -t ext4 /dev/%s' % d)
-            cmds.append('sudo mkdir -p /disk/%s' % d)
-            cmds.append('sudo mount /dev/%s /disk/%s' % (d, d))
-            disks.append('/disk/%s' % d)
+        cmds.append('    $HADOOP_HOME/sbin/stop-all.sh')
+    else:
+        cmds.append('    %s' % daemon_cmd('nodemanager', 'stop'))
+    cmds.append('fi')
+    cmds.append(phase_marker('disk'))
+    cmds += disk_setup_cmds()
 
     for d in disks:
         cmds.append('sudo mkdir -p %s/hadoop' %d)
         cmds.append('sudo chown ubuntu:ubuntu %s/hadoop' % d)
         cmds.append('sudo mkdir -p %s/tmp' %d)
         cmds.append('sudo chown ubuntu:ubuntu %s/tmp' % d)
-        cmds.append('rm -rf %s/hadoop/dfs' % d)
-        cmds.append('mkdir %s/hadoop/dfs' % d)
-        cmds.append('mkdir %s/hadoop/dfs/name' % d)
-        cmds.append('mkdir %s/hadoop/dfs/data' % d)
+        cmds.append('[ $FORCE_CLEAN == 1 ] && rm -rf %s/hadoop/dfs' % d)
+        cmds.append('mkdir -p %s/hadoop/dfs/name' % d)
+        cmds.append('mkdir -p %s/hadoop/dfs/data' % d)
 
+    cmds.append(phase_marker('disk'))
     # run command
+    cmds.append(phase_marker('start-daemons'))
+    for d in node_daemons(is_master):
+        if d == 'queues':
+            continue
+        # zookeeper and the journal nodes start first, the format needs them
+        if d == 'namenode':
+            cmds += namenode_format_cmds(disks)
+        cmds.append('pgrep -f %s > /dev/null || (%s)' % (daemon_pattern(d), daemon_cmd(d, 'start')))
     if is_master:
-        cmds.append('$HADOOP_HOME/bin/hadoop namenode -format')
-        cmds.append('$HADOOP_HOME/sbin/start-all.sh')
+        cmds.append(artifact_server_cmd())
+        cmds.append(watcher_cmd('watch-decommission'))
     else:
-        cmds.append('export HADOOP_LIBEXEC_DIR=$HADOOP_HOME/libexec &&'\
-                ' $HADOOP_HOME/sbin/yarn-daemon.sh --config $HADOOP_HOME/etc/hadoop start nodemanager')
+        cmds.append(watcher_cmd('watch-spot'))
+    cmds.append(phase_marker('start-daemons'))
+    # measured once the node joined, so that it does not delay the join
+    benchmark = disk_benchmark_cmds(disks)
+    if benchmark:
+        cmds.append('if [ $FORCE_CLEAN == 1 ] || [ ! -s %s ]; then' %
+                    os.path.abspath(DISK_THROUGHPUT))
+        cmds += ['    %s' % c for c in benchmark]
+        cmds.append('fi')
     with open('startup.sh', 'w') as fo:
         fo.write('#!/bin/bash\n')
         fo.write('set -v\n')
         fo.write('\n'.join(cmds))
     run('chmod +x startup.sh')
     run('./startup.sh')
+    read_startup_phases()
 
 
-def main():
+def retry_cmd(cmd, tries=60, delay=10):
+    """
+    shell loop running cmd until it succeeds, e.g. until daemons on the other masters are up
+    """
+    return 'for i in $(seq %d); do (%s) && break; sleep %d; done' % (tries, cmd, delay)
+
+def namenode_format_cmds(disks):
+    """
+    commands formatting the namenode when it has no metadata yet; with NAMENODE_HA
+    the first master formats it, the second copies the metadata of the first one
+    """
+    # the namenode keeps its metadata under hadoop.tmp.dir, on the first disk
+    cmds = ['if [ ! -f %s/hadoop/dfs/name/current/VERSION ]; then' % disks[0]]
+    if NAMENODE_HA and master_index() == 1:
+        cmds.append('    ' + retry_cmd('$HADOOP_HOME/bin/hdfs namenode -bootstrapStandby'
+                                       ' -nonInteractive'))
+    else:
+        # the blocks of the datanode belong to the previous file system
+        cmds += ['    rm -rf %s/hadoop/dfs/data/*' % d for d in disks]
+        if NAMENODE_HA:
+            cmds.append('    ' + retry_cmd('$HADOOP_HOME/bin/hdfs namenode -format -nonInteractive'))
+            cmds.append('    ' + retry_cmd('$HADOOP_HOME/bin/hdfs zkfc -formatZK -force'))
+        else:
+            cmds.append('    $HADOOP_HOME/bin/hadoop namenode -format -nonInteractive')
+    cmds.append('fi')
+    return cmds
+
+# copy of this script kept in the home directory, for the watch modes
+BOOTSTRAP_COPY = 'yarn-ec2-bootstrap.py'
+# hdfs directory where slaves flag themselves for decommission
+DECOMMISSION_DIR = '/yarn-ec2/decommission'
+WEBHDFS_PORT = 50070
+RM_INFO_URL = 'http://localhost:8088/ws/v1/cluster/info'
+
+def watcher_cmd(mode):
+    script = os.path.abspath(BOOTSTRAP_COPY)
+    return ('pgrep -f "%s %s" > /dev/null || (nohup python %s %s > /dev/null 2>&1 &)' %
+            (script, mode, script, mode))
+
+def spot_notice():
+    """
+    the pending spot interruption action of this instance, None if there is none
+    """
+    notice = get_metadata('spot/instance-action', None)
+    if notice is not None:
+        try:
+            return json.loads(notice)
+        except ValueError:
+            pass
+    # older form of the notice, only the reclaim time
+    reclaim = get_metadata('spot/termination-time', None)
+    if reclaim is None:
+        return None
+    return {'action': 'terminate', 'time': reclaim.strip()}
+
+def seconds_until(timestamp):
+    """
+    seconds from now to a metadata timestamp such as 2017-09-18T08:22:00Z, None if unreadable
+    """
+    try:
+        return calendar.timegm(time.strptime(timestamp[:19], '%Y-%m-%dT%H:%M:%S')) - time.time()
+    except (TypeError, ValueError):
+        return None
+
+def watch_spot():
+    """
+    wait for the spot interruption notice, then ask the master to decommission this node,
+    so that it gets no new containers and the running ones finish or move in time;
+    the nodemanager stops just before the instance is reclaimed
+    """
+    if get_metadata('instance-life-cycle') != 'spot':
+        logging.info('not a spot instance, nothing to watch')
+        return
+    notice = spot_notice()
+    while notice is None:
+        time.sleep(spot_watch_interval)
+        notice = spot_notice()
+    logging.warning('spot interruption notice: %s' % notice)
+    # slaves cannot ssh to the master, they leave a flag in its hdfs
+    hadoop = '%s/bin/hadoop fs' % HADOOP_HOME
+    run('%s -mkdir -p %s && %s -touchz %s/%s' %
+        (hadoop, DECOMMISSION_DIR, hadoop, DECOMMISSION_DIR, socket.getfqdn()),
+        retries=2, check=False)
+    left = seconds_until(notice.get('time'))
+    if left is None:
+        left = 120
+    if left > spot_nm_stop_margin:
+        time.sleep(left - spot_nm_stop_margin)
+    run(daemon_cmd('nodemanager', 'stop'), check=False)
+
+def namenode_hosts():
+    """
+    hosts that may run the active namenode; the slaves, which run the topology script
+    for the jobs, reach it on the master
+    """
+    if len(MASTERS) > 1:
+        return MASTERS[:2] if NAMENODE_HA else MASTERS[:1]
+    return [MASTER] if MASTER else ['localhost']
+
+def webhdfs(path, op, method='GET'):
+    """
+    call the webhdfs api of the active namenode, a standby namenode refuses the calls
+    """
+    error = None
+    for host in namenode_hosts():
+        req = urllib2.Request('http://%s:%d/webhdfs/v1%s?op=%s&user.name=%s' %
+                              (host, WEBHDFS_PORT, path, op, USER_NAME))
+        req.get_method = lambda: method
+        try:
+            return json.load(urllib2.urlopen(req, timeout=10))
+        except IOError as e:
+            if getattr(e, 'code', None) == 404:
+                raise
+            error = e
+    raise error
+
+def local_rm_active():
+    """
+    whether the resource manager of this node is the active one, which it
+    always is without high availability
+    """
+    try:
+        info = json.load(urllib2.urlopen(RM_INFO_URL, timeout=10))['clusterInfo']
+    except (IOError, ValueError, KeyError):
+        return False
+    return info.get('haState') == 'ACTIVE'
+
+def flagged_hosts():
+    """
+    hosts that flagged themselves for decommission
+    """
+    try:
+        status = webhdfs(DECOMMISSION_DIR, 'LISTSTATUS')
+    except urllib2.HTTPError as e:
+        if e.code == 404:
+            return []
+        raise
+    return [f['pathSuffix'] for f in status['FileStatuses']['FileStatus']]
+
+def watch_decommission():
+    """
+    on the master, gracefully decommission the hosts flagged in DECOMMISSION_DIR;
+    with several masters, the one running the active resource manager does it
+    """
+    exclude = '%s/etc/hadoop/yarn.exclude' % HADOOP_HOME
+    while True:
+        if not local_rm_active():
+            time.sleep(spot_watch_interval)
+            continue
+        try:
+            hosts = flagged_hosts()
+        except Exception as e:
+            logging.error('cannot list %s: %s' % (DECOMMISSION_DIR, e))
+            hosts = []
+        if hosts:
+            logging.info('decommissioning %s' % ', '.join(hosts))
+            excluded = set(l.strip() for l in open(exclude))
+            with open(exclude, 'a') as fo:
+                for host in hosts:
+                    if host not in excluded:
+                        fo.write(host + '\n')
+            # rmadmin waits for the timeout, do not hold the next flags back
+            cmd = '%s/bin/yarn rmadmin -refreshNodes -g %d' % (HADOOP_HOME, spot_decommission_timeout)
+            thread = threading.Thread(target=run, args=(cmd,))
+            thread.daemon = True
+            thread.start()
+            for host in hosts:
+                try:
+                    webhdfs('%s/%s' % (DECOMMISSION_DIR, host), 'DELETE', 'DELETE')
+                except Exception as e:
+                    logging.error('cannot remove the flag of %s: %s' % (host, e))
+        time.sleep(spot_watch_interval)
+
+# yarn-ec2 writes the host names of the masters of a high availability cluster into this file
+MASTERS_FILE = 'yarn-ec2-masters.json'
+
+def short_host(host):
+    return host.split('.')[0].lower()
+
+def master_index():
+    """
+    position of this node in MASTERS, None if it is not one of them
+    """
+    me = short_host(socket.getfqdn())
+    for i, m in enumerate(MASTERS):
+        if short_host(m) == me:
+            return i
+    return None
+
+def wait_for_masters():
+    """
+    on the masters of a high availability cluster, wait until yarn-ec2 writes the host
+    names of all the masters into MASTERS_FILE, they are only known once all are launched
+    """
+    global MASTERS, MASTER
+    deadline = time.time() + masters_wait_timeout
+    while True:
+        try:
+            with open(MASTERS_FILE) as fi:
+                masters = json.load(fi)
+            break
+        except (IOError, ValueError):
+            if time.time() > deadline:
+                raise IOError('%s was not written in %d seconds' %
+                              (MASTERS_FILE, masters_wait_timeout))
+            time.sleep(5)
+    logging.info('masters are %s' % ', '.join(masters))
+    MASTERS = masters
+    MASTER = masters[0]
+
+# hdfs directory where the nodes report their rack, as empty files named host@zone
+RACK_DIR = '/yarn-ec2/racks'
+DEFAULT_RACK = '/default-rack'
+
+def report_rack():
+    """
+    report the availability zone of this node, under its host name and address
+    """
+    zone = get_metadata('placement/availability-zone')
+    if not zone:
+        logging.warning('unknown availability zone, the node stays in %s' % DEFAULT_RACK)
+        return
+    names = [socket.getfqdn(), get_metadata('local-ipv4')]
+    hadoop = '%s/bin/hadoop fs' % HADOOP_HOME
+    run('%s -mkdir -p %s && %s -touchz %s' % (
+        hadoop, RACK_DIR, hadoop, ' '.join('%s/%s@%s' % (RACK_DIR, n, zone) for n in names if n)),
+        retries=2, check=False)
+
+def is_address(name):
+    return re.match(r'^\d+\.\d+\.\d+\.\d+$', name) is not None
+
+def topology():
+    """
+    network topology script of hadoop: print the rack of each host name or address
+    given as argument, which is the availability zone the node reported in RACK_DIR
+    """
+    racks = {}
+    try:
+        status = webhdfs(RACK_DIR, 'LISTSTATUS')
+        for f in status['FileStatuses']['FileStatus']:
+            name, _, zone = f['pathSuffix'].rpartition('@')
+            racks[name] = '/' + zone
+            if not is_address(name):
+                racks.setdefault(short_host(name), '/' + zone)
+    except Exception as e:
+        logging.error('cannot list %s: %s' % (RACK_DIR, e))
+    # the master resolves itself before it can report its rack
+    zone = get_metadata('placement/availability-zone')
+    if zone:
+        for name in [socket.getfqdn(), short_host(socket.getfqdn()), get_metadata('local-ipv4')]:
+            racks.setdefault(name, '/' + zone)
+    hosts = sys.argv[2:]
+    print ' '.join(racks.get(h, racks.get(short_host(h) if not is_address(h) else h, DEFAULT_RACK))
+                   for h in hosts)
+
+def load_masters():
+    """
+    the watch modes run from the copy of the user data, where the masters of
+    a high availability cluster are not set, read them from MASTERS_FILE
+    """
+    global MASTERS, MASTER
+    # next to the copy, the daemons running the topology script have another directory
+    fname = os.path.join(os.path.dirname(os.path.abspath(__file__)), MASTERS_FILE)
+    if not MASTERS and os.path.exists(fname):
+        with open(fname) as fi:
+            MASTERS = json.load(fi)
+        MASTER = MASTERS[0]
+
+def find_master():
+    """
+    set MASTER to this node when the script does not name a master,
+    or to the first master when it names all of them
+
+    Returns whether this node is a master
+    """
     global MASTER
-    logging.basicConfig(filename = 'bootstrap.log', level = logging.INFO,
-                        format='%(asctime)s %(levelname)s %(message)s')
+    if MASTERS:
+        MASTER = MASTERS[0]
+        return master_index() is not None
     if MASTER == '':
-        is_master = True
         MASTER = socket.getfqdn()
         logging.info('assuming master is myself as %s' % MASTER)
+        return True
+    return socket.getfqdn() == MASTER
+
+# daemons reading each configuration file, restarted when it changes; the queues
+# of the capacity scheduler are refreshed instead, mapred-site.xml is read by the jobs
+HDFS_DAEMONS = ['namenode', 'secondarynamenode', 'datanode', 'journalnode', 'zkfc']
+CONF_DAEMONS = {
+    'core-site.xml': HDFS_DAEMONS + ['resourcemanager', 'nodemanager'],
+    'hdfs-site.xml': HDFS_DAEMONS,
+    'yarn-site.xml': ['resourcemanager', 'nodemanager'],
+    'capacity-scheduler.xml': ['queues'],
+    'hadoop-env.sh': HDFS_DAEMONS + ['resourcemanager', 'nodemanager'],
+    'zoo.cfg': ['zookeeper'],
+    'mapred-site.xml': [],
+    'slaves': [],
+    TOPOLOGY_SCRIPT: []
+}
+
+def node_daemons(is_master):
+    """
+    daemons running on a node, in start order; the masters also run a datanode and a nodemanager
+
+    With several masters, all of them run zookeeper and a resource manager. The namenode
+    runs on the first master, or on the first two with NAMENODE_HA, sharing their edits
+    through journal nodes on all the masters.
+    """
+    if not is_master:
+        return ['nodemanager']
+    if len(MASTERS) < 2:
+        return ['namenode', 'secondarynamenode', 'datanode', 'resourcemanager', 'nodemanager',
+                'queues']
+    index = master_index()
+    daemons = ['zookeeper']
+    if NAMENODE_HA:
+        daemons.append('journalnode')
+        if index < 2:
+            daemons += ['namenode', 'zkfc']
+    elif index == 0:
+        daemons += ['namenode', 'secondarynamenode']
+    return daemons + ['datanode', 'resourcemanager', 'nodemanager', 'queues']
+
+def daemon_pattern(daemon):
+    """
+    pattern matching the command line of a running daemon, for pgrep
+    """
+    if daemon == 'zookeeper':
+        return 'QuorumPeerMain'
+    return 'proc_%s' % daemon
+
+def daemon_cmd(daemon, action):
+    """
+    command to start or stop a hadoop daemon
+    """
+    if daemon == 'zookeeper':
+        return '%s/bin/zkServer.sh %s' % (os.path.abspath(zookeeper_dir), action)
+    if daemon in HDFS_DAEMONS:
+        script = 'hadoop-daemon.sh'
     else:
-        is_master = socket.getfqdn() == MASTER
+        script = 'yarn-daemon.sh'
+    return ('export HADOOP_LIBEXEC_DIR=$HADOOP_HOME/libexec && $HADOOP_HOME/sbin/%s'
+            ' --config $HADOOP_HOME/etc/hadoop %s %s' % (script, action, daemon))
+
+def restart_cmds(daemons):
+    """
+    commands restarting the given daemons
+    """
+    cmds = []
+    for d in daemons:
+        if d == 'queues':
+            cmds.append('$HADOOP_HOME/bin/yarn rmadmin -refreshQueues')
+        else:
+            cmds += [daemon_cmd(d, 'stop'), daemon_cmd(d, 'start')]
+    return cmds
+
+# configure prints its result on a line starting with this
+CONFIGURE_RESULT = 'YARN_EC2_CONFIGURE'
+
+def configure():
+    """
+    render the hadoop configuration of this node again, leaving disks and daemons alone,
+    and print the changed properties and the daemons to restart as json
+    """
+    is_master = find_master()
+    disks = get_data_disks()
+    missing = [d for d in disks if not os.path.isdir('%s/hadoop' % d)]
+    if missing:
+        # e.g. a disk layout other than the one of the launch
+        print >> sys.stderr, 'data disks %s are not set up on this node' % ', '.join(missing)
+        sys.exit(1)
+    changes, written = setup_hadoop_site(is_master, MASTER,
+                                         ['%s/hadoop' % d for d in disks],
+                                         ['%s/hadoop/dfs' % d for d in disks],
+                                         NODE_VCPU, NODE_VMEM)
+    files = sorted(set([c[0] for c in changes] + written))
+    daemons = [d for d in node_daemons(is_master)
+               if any(d in CONF_DAEMONS.get(f, []) for f in files)]
+    print '%s %s' % (CONFIGURE_RESULT, json.dumps({
+        'files': files, 'changes': changes, 'restart': daemons}))
+
+def main():
+    logging.basicConfig(filename = 'bootstrap.log', level = logging.INFO,
+                        format='%(asctime)s %(levelname)s %(message)s')
+    is_master = find_master()
+    if BAKE_IMAGE:
+        bake_image()
+        return
     tstart = time.time()
-    install_main(is_master)
+    offset = boot_offset()
+    baked = baked_image()
+    if baked:
+        logging.info('running from a baked image, skipping the package installation')
+    install_main(is_master, baked)
     tmid = time.time()
     logging.info('installation finishes in %g secs' % (tmid - tstart))
+    if not is_master:
+        # before the nodemanager registers, the resource manager asks for its rack then
+        report_rack()
     make_startup_script(is_master)
+    if is_master:
+        report_rack()
     ENVIRON['HADOOP_HOME'] = HADOOP_HOME
     ENVIRON['JAVA_HOME'] = JAVA_HOME
     tend = time.time()
+    report_timeline(timeline_report(is_master, tstart, offset))
     if is_master:
         custom_master_install()
-    custom_all_nodes_install()
+    if not baked:
+        custom_all_nodes_install()
     logging.info('boostrap finishes in %g secs' % (tend - tmid))
     logging.info('all finishes in %g secs' % (tend - tstart))
 
+# what the script does, given as its first argument
+MODES = {'install': main, 'configure': configure, 'topology': topology,
+         'watch-spot': watch_spot, 'watch-decommission': watch_decommission}
+
 if __name__ == '__main__':
+    mode = sys.argv[1] if len(sys.argv) > 1 else 'install'
+    if mode not in MODES:
+        print >> sys.stderr, 'usage: %s [%s]' % (sys.argv[0], '|'.join(sorted(MODES.keys())))
+        sys.exit(1)
     pw_record = pwd.getpwnam(USER_NAME)
     user_name = pw_record.pw_name
     user_home_dir = pw_record.pw_dir
@@ -431,7 +1546,17 @@ if __name__ == '__main__':
     env = os.environ.copy()
     cwd = user_home_dir
     ENVIRON['HOME'] = user_home_dir
-    os.setgid(user_gid)
-    os.setuid(user_uid)
+    # started as root from the user data, the watch modes run as the user already
+    if os.getuid() == 0:
+        if mode == 'install':
+            copy = os.path.join(user_home_dir, BOOTSTRAP_COPY)
+            shutil.copy(os.path.abspath(__file__), copy)
+            os.chown(copy, user_uid, user_gid)
+        os.setgid(user_gid)
+        os.setuid(user_uid)
     os.chdir(user_home_dir)
-    main()
+    if mode != 'install':
+        logging.basicConfig(filename='%s.log' % mode, level=logging.INFO,
+                            format='%(asctime)s %(levelname)s %(message)s')
+        load_masters()
+    MODES[mode]()
@@ -0,0 +1,134 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+On-disk cache of the instances of a cluster, so that read-only actions
+such as get-master and login do not need a round trip to EC2.
+"""
+import json
+import os
+import time
+
+DEFAULT_CACHE_FILE = os.path.join(os.path.expanduser('~'), '.yarn-ec2', 'cluster-cache.json')
+
+class CachedInstance(object):
+    """
+    Plain record holding the attributes of a boto instance
+    that the read-only actions need.
+    """
+    FIELDS = ['id', 'state', 'instance_type', 'placement',
+              'public_dns_name', 'private_dns_name', 'ami_launch_index', 'tags']
+
+    def __init__(self, **kwargs):
+        for field in self.FIELDS:
+            setattr(self, field, kwargs.get(field))
+
+    @classmethod
+    def from_instance(cls, inst):
+        return cls(**dict((f, getattr(inst, f, None)) for f in cls.FIELDS))
+
+    def to_dict(self):
+        return dict((f, getattr(self, f)) for f in self.FIELDS)
+
+
+class ClusterCache(object):
+    """
+    Cluster state keyed by region and cluster name, stored as json.
+
+    Parameters
+    ----------
+    path: the file the cache is stored in
+    ttl: seconds an entry stays valid, 0 disables the cache
+    """
+    def __init__(self, path=DEFAULT_CACHE_FILE, ttl=300):
+        self.path = path
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(region, cluster_name):
+        return '%s/%s' % (region, cluster_name)
+
+    def _load(self):
+        try:
+            with open(self.path) as fi:
+                data = json.load(fi)
+        except (IOError, ValueError):
+            data = {}
+        data.setdefault('clusters', {})
+        data.setdefault('stats', {'hits': 0, 'misses': 0})
+        return data
+
+    def _save(self, data):
+        dirname = os.path.dirname(self.path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        # write to a temp file and rename, so concurrent readers never see a partial file
+        tmp = '%s.%d.tmp' % (self.path, os.getpid())
+        with open(tmp, 'w') as fo:
+            json.dump(data, fo)
+        os.rename(tmp, self.path)
+
+    def get(self, region, cluster_name):
+        """
+        Returns (master_nodes, slave_nodes) as CachedInstance lists,
+        or None if the cluster is not cached or its entry expired.
+        """
+        if self.ttl <= 0:
+            return None
+        data = self._load()
+        entry = data['clusters'].get(self._key(region, cluster_name))
+        if entry is not None and time.time() - entry['time'] < self.ttl:
+            self.hits += 1
+            data['stats']['hits'] += 1
+            result = ([CachedInstance(**d) for d in entry['masters']],
+                      [CachedInstance(**d) for d in entry['slaves']])
+        else:
+            self.misses += 1
+            data['stats']['misses'] += 1
+            result = None
+        self._save(data)
+        return result
+
+    def put(self, region, cluster_name, master_nodes, slave_nodes):
+        if self.ttl <= 0:
+            return
+        # a master without dns name (e.g. stopped) would be useless to the readers
+        if not master_nodes or not all(m.public_dns_name for m in master_nodes):
+            self.invalidate(region, cluster_name)
+            return
+        data = self._load()
+        data['clusters'][self._key(region, cluster_name)] = {
+            'time': time.time(),
+            'masters': [CachedInstance.from_instance(i).to_dict() for i in master_nodes],
+            'slaves': [CachedInstance.from_instance(i).to_dict() for i in slave_nodes]
+        }
+        self._save(data)
+
+    def invalidate(self, region, cluster_name):
+        data = self._load()
+        if data['clusters'].pop(self._key(region, cluster_name), None) is not None:
+            self._save(data)
+
+    def stats(self):
+        """
+        Returns the hit and miss counts of this run and of all runs.
+        """
+        totals = self._load()['stats']
+        return {'hits': self.hits, 'misses': self.misses,
+                'total_hits': totals['hits'], 'total_misses': totals['misses']}
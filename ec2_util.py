@@ -19,122 +19,122 @@
 import boto
 from boto.ec2.blockdevicemapping import BlockDeviceMapping, BlockDeviceType, EBSBlockDeviceType
 from boto import ec2
+from boto.exception import EC2ResponseError
+import random
 import sys
 import string
 import time
+import instance_catalog
 
 # Get number of local disks available for a given EC2 instance type.
 def get_num_disks(instance):
-    # From http://docs.aws.amazon.com/AWSEC2/latest/UserGuide/InstanceStorage.html
-    # Updated 2014-6-20
-    disks_by_instance = {
-        "m1.small":    1,
-        "m1.medium":   1,
-        "m1.large":    2,
-        "m1.xlarge":   4,
-        "t1.micro":    1,
-        "c1.medium":   1,
-        "c1.xlarge":   4,
-        "m2.xlarge":   1,
-        "m2.2xlarge":  1,
-        "m2.4xlarge":  2,
-        "cc1.4xlarge": 2,
-        "cc2.8xlarge": 4,
-        "cg1.4xlarge": 2,
-        "hs1.8xlarge": 24,
-        "cr1.8xlarge": 2,
-        "hi1.4xlarge": 2,
-        "m3.medium":   1,
-        "m3.large":    1,
-        "m3.xlarge":   2,
-        "m3.2xlarge":  2,
-        "i2.xlarge":   1,
-        "i2.2xlarge":  2,
-        "i2.4xlarge":  4,
-        "i2.8xlarge":  8,
-        "c3.large":    2,
-        "c3.xlarge":   2,
-        "c3.2xlarge":  2,
-        "c3.4xlarge":  2,
-        "c3.8xlarge":  2,
-        "r3.large":    1,
-        "r3.xlarge":   1,
-        "r3.2xlarge":  1,
-        "r3.4xlarge":  1,
-        "r3.8xlarge":  2,
-        "g2.2xlarge":  1,
-        "g2.8xlarge":  2,
-        "t1.micro":    0
-    }
-    if instance in disks_by_instance:
-        return disks_by_instance[instance]
+    itype = instance_catalog.get(instance)
+    if itype is not None:
+        return itype.disks
     else:
         print >> sys.stderr, ("WARNING: Don't know number of disks on instance type %s; assuming 1"
                               % instance)
         return 1
 
+# Get the virtualization type (pvm or hvm) of the AMI to use for an instance type.
 def get_instance_type(instance):
-    instance_types = {
-        "m1.small":    "pvm",
-        "m1.medium":   "pvm",
-        "m1.large":    "pvm",
-        "m1.xlarge":   "pvm",
-        "t1.micro":    "pvm",
-        "c1.medium":   "pvm",
-        "c1.xlarge":   "pvm",
-        "m2.xlarge":   "pvm",
-        "m2.2xlarge":  "pvm",
-        "m2.4xlarge":  "pvm",
-        "cc1.4xlarge": "hvm",
-        "cc2.8xlarge": "hvm",
-        "cg1.4xlarge": "hvm",
-        "hs1.8xlarge": "pvm",
-        "hi1.4xlarge": "pvm",
-        "m3.medium":   "hvm",
-        "m3.large":    "hvm",
-        "m3.xlarge":   "hvm",
-        "m3.2xlarge":  "hvm",
-        "cr1.8xlarge": "hvm",
-        "i2.xlarge":   "hvm",
-        "i2.2xlarge":  "hvm",
-        "i2.4xlarge":  "hvm",
-        "i2.8xlarge":  "hvm",
-        "c3.large":    "pvm",
-        "c3.xlarge":   "pvm",
-        "c3.2xlarge":  "pvm",
-        "c3.4xlarge":  "pvm",
-        "c3.8xlarge":  "pvm",
-        "r3.large":    "hvm",
-        "g2.2xlarge":  "hvm",
-        "g2.8xlarge":  "hvm",
-        "r3.xlarge":   "hvm",
-        "r3.2xlarge":  "hvm",
-        "r3.4xlarge":  "hvm",
-        "r3.8xlarge":  "hvm",
-        "t2.micro":    "hvm",
-        "t2.small":    "hvm",
-        "t2.medium":   "hvm"
-    }
-    if instance in instance_types:
-        return instance_types[instance]
+    itype = instance_catalog.get(instance)
+    if itype is not None:
+        return itype.virt
     else:
         print >> sys.stderr,\
             "Don't recognize %s, assuming type is pvm" % instance
         return 'pvm'
 
-# Wait for a set of launched instances to exit the "pending" state
-# (i.e. either to start running or to fail and be terminated)
-def wait_for_instances(conn, instances):
-    while True:
-        for i in instances:
-            i.update()
-        status = conn.get_all_instance_status(instance_ids = [i.id for i in instances])
-        if len([i for i in instances if i.state == 'pending']) > 0:
-            time.sleep(5)
-        elif len([i for i in status if i.system_status.status == 'initializing']) > 0:
-            time.sleep(5)
-        else:
+# Largest number of instance ids passed to a single Describe* call
+DESCRIBE_CHUNK_SIZE = 100
+
+# Split a list into chunks of at most size elements.
+def chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+# Whether an EC2 error means the instance ids are not visible yet,
+# which happens right after a launch due to eventual consistency.
+def is_not_found_error(e):
+    return isinstance(e, EC2ResponseError) and e.error_code == 'InvalidInstanceID.NotFound'
+
+# EC2 error codes for which a call is worth retrying: throttling, and instance
+# or spot request ids that are not visible yet right after a launch.
+RETRY_ERROR_CODES = ['RequestLimitExceeded', 'Throttling', 'InvalidInstanceID.NotFound',
+                     'InvalidSpotInstanceRequestID.NotFound']
+
+# Call fn, retrying with exponential backoff and jitter on retryable EC2 errors.
+def retry_ec2_call(fn, max_tries=8, min_delay=1.0, max_delay=30.0):
+    delay = min_delay
+    for tries in range(max_tries):
+        try:
+            return fn()
+        except EC2ResponseError as e:
+            if e.error_code not in RETRY_ERROR_CODES or tries + 1 == max_tries:
+                raise
+            print >> sys.stderr, "EC2 returned %s, retrying..." % e.error_code
+            time.sleep(delay * random.uniform(0.5, 1.0))
+            delay = min(max_delay, delay * 2)
+
+# Set the same tags on a list of instances (or instance ids), with one
+# CreateTags call per chunk of ids instead of one call per instance and tag.
+# Returns the number of CreateTags calls made.
+def tag_instances(conn, instances, tags, chunk_size=DESCRIBE_CHUNK_SIZE):
+    ids = [getattr(i, 'id', i) for i in instances]
+    ncall = 0
+    for chunk in chunks(ids, chunk_size):
+        retry_ec2_call(lambda: conn.create_tags(chunk, tags))
+        ncall += 1
+    return ncall
+
+# Yield launched instances as soon as they exit the "pending" state and finish
+# initializing (i.e. either start running or fail and are terminated).
+# Each poll cycle makes one DescribeInstanceStatus call per chunk of ids, and one
+# DescribeInstances call to refresh the attributes of the instances that got ready.
+# Polls back off exponentially with jitter, and give up after timeout seconds.
+def iter_ready_instances(conn, instances, timeout=None, min_delay=2.0, max_delay=30.0):
+    pending = dict((i.id, i) for i in instances)
+    deadline = None if timeout is None else time.time() + timeout
+    delay = min_delay
+    while pending:
+        ready = []
+        for ids in chunks(pending.keys(), DESCRIBE_CHUNK_SIZE):
+            try:
+                status = conn.get_all_instance_status(instance_ids=ids,
+                                                      include_all_instances=True)
+            except EC2ResponseError as e:
+                if not is_not_found_error(e):
+                    raise
+                continue
+            ready += [st.id for st in status
+                      if st.state_name != 'pending' and
+                      st.system_status.status != 'initializing']
+        for ids in chunks(ready, DESCRIBE_CHUNK_SIZE):
+            for res in conn.get_all_instances(instance_ids=ids):
+                for fresh in res.instances:
+                    inst = pending.pop(fresh.id)
+                    inst._update(fresh)
+                    yield inst
+        if not pending:
+            return
+        if ready:
+            delay = min_delay
+        now = time.time()
+        if deadline is not None and now >= deadline:
+            print >> sys.stderr, ("WARNING: %d instance(s) still not ready after %d seconds: %s"
+                                  % (len(pending), timeout, ', '.join(sorted(pending.keys()))))
             return
+        sleep = delay * random.uniform(0.5, 1.0)
+        if deadline is not None:
+            sleep = min(sleep, deadline - now)
+        time.sleep(sleep)
+        delay = min(max_delay, delay * 1.5)
+
+# Wait for a set of launched instances to exit the "pending" state
+# Returns the instances that got ready before the timeout.
+def wait_for_instances(conn, instances, timeout=None):
+    return list(iter_ready_instances(conn, instances, timeout))
 
 # Get the EC2 security group of the given name, creating it if it doesn't exist
 def get_or_make_group(conn, name, make_if_not_exist = True):
@@ -149,11 +149,71 @@ def get_or_make_group(conn, name, make_if_not_exist = True):
         print "Creating security group " + name
         return conn.create_security_group(name, "MODE EC2 group")
 
-# Check whether a given EC2 instance object is in a state we consider active,
-# i.e. not terminating or terminated. We count both stopping and stopped as
-# active since we can restart stopped clusters.
+# Instance states we consider active, i.e. not terminating or terminated.
+# We count both stopping and stopped as active since we can restart stopped clusters.
+ACTIVE_STATES = ['pending', 'running', 'stopping', 'stopped']
+
+# Tags written on every instance at launch time, so that a cluster
+# can be discovered without looking at its security groups.
+CLUSTER_TAG = 'yarn-ec2-cluster'
+ROLE_TAG = 'yarn-ec2-role'
+# Written on the masters of a cluster whose namenode is highly available.
+NAMENODE_HA_TAG = 'yarn-ec2-namenode-ha'
+# Written on the masters, the options the configuration of the nodes is rendered from.
+OPTIONS_TAG = 'yarn-ec2-options'
+
+# Check whether a given EC2 instance object is in a state we consider active.
 def is_active(instance):
-    return (instance.state in ['pending', 'running', 'stopping', 'stopped'])
+    return (instance.state in ACTIVE_STATES)
+
+# Names of the master and slave security groups of a cluster.
+def get_group_names(cluster_name):
+    return (cluster_name + "-master", cluster_name + "-slave")
+
+# Tags that identify an instance as the given role of a cluster.
+# They are the same for all instances of a role, so they can be set in bulk.
+# The Name tag is shared as well, <cluster>-<role>, where it used to be
+# <cluster>-<role>-<instance id>; the instance id tells the nodes apart.
+def get_cluster_tags(cluster_name, role):
+    return {'Name': '%s-%s' % (cluster_name, role),
+            CLUSTER_TAG: cluster_name,
+            ROLE_TAG: role}
+
+# Build DescribeInstances filters that select the active instances of a cluster
+# on the server side, either by security group name or by the cluster tag.
+def get_cluster_filters(cluster_name, by_tag=False):
+    filters = {'instance-state-name': ACTIVE_STATES}
+    if by_tag:
+        filters['tag:' + CLUSTER_TAG] = cluster_name
+    else:
+        filters['instance.group-name'] = list(get_group_names(cluster_name))
+    return filters
+
+# Split the instances of a cluster into masters and slaves, using the role tag
+# when it was written at launch and the security group otherwise.
+def split_cluster_roles(instances, cluster_name):
+    master_group, slave_group = get_group_names(cluster_name)
+    master_nodes = []
+    slave_nodes = []
+    for inst in instances:
+        role = inst.tags.get(ROLE_TAG)
+        group_names = [g.name for g in inst.groups]
+        if role == 'master' or (role is None and master_group in group_names):
+            master_nodes.append(inst)
+        elif role == 'slave' or (role is None and slave_group in group_names):
+            slave_nodes.append(inst)
+    return (master_nodes, slave_nodes)
+
+# Sort the masters of a cluster in the order they were launched in, which is the
+# order of the master list their high availability configuration is rendered from.
+def sort_masters(master_nodes):
+    return sorted(master_nodes,
+                  key=lambda m: (int(getattr(m, 'ami_launch_index', None) or 0), m.id))
+
+# Whether the masters of a cluster run the namenode in high availability.
+def is_namenode_ha(master_nodes):
+    return any((getattr(m, 'tags', None) or {}).get(NAMENODE_HA_TAG) == 'true'
+               for m in master_nodes)
 
 # Attempt to resolve an appropriate AMI given the architecture and
 # region of the request.
@@ -179,20 +239,16 @@ def get_block_device(instance_type, ebs_vol_size):
 
 
 # Get the EC2 instances in an existing cluster if available.
-# Returns a tuple of lists of EC2 instance objects for the masters and slaves
-def get_existing_cluster(conn, cluster_name, die_on_error=True):
+# Only the cluster's own instances are requested from EC2, so the cost of the
+# lookup depends on the size of the cluster rather than of the account.
+# Returns a tuple of lists of EC2 instance objects for the masters, in launch
+# order, and the slaves
+def get_existing_cluster(conn, cluster_name, die_on_error=True, by_tag=False):
     print "Searching for existing cluster " + cluster_name + "..."
-    reservations = conn.get_all_instances()
-    master_nodes = []
-    slave_nodes = []
-    for res in reservations:
-        active = [i for i in res.instances if is_active(i)]
-        for inst in active:
-            group_names = [g.name for g in inst.groups]
-            if group_names == [cluster_name + "-master"]:
-                master_nodes.append(inst)
-            elif group_names == [cluster_name + "-slaves"]:
-                slave_nodes.append(inst)
+    reservations = conn.get_all_instances(filters=get_cluster_filters(cluster_name, by_tag))
+    instances = [i for res in reservations for i in res.instances if is_active(i)]
+    master_nodes, slave_nodes = split_cluster_roles(instances, cluster_name)
+    master_nodes = sort_masters(master_nodes)
     if any((master_nodes, slave_nodes)):
         print ("Found %d master(s), %d slaves" % (len(master_nodes), len(slave_nodes)))
     if master_nodes != [] or not die_on_error:
@@ -0,0 +1,104 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+Catalog of the EC2 instance types, loaded once from data/instances.tsv.
+New instance families are added by appending lines to that file.
+"""
+import os
+from collections import namedtuple
+
+CATALOG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'data', 'instances.tsv')
+
+class InstanceType(namedtuple('InstanceType', [
+        'name', 'vcpu', 'ecu', 'memory_gb', 'disks', 'disk_gb', 'disk_kind',
+        'virt', 'network', 'prices'])):
+    """
+    Facts about one instance type, see data/instances.tsv for the fields.
+    """
+    __slots__ = ()
+
+    @property
+    def memory_mb(self):
+        return int(self.memory_gb * 1024)
+
+    @property
+    def burstable(self):
+        return self.ecu is None
+
+    def price(self, region=None):
+        """
+        On-demand hourly price in region, None if unknown.
+        """
+        return self.prices.get(region, self.prices.get('*'))
+
+def _parse_line(line):
+    f = line.rstrip('\n').split('\t')
+    prices = {}
+    if f[9] != '-':
+        for item in f[9].split(','):
+            region, price = item.split('=')
+            prices[region] = float(price)
+    return InstanceType(name=f[0], vcpu=int(f[1]),
+                        ecu=None if f[2] == '-' else float(f[2]),
+                        memory_gb=float(f[3]), disks=int(f[4]), disk_gb=int(f[5]),
+                        disk_kind=None if f[6] == '-' else f[6],
+                        virt=f[7], network=f[8], prices=prices)
+
+_CATALOG = {}
+
+def load(fname=CATALOG_FILE):
+    """
+    Returns the dict of instance type name to InstanceType, parsed once per file.
+    """
+    if fname not in _CATALOG:
+        catalog = {}
+        with open(fname) as fi:
+            for line in fi:
+                if line.strip() and not line.startswith('#'):
+                    itype = _parse_line(line)
+                    catalog[itype.name] = itype
+        _CATALOG[fname] = catalog
+    return _CATALOG[fname]
+
+def get(name):
+    """
+    Returns the InstanceType of name, None if the catalog does not know it.
+    """
+    return load().get(name)
+
+def select(pred=None, **conds):
+    """
+    Select the instance types matching all conditions, sorted by name.
+
+    Conditions are field=value for equality, and min_field=value or
+    max_field=value for bounds, e.g. select(virt='hvm', min_disks=4, disk_kind='ssd')
+    pred is an optional extra predicate on the InstanceType.
+    """
+    def match(itype):
+        for key, value in conds.items():
+            if key.startswith('min_'):
+                if getattr(itype, key[4:]) < value:
+                    return False
+            elif key.startswith('max_'):
+                if getattr(itype, key[4:]) > value:
+                    return False
+            elif getattr(itype, key) != value:
+                return False
+        return pred is None or pred(itype)
+    return sorted([t for t in load().values() if match(t)], key=lambda t: t.name)
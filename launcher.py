@@ -0,0 +1,142 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+Launch many on-demand instances as concurrent chunks that may be partially
+fulfilled, moving what EC2 has no capacity for to other launch specs.
+"""
+import Queue
+import sys
+import time
+from multiprocessing.pool import ThreadPool
+from boto.exception import EC2ResponseError
+
+# EC2 error codes meaning that a launch spec has no capacity left, worth
+# trying the next launch spec for.
+CAPACITY_ERROR_CODES = ['InsufficientInstanceCapacity', 'InsufficientCapacity', 'Unsupported']
+
+# Split count into chunks of at most size.
+def split_chunks(count, size):
+    size = max(1, size)
+    return [min(size, count - i) for i in range(0, count, size)]
+
+class ChunkResult(object):
+    """
+    Outcome of one launch call: the launch spec, the number of instances
+    asked for, the instances launched and the error if it failed.
+    retry tells whether the other launch specs are worth trying.
+    """
+    def __init__(self, spec, count, instances, error=None, retry=True, elapsed=0.0):
+        self.spec = spec
+        self.count = count
+        self.instances = instances
+        self.error = error
+        self.retry = retry
+        self.elapsed = elapsed
+
+
+class ChunkedLauncher(object):
+    """
+    Launch instances in chunks submitted concurrently. Each chunk accepts a
+    partial fulfillment, the instances EC2 did not launch, for lack of capacity
+    or because it only launched part of the chunk, go on with the next launch spec.
+
+    Parameters
+    ----------
+    launch: function (spec, count) launching between 1 and count instances with
+        the launch spec number spec, and returning them
+    nspecs: the number of launch specs launch accepts
+    parallel: the maximum number of concurrent launch calls
+    launched: optional function called with the instances of each chunk as soon
+        as they are launched, e.g. to tag them
+    """
+    def __init__(self, launch, nspecs, parallel=8, launched=None):
+        self.launch = launch
+        self.nspecs = nspecs
+        self.parallel = parallel
+        self.launched = launched or (lambda instances: None)
+        self.results = []
+
+    def _run_chunk(self, spec, count):
+        tstart = time.time()
+        try:
+            instances = self.launch(spec, count)
+            return ChunkResult(spec, count, instances, elapsed=time.time() - tstart)
+        except EC2ResponseError as e:
+            return ChunkResult(spec, count, [], e.error_code, e.error_code in CAPACITY_ERROR_CODES,
+                               time.time() - tstart)
+        except Exception as e:
+            return ChunkResult(spec, count, [], str(e), False, time.time() - tstart)
+
+    def run(self, chunks):
+        """
+        Launch chunks, a list of (launch spec, count).
+        Returns the launched instances.
+        """
+        done = Queue.Queue()
+        pool = ThreadPool(self.parallel)
+        outstanding = [0]
+        def submit(spec, count):
+            outstanding[0] += 1
+            pool.apply_async(self._run_chunk, (spec, count), callback=done.put)
+        instances = []
+        try:
+            for spec, count in chunks:
+                submit(spec, count)
+            while outstanding[0]:
+                try:
+                    # get with a timeout so that KeyboardInterrupt is delivered
+                    res = done.get(True, 1)
+                except Queue.Empty:
+                    continue
+                outstanding[0] -= 1
+                self.results.append(res)
+                if res.instances:
+                    instances += res.instances
+                    self.launched(res.instances)
+                missing = res.count - len(res.instances)
+                if missing == 0:
+                    continue
+                if not res.retry:
+                    print >> sys.stderr, "ERROR: launching %d instance(s) with launch spec %d: %s" % (
+                        missing, res.spec, res.error)
+                    continue
+                if res.spec + 1 >= self.nspecs:
+                    print >> sys.stderr, ("WARNING: giving up on %d instance(s), no launch "
+                                          "spec left to try" % missing)
+                    continue
+                print "Launch spec %d got %d of %d instance(s)%s, trying %d with launch spec %d" % (
+                    res.spec, len(res.instances), res.count,
+                    ' (%s)' % res.error if res.error else '', missing, res.spec + 1)
+                submit(res.spec + 1, missing)
+        finally:
+            pool.terminate()
+        return instances
+
+    def report(self, specs):
+        """
+        Print the instances asked for and launched per launch spec,
+        specs gives a description of each launch spec.
+        """
+        print '%-40s %6s %8s %8s %10s' % ('launch spec', 'calls', 'asked', 'launched', 'slowest(s)')
+        by_spec = {}
+        for r in self.results:
+            by_spec.setdefault(r.spec, []).append(r)
+        for spec, results in sorted(by_spec.items()):
+            print '%-40s %6d %8d %8d %10.1f' % (
+                specs[spec], len(results), sum(r.count for r in results),
+                sum(len(r.instances) for r in results), max(r.elapsed for r in results))
@@ -0,0 +1,106 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+Where the slaves of a launch go: the zone of the master, a cluster
+placement group in it, or several zones in proportion to their weights.
+"""
+import sys
+import time
+from boto.exception import EC2ResponseError
+import ec2_util
+
+STRATEGIES = ['single-az', 'cluster', 'spread']
+
+# Parse zone weights given as us-west-2a=2,us-west-2b=1 into a dict.
+# Raises ValueError when they do not look like that.
+def parse_zone_weights(text):
+    weights = {}
+    for item in [i for i in text.split(',') if i]:
+        zone, weight = item.split('=')
+        weights[zone.strip()] = float(weight)
+        if weights[zone.strip()] < 0:
+            raise ValueError('negative weight for %s' % zone)
+    return weights
+
+# Split count instances across the zones of weights in proportion to the weights,
+# counting the instances already in each zone (existing), so that repeated small
+# launches such as the ones of autoscale still follow the weights.
+# Returns the list of (zone, count) with a positive count, sorted by zone.
+def split_counts(count, weights, existing=None):
+    existing = existing or {}
+    zones = sorted(z for z, w in weights.items() if w > 0)
+    if not zones:
+        raise ValueError('no zone with a positive weight')
+    counts = dict((z, 0) for z in zones)
+    for i in range(count):
+        # the zone furthest below its share
+        zone = min(zones, key=lambda z: ((existing.get(z, 0) + counts[z]) / float(weights[z]), z))
+        counts[zone] += 1
+    return [(z, counts[z]) for z in zones if counts[z] > 0]
+
+# The available zones of the region of conn.
+def get_zones(conn):
+    return sorted(z.name for z in conn.get_all_zones() if z.state == 'available')
+
+# Zones to launch count slaves in with the given strategy: the master's zone,
+# or with spread the zones of zone_weights, all the available zones evenly if empty.
+# existing_slaves are taken into account to keep the spread balanced.
+# Returns the list of (zone, count).
+def plan_zones(conn, strategy, zone_weights, master_zone, count, existing_slaves=()):
+    if strategy != 'spread':
+        return [(master_zone, count)]
+    weights = zone_weights or dict((z, 1.0) for z in get_zones(conn))
+    existing = {}
+    for s in existing_slaves:
+        existing[s.placement] = existing.get(s.placement, 0) + 1
+    return split_counts(count, weights, existing)
+
+# Name of the cluster placement group of the slaves of a cluster.
+def get_group_name(cluster_name):
+    return cluster_name + '-slaves'
+
+# Get the cluster placement group of the given name, creating it if it doesn't exist.
+def get_or_make_group(conn, name):
+    if not [g for g in conn.get_all_placement_groups() if g.name == name]:
+        print "Creating placement group " + name
+        conn.create_placement_group(name, strategy='cluster')
+    return name
+
+# Delete a placement group once the instances in it are terminated, waiting up to
+# timeout seconds for the ones shutting down. Returns whether it was deleted.
+def delete_group(conn, name, timeout, poll=10):
+    deadline = time.time() + timeout
+    while True:
+        reservations = conn.get_all_instances(filters={
+            'placement-group-name': name,
+            'instance-state-name': ec2_util.ACTIVE_STATES + ['shutting-down']})
+        left = [i for res in reservations for i in res.instances]
+        if not left:
+            break
+        if time.time() > deadline:
+            print >> sys.stderr, ("WARNING: placement group %s is kept, %d instance(s) are "
+                                  "still in it" % (name, len(left)))
+            return False
+        time.sleep(poll)
+    try:
+        ec2_util.retry_ec2_call(lambda: conn.delete_placement_group(name))
+    except EC2ResponseError as e:
+        print >> sys.stderr, "WARNING: cannot delete placement group %s: %s" % (name, e.error_code)
+        return False
+    print "Deleted placement group " + name
+    return True
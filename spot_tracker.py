@@ -0,0 +1,219 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+Follow spot instance requests until they are fulfilled,
+re-submitting the ones that stay open or get cancelled.
+"""
+import random
+import sys
+import time
+from boto.exception import EC2ResponseError
+import ec2_util
+
+# Spot request states after which the request will never be fulfilled.
+DEAD_STATES = ['cancelled', 'failed', 'closed']
+
+# Whether a spot request launched an instance that is still there: a request
+# cancelled after its fulfillment keeps its instance running.
+def has_instance(req):
+    return bool(req.instance_id) and req.state in ['active', 'cancelled']
+
+class TrackedRequest(object):
+    """
+    A spot request, the launch spec it was submitted with and its outcome.
+    origin is when the first request for this instance was submitted,
+    fulfillment latency counts from there across re-submissions.
+    """
+    def __init__(self, request, spec, submitted, origin=None):
+        self.request = request
+        self.spec = spec
+        self.submitted = submitted
+        self.origin = origin or submitted
+        self.fulfilled = None
+        self.instance_id = None
+        self.outcome = 'open'
+
+    def latency(self):
+        if self.fulfilled is None:
+            return None
+        return self.fulfilled - self.origin
+
+
+class SpotTracker(object):
+    """
+    Poll spot requests in batches, tag their instances as soon as they are
+    fulfilled, and re-submit requests that stay open longer than open_timeout
+    or die, using the next launch spec.
+
+    Parameters
+    ----------
+    conn: the EC2 connection
+    submit: function (spec, count) that submits count spot requests with
+        the launch spec number spec, and returns the new boto requests
+    nspecs: the number of launch specs submit accepts
+    tags: tags set on the fulfilled instances
+    open_timeout: seconds a request may stay open before it is re-submitted
+    """
+    def __init__(self, conn, submit, nspecs, tags, open_timeout=120,
+                 min_delay=2.0, max_delay=30.0):
+        self.conn = conn
+        self.submit = submit
+        self.nspecs = nspecs
+        self.tags = tags
+        self.open_timeout = open_timeout
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.requests = []
+
+    def add(self, requests, spec, origins=None):
+        now = time.time()
+        origins = origins or [None] * len(requests)
+        for req, origin in zip(requests, origins):
+            self.requests.append(TrackedRequest(req, spec, now, origin))
+
+    def launch(self, spec, count, origins=None):
+        """
+        Submit count requests with the launch spec number spec and track them.
+        When EC2 rejects the submission, e.g. for a type the zone does not offer,
+        the next launch specs are tried in turn. Returns whether one was accepted.
+        """
+        while spec < self.nspecs:
+            try:
+                requests = ec2_util.retry_ec2_call(lambda: self.submit(spec, count))
+            except EC2ResponseError as e:
+                print >> sys.stderr, ("WARNING: submitting %d spot request(s) with launch spec "
+                                      "%d failed: %s %s" % (count, spec, e.error_code,
+                                                            e.error_message))
+                spec += 1
+                continue
+            self.add(requests, spec, origins)
+            return True
+        print >> sys.stderr, ("WARNING: giving up on %d spot request(s), no launch "
+                              "spec left to try" % count)
+        return False
+
+    def pending(self):
+        return [r for r in self.requests if r.outcome == 'open']
+
+    def fulfilled(self):
+        return [r for r in self.requests if r.outcome == 'fulfilled']
+
+    def poll(self):
+        """
+        One poll cycle, returns the number of requests fulfilled in it.
+        """
+        pending = dict((r.request.id, r) for r in self.pending())
+        states = []
+        for ids in ec2_util.chunks(pending.keys(), ec2_util.DESCRIBE_CHUNK_SIZE):
+            states += ec2_util.retry_ec2_call(
+                lambda: self.conn.get_all_spot_instance_requests(request_ids=ids))
+        now = time.time()
+        ready = []
+        retry = []
+        for req in states:
+            tracked = pending[req.id]
+            if has_instance(req):
+                tracked.instance_id = req.instance_id
+                ready.append(tracked)
+            elif req.state in DEAD_STATES:
+                tracked.outcome = req.state
+                retry.append(tracked)
+            elif now - tracked.submitted > self.open_timeout:
+                tracked.outcome = 'timeout'
+                retry.append(tracked)
+        self.fulfill(ready, now)
+        late = self.cancel([r for r in retry if r.outcome == 'timeout'])
+        self.resubmit([r for r in retry if r not in late])
+        return len(ready) + len(late)
+
+    def fulfill(self, ready, now):
+        """
+        Mark the requests of ready, whose instance_id is set, fulfilled and tag their instances.
+        """
+        if not ready:
+            return
+        for r in ready:
+            r.outcome = 'fulfilled'
+            r.fulfilled = now
+        ec2_util.tag_instances(self.conn, [r.instance_id for r in ready], self.tags)
+        for r in ready:
+            print "Spot request %s fulfilled by %s after %.0f seconds" % (
+                r.request.id, r.instance_id, r.latency())
+
+    def cancel(self, tracked):
+        """
+        Cancel the requests of tracked. A request may be fulfilled between the
+        last poll and its cancellation, which does not terminate its instance:
+        these requests are described again, marked fulfilled and returned.
+        """
+        ids = [r.request.id for r in tracked]
+        for chunk in ec2_util.chunks(ids, ec2_util.DESCRIBE_CHUNK_SIZE):
+            ec2_util.retry_ec2_call(lambda: self.conn.cancel_spot_instance_requests(chunk))
+        by_id = dict((r.request.id, r) for r in tracked)
+        late = []
+        for chunk in ec2_util.chunks(ids, ec2_util.DESCRIBE_CHUNK_SIZE):
+            for req in ec2_util.retry_ec2_call(
+                    lambda: self.conn.get_all_spot_instance_requests(request_ids=chunk)):
+                if has_instance(req):
+                    by_id[req.id].instance_id = req.instance_id
+                    late.append(by_id[req.id])
+        self.fulfill(late, time.time())
+        return late
+
+    def resubmit(self, retry):
+        by_spec = {}
+        for r in retry:
+            by_spec.setdefault(r.spec + 1, []).append(r)
+        for spec, reqs in sorted(by_spec.items()):
+            if spec < self.nspecs:
+                print "Re-submitting %d spot request(s) with launch spec %d" % (len(reqs), spec)
+            self.launch(spec, len(reqs), [r.origin for r in reqs])
+
+    def run(self, timeout):
+        """
+        Poll until every request is fulfilled or given up, or timeout seconds passed.
+        Returns the number of requests still open, which are cancelled.
+        """
+        deadline = time.time() + timeout
+        delay = self.min_delay
+        while self.pending():
+            if self.poll():
+                delay = self.min_delay
+            now = time.time()
+            if not self.pending() or now >= deadline:
+                break
+            time.sleep(min(delay * random.uniform(0.5, 1.0), deadline - now))
+            delay = min(self.max_delay, delay * 1.5)
+        left = self.pending()
+        late = self.cancel(left)
+        left = [r for r in left if r not in late]
+        for r in left:
+            r.outcome = 'unfulfilled'
+        return len(left)
+
+    def report(self, specs):
+        """
+        Print the outcome and fulfillment latency of every request.
+        specs gives a description of each launch spec.
+        """
+        print '%-16s %-40s %-12s %10s' % ('request', 'launch spec', 'outcome', 'latency(s)')
+        for r in self.requests:
+            latency = r.latency()
+            print '%-16s %-40s %-12s %10s' % (
+                r.request.id, specs[r.spec], r.outcome,
+                '%.0f' % latency if latency is not None else '-')
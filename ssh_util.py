@@ -0,0 +1,197 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+Run commands on the nodes of a cluster through ssh,
+on many hosts at once with bounded concurrency.
+"""
+import os
+import pipes
+import random
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+# The ssh binary to run, can be pointed to a fake ssh for local testing.
+SSH_BINARY = os.getenv('YARN_EC2_SSH', 'ssh')
+# ssh exits with 255 when the connection itself failed.
+SSH_CONNECT_ERROR = 255
+
+def stringify_command(parts):
+    if isinstance(parts, basestring):
+        return parts
+    else:
+        return ' '.join(map(pipes.quote, parts))
+
+def ssh_args(opts):
+    parts = ['-o', 'StrictHostKeyChecking=no']
+    if opts.identity_file is not None:
+        parts += ['-i', opts.identity_file]
+    return parts
+
+# Options that let consecutive ssh sessions to a host share one connection.
+# %C is a hash of the connection, as a socket path built from the long EC2
+# host names goes past the limit of unix sockets; ssh gives up with 255
+# when the directory of the socket is missing.
+def control_args(persist=60):
+    dirname = os.path.join(os.path.expanduser('~'), '.ssh')
+    if not os.path.isdir(dirname):
+        try:
+            os.makedirs(dirname, 0700)
+        except OSError:
+            # created by another session in the meantime
+            pass
+    path = os.path.join(dirname, 'yarn-ec2-%C')
+    return ['-o', 'ControlMaster=auto',
+            '-o', 'ControlPath=%s' % path,
+            '-o', 'ControlPersist=%d' % persist]
+
+def ssh_command(opts):
+    return [SSH_BINARY] + ssh_args(opts)
+
+# Seconds to wait before retry number tries, exponential with jitter.
+def backoff_delay(tries, min_delay=2.0, max_delay=60.0):
+    return min(max_delay, min_delay * (2 ** tries)) * random.uniform(0.5, 1.0)
+
+
+class HostResult(object):
+    """
+    Outcome of running a command on one host.
+    """
+    def __init__(self, host):
+        self.host = host
+        self.returncode = None
+        self.timed_out = False
+        self.tries = 0
+        self.elapsed = 0.0
+        self.output = []
+
+    def ok(self):
+        return self.returncode == 0
+
+
+class Executor(object):
+    """
+    Run commands on many hosts through ssh with bounded concurrency.
+
+    Output lines are streamed to out as they arrive, prefixed with the host name.
+    Connection failures are retried with exponential backoff, remote command
+    failures are not, as the command might not be safe to run twice.
+
+    Parameters
+    ----------
+    opts: the parsed options, providing user and identity_file
+    parallel: the maximum number of concurrent ssh sessions
+    timeout: seconds after which a session is killed, None for no limit
+    retries: how many times to retry a failed connection
+    control_master: whether to reuse connections with ssh ControlMaster
+    """
+    def __init__(self, opts, parallel=20, timeout=None, retries=5,
+                 control_master=True, out=sys.stdout):
+        self.opts = opts
+        self.parallel = parallel
+        self.timeout = timeout
+        self.retries = retries
+        self.control_master = control_master
+        self.out = out
+        self.lock = threading.Lock()
+
+    def command(self, host, command):
+        cmd = ssh_command(self.opts)
+        if self.control_master:
+            cmd += control_args()
+        return cmd + ['%s@%s' % (self.opts.user, host), stringify_command(command)]
+
+    def _emit(self, host, line, capture, result):
+        if capture:
+            result.output.append(line)
+        else:
+            with self.lock:
+                self.out.write('[%s] %s' % (host, line))
+                self.out.flush()
+
+    def run_host(self, host, command, stdin=None, capture=False):
+        """
+        Run command on host, returns a HostResult.
+        When capture is set the output is kept in the result instead of printed.
+        """
+        result = HostResult(host)
+        start = time.time()
+        while True:
+            result.tries += 1
+            result.output = []
+            proc = subprocess.Popen(self.command(host, command),
+                                    stdin=subprocess.PIPE,
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.STDOUT)
+            killed = []
+            timer = None
+            if self.timeout:
+                def kill():
+                    killed.append(True)
+                    proc.kill()
+                timer = threading.Timer(self.timeout, kill)
+                timer.start()
+            writer = threading.Thread(target=self._feed, args=(proc, stdin))
+            writer.start()
+            for line in iter(proc.stdout.readline, ''):
+                self._emit(host, line, capture, result)
+            result.returncode = proc.wait()
+            writer.join()
+            if timer is not None:
+                timer.cancel()
+            if killed:
+                result.timed_out = True
+                self._emit(host, 'timed out after %d seconds\n' % self.timeout, False, result)
+                break
+            if result.returncode != SSH_CONNECT_ERROR or result.tries > self.retries:
+                break
+            delay = backoff_delay(result.tries - 1)
+            self._emit(host, 'ssh connection failed, retrying in %.1f seconds\n' % delay,
+                       False, result)
+            time.sleep(delay)
+        result.elapsed = time.time() - start
+        return result
+
+    @staticmethod
+    def _feed(proc, stdin):
+        try:
+            if stdin:
+                proc.stdin.write(stdin)
+            proc.stdin.close()
+        except IOError:
+            pass
+
+    def run(self, hosts, command, stdin=None, capture=False):
+        """
+        Run command on all hosts, returns the list of HostResult in host order.
+        command and stdin can also be functions of the host.
+        """
+        if not hosts:
+            return []
+        def run_one(host):
+            cmd = command(host) if callable(command) else command
+            data = stdin(host) if callable(stdin) else stdin
+            return self.run_host(host, cmd, data, capture)
+        pool = ThreadPool(min(self.parallel, len(hosts)))
+        try:
+            # get with a timeout so that KeyboardInterrupt is delivered
+            return pool.map_async(run_one, hosts).get(1 << 30)
+        finally:
+            pool.terminate()
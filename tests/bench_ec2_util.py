@@ -0,0 +1,91 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+Count the EC2 calls and the instances sent back by EC2 for the operations of
+ec2_util against a fake connection, for growing clusters and accounts.
+The fake applies the filters in memory, so only the counts are meaningful,
+not the time the lookups take.
+
+    python tests/bench_ec2_util.py
+"""
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import ec2_util
+from fake_ec2 import FakeEC2Connection
+
+# The lookup made before the discovery used server side filters:
+# every reservation of the region, matched on the security groups in python.
+def scan_all(conn, cluster_name):
+    master_group, slave_group = ec2_util.get_group_names(cluster_name)
+    found = [i for res in conn.get_all_instances() for i in res.instances
+             if set(g.name for g in i.groups) & set([master_group, slave_group])]
+    return found
+
+# Run fn with the progress messages of ec2_util discarded.
+def quiet(fn):
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        return fn()
+    finally:
+        sys.stdout = stdout
+
+def bench_discovery():
+    print 'Cluster discovery'
+    print '%8s %8s | %-17s | %-17s' % ('cluster', 'account', 'filtered lookup', 'full scan')
+    print '%8s %8s | %6s %10s | %6s %10s' % ('', '', 'calls', 'returned', 'calls', 'returned')
+    for cluster in [10, 100, 1000]:
+        for account in [0, 10000, 100000]:
+            conn = FakeEC2Connection()
+            conn.add_instances(account, ['default'])
+            conn.add_cluster('bench', cluster)
+            row = []
+            for lookup in [lambda: ec2_util.get_existing_cluster(conn, 'bench'),
+                           lambda: scan_all(conn, 'bench')]:
+                conn.reset()
+                quiet(lookup)
+                row += [conn.ncalls(), conn.returned]
+            print '%8d %8d | %6d %10d | %6d %10d' % tuple(
+                [cluster + 1, account + cluster + 1] + row)
+
+# The tagging made before the bulk tagging: one add_tag call per instance and tag.
+def tag_each(conn, instances, tags):
+    for inst in instances:
+        for key, value in tags.items():
+            conn.create_tags([inst.id], {key: value})
+
+def bench_tagging():
+    print 'Tagging launched instances'
+    print '%8s | %-10s | %-10s' % ('nodes', 'bulk', 'per node')
+    print '%8s | %10s | %10s' % ('', 'calls', 'calls')
+    tags = ec2_util.get_cluster_tags('bench', 'slave')
+    for nodes in [10, 100, 1000]:
+        conn = FakeEC2Connection()
+        slaves = conn.add_instances(nodes, ['bench-slave'])
+        row = []
+        for tag in [ec2_util.tag_instances, tag_each]:
+            conn.reset()
+            tag(conn, slaves, tags)
+            row.append(conn.ncalls())
+        print '%8d | %10d | %10d' % tuple([nodes] + row)
+
+if __name__ == '__main__':
+    bench_discovery()
+    print
+    bench_tagging()
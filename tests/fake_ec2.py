@@ -0,0 +1,284 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+An in-memory EC2 connection for the tests and benchmarks, counting the API
+calls made and the instances EC2 would send back for them.
+"""
+import itertools
+import threading
+import time
+from boto.exception import EC2ResponseError
+import ec2_util
+
+
+class FakeGroup(object):
+    def __init__(self, name):
+        self.name = name
+
+
+class FakeZone(object):
+    def __init__(self, name, state='available'):
+        self.name = name
+        self.state = state
+
+
+class FakePlacementGroup(object):
+    def __init__(self, name, strategy):
+        self.name = name
+        self.strategy = strategy
+
+
+class FakeStatus(object):
+    def __init__(self, status):
+        self.status = status
+
+
+class FakeInstanceStatus(object):
+    def __init__(self, inst):
+        self.id = inst.id
+        self.state_name = inst.state
+        self.system_status = FakeStatus(inst.system_status)
+
+
+class FakeInstance(object):
+    def __init__(self, id, groups, state='running', tags=None, ami_launch_index=0,
+                 placement='us-west-2a', instance_type='m3.xlarge', system_status='ok',
+                 launch_time=None, placement_group=None):
+        self.id = id
+        self.groups = [FakeGroup(g) for g in groups]
+        self.state = state
+        self.tags = dict(tags or {})
+        self.ami_launch_index = ami_launch_index
+        self.placement = placement
+        self.instance_type = instance_type
+        self.system_status = system_status
+        self.launch_time = launch_time or time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime())
+        self.placement_group = placement_group
+        self.private_dns_name = 'ip-%s.internal' % id
+        self.public_dns_name = 'ec2-%s.amazonaws.com' % id
+
+    def copy(self):
+        return FakeInstance(self.id, [g.name for g in self.groups], self.state, self.tags,
+                            self.ami_launch_index, self.placement, self.instance_type,
+                            self.system_status, self.launch_time, self.placement_group)
+
+    def _update(self, fresh):
+        self.__dict__.update(fresh.__dict__)
+
+
+class FakeSpotRequest(object):
+    def __init__(self, id, state='open', instance_id=None):
+        self.id = id
+        self.state = state
+        self.instance_id = instance_id
+
+
+class FakeReservation(object):
+    def __init__(self, id, instances):
+        self.id = id
+        self.instances = instances
+
+
+class FakeEC2Connection(object):
+    """
+    Keeps instances in memory and answers the EC2 calls yarn-ec2 makes on them,
+    applying the filters on the server side as EC2 does.
+
+    calls counts the calls made per API name, and returned the number of
+    instances sent back by DescribeInstances, the cost of a lookup.
+    failures maps an API name to the error codes its next calls fail with.
+    capacity maps an (instance type, zone) to the number of instances
+    RunInstances can still launch there, without limit if it is not in it.
+    """
+    def __init__(self):
+        self.instances = []
+        self.calls = {}
+        self.returned = 0
+        self.failures = {}
+        self.spot_requests = {}
+        # spot requests fulfilled at the moment they are cancelled
+        self.fulfill_on_cancel = set()
+        self.zones = [FakeZone('us-west-2%s' % z) for z in 'abc']
+        self.placement_groups = {}
+        self.capacity = {}
+        self.run_requests = []
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+
+    def _count(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.failures.get(name):
+            e = EC2ResponseError(400, 'Bad Request')
+            e.error_code = self.failures[name].pop(0)
+            raise e
+
+    def ncalls(self, name=None):
+        if name is None:
+            return sum(self.calls.values())
+        return self.calls.get(name, 0)
+
+    def reset(self):
+        self.calls = {}
+        self.returned = 0
+
+    def add_instances(self, count, groups, **kwargs):
+        """
+        Add count instances in the given security groups, returns them.
+        """
+        added = []
+        for i in range(count):
+            added.append(FakeInstance('i-%08x' % next(self._ids), groups,
+                                      ami_launch_index=i, **kwargs))
+        self.instances += added
+        return added
+
+    def add_cluster(self, cluster_name, nslaves, nmasters=1, tagged=True):
+        """
+        Add a cluster launched by yarn-ec2, returns its masters and slaves.
+        """
+        master_group, slave_group = ec2_util.get_group_names(cluster_name)
+        masters = self.add_instances(nmasters, [master_group], tags=(
+            ec2_util.get_cluster_tags(cluster_name, 'master') if tagged else None))
+        slaves = self.add_instances(nslaves, [slave_group], tags=(
+            ec2_util.get_cluster_tags(cluster_name, 'slave') if tagged else None))
+        return masters, slaves
+
+    def _match(self, inst, filters):
+        for key, value in (filters or {}).items():
+            values = value if isinstance(value, list) else [value]
+            if key == 'instance-state-name':
+                actual = [inst.state]
+            elif key == 'instance.group-name':
+                actual = [g.name for g in inst.groups]
+            elif key.startswith('tag:'):
+                actual = [inst.tags.get(key[4:])]
+            elif key == 'placement-group-name':
+                actual = [inst.placement_group]
+            else:
+                raise ValueError('unsupported filter ' + key)
+            if not set(values) & set(actual):
+                return False
+        return True
+
+    def get_all_instances(self, instance_ids=None, filters=None):
+        self._count('DescribeInstances')
+        found = [i.copy() for i in self.instances
+                 if (instance_ids is None or i.id in instance_ids) and self._match(i, filters)]
+        self.returned += len(found)
+        return [FakeReservation('r-%s' % i.id, [i]) for i in found]
+
+    def get_only_instances(self, instance_ids=None, filters=None):
+        return [i for res in self.get_all_instances(instance_ids, filters) for i in res.instances]
+
+    def get_all_instance_status(self, instance_ids=None, include_all_instances=False):
+        self._count('DescribeInstanceStatus')
+        return [FakeInstanceStatus(i) for i in self.instances
+                if instance_ids is None or i.id in instance_ids]
+
+    def create_tags(self, resource_ids, tags):
+        self._count('CreateTags')
+        for inst in self.instances:
+            if inst.id in resource_ids:
+                inst.tags.update(tags)
+        return True
+
+    def add_spot_requests(self, count):
+        """
+        Add count open spot requests, returns them.
+        """
+        added = [FakeSpotRequest('sir-%08x' % next(self._ids)) for i in range(count)]
+        for req in added:
+            self.spot_requests[req.id] = req
+        return added
+
+    def fulfill_spot_request(self, request_id):
+        """
+        Launch the instance of an open spot request, returns it.
+        """
+        req = self.spot_requests[request_id]
+        inst = self.add_instances(1, ['spot'])[0]
+        req.state = 'active'
+        req.instance_id = inst.id
+        return inst
+
+    def get_all_spot_instance_requests(self, request_ids=None):
+        self._count('DescribeSpotInstanceRequests')
+        return [FakeSpotRequest(r.id, r.state, r.instance_id)
+                for r in self.spot_requests.values()
+                if request_ids is None or r.id in request_ids]
+
+    def cancel_spot_instance_requests(self, request_ids):
+        self._count('CancelSpotInstanceRequests')
+        for rid in request_ids:
+            if rid in self.fulfill_on_cancel:
+                self.fulfill_spot_request(rid)
+            # the instance of a fulfilled request keeps running
+            self.spot_requests[rid].state = 'cancelled'
+        return True
+
+    def terminate_instances(self, instance_ids):
+        self._count('TerminateInstances')
+        terminated = [i for i in self.instances if i.id in instance_ids]
+        for inst in terminated:
+            inst.state = 'terminated'
+        return terminated
+
+    def get_all_zones(self):
+        self._count('DescribeAvailabilityZones')
+        return list(self.zones)
+
+    def get_all_placement_groups(self):
+        self._count('DescribePlacementGroups')
+        return list(self.placement_groups.values())
+
+    def create_placement_group(self, name, strategy='cluster'):
+        self._count('CreatePlacementGroup')
+        if name in self.placement_groups:
+            e = EC2ResponseError(400, 'Bad Request')
+            e.error_code = 'InvalidPlacementGroup.Duplicate'
+            raise e
+        self.placement_groups[name] = FakePlacementGroup(name, strategy)
+        return True
+
+    def delete_placement_group(self, name):
+        self._count('DeletePlacementGroup')
+        if name not in self.placement_groups:
+            e = EC2ResponseError(400, 'Bad Request')
+            e.error_code = 'InvalidPlacementGroup.Unknown'
+            raise e
+        del self.placement_groups[name]
+        return True
+
+    def run_instances(self, image_id, min_count=1, max_count=1, security_groups=None,
+                      instance_type='m3.xlarge', placement='us-west-2a', placement_group=None,
+                      **kwargs):
+        with self._lock:
+            self._count('RunInstances')
+            self.run_requests.append((instance_type, placement, min_count, max_count))
+            left = self.capacity.get((instance_type, placement), max_count)
+            if left < min_count:
+                e = EC2ResponseError(500, 'Server Error')
+                e.error_code = 'InsufficientInstanceCapacity'
+                raise e
+            count = min(left, max_count)
+            if (instance_type, placement) in self.capacity:
+                self.capacity[(instance_type, placement)] -= count
+            instances = self.add_instances(count, security_groups or [], state='pending',
+                                           instance_type=instance_type, placement=placement,
+                                           placement_group=placement_group)
+            return FakeReservation('r-%08x' % next(self._ids), instances)
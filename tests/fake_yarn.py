@@ -0,0 +1,85 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+A resource manager for the tests, answering the calls yarn_util makes on
+the master: the node list, and the commands run there over ssh.
+"""
+import re
+import threading
+import time
+import yarn_util
+
+
+class FakeResourceManager(object):
+    """
+    Nodes being decommissioned finish one container per node list request,
+    and leave once they run none. stuck hosts never finish their containers,
+    refreshNodes gives up on them after timeout seconds like rmadmin -g.
+
+    commands keeps the commands run on the master, fail_refresh makes
+    yarn rmadmin fail.
+    """
+    def __init__(self, nodes, stuck=(), fail_refresh=False):
+        self.nodes = dict((host, {'nodeHostName': host, 'state': 'RUNNING',
+                                  'numContainers': count})
+                          for host, count in nodes.items())
+        self.stuck = set(stuck)
+        self.fail_refresh = fail_refresh
+        self.commands = []
+        self.lock = threading.Lock()
+        self.saved = None
+
+    def install(self):
+        self.saved = (yarn_util.get_nodes, yarn_util._run_on_master)
+        yarn_util.get_nodes = self.get_nodes
+        yarn_util._run_on_master = self.run_on_master
+
+    def uninstall(self):
+        yarn_util.get_nodes, yarn_util._run_on_master = self.saved
+
+    def get_nodes(self, master):
+        with self.lock:
+            for node in self.nodes.values():
+                if node['state'] == 'DECOMMISSIONING' and node['nodeHostName'] not in self.stuck:
+                    if node['numContainers'] > 0:
+                        node['numContainers'] -= 1
+                    else:
+                        node['state'] = 'DECOMMISSIONED'
+            return [dict(n) for n in self.nodes.values()]
+
+    def decommissioning(self):
+        with self.lock:
+            return [n for n in self.nodes.values() if n['state'] == 'DECOMMISSIONING']
+
+    def run_on_master(self, opts, master, command):
+        self.commands.append(command)
+        m = re.match(r"printf '(.*)\\n' >> \S+ && yarn rmadmin -refreshNodes -g (\d+)$", command)
+        if m is None:
+            return True
+        if self.fail_refresh:
+            return False
+        with self.lock:
+            for host in m.group(1).split('\\n'):
+                self.nodes[host]['state'] = 'DECOMMISSIONING'
+        deadline = time.time() + int(m.group(2))
+        while self.decommissioning() and time.time() < deadline:
+            time.sleep(0.001)
+        with self.lock:
+            for host in m.group(1).split('\\n'):
+                self.nodes[host]['state'] = 'DECOMMISSIONED'
+        return True
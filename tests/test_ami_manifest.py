@@ -0,0 +1,148 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import ami_manifest
+import bootstrap
+import yarn_ec2
+
+
+class AmiManifestTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'yarn-ec2', 'amis.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_round_trip(self):
+        manifest = ami_manifest.AmiManifest(self.path)
+        self.assertEqual(manifest.get('us-west-2', 'hvm'), None)
+        manifest.put('us-west-2', 'hvm', 'ami-1', 'baked-hvm', 'hadoop-2.8.0', 'jdk1.8.0')
+        manifest.put('us-west-2', 'pvm', 'ami-2', 'baked-pvm', 'hadoop-2.8.0', 'jdk1.8.0')
+        manifest.put('us-east-1', 'hvm', 'ami-3', 'baked-hvm', 'hadoop-2.8.0', 'jdk1.8.0')
+        # read back from the file
+        manifest = ami_manifest.AmiManifest(self.path)
+        self.assertEqual(manifest.get('us-west-2', 'hvm'), 'ami-1')
+        self.assertEqual(manifest.get('us-west-2', 'pvm'), 'ami-2')
+        self.assertEqual(manifest.get('us-east-1', 'hvm'), 'ami-3')
+        self.assertEqual(manifest.get('us-east-1', 'pvm'), None)
+        # a new bake replaces the image of its region and type only
+        manifest.put('us-west-2', 'hvm', 'ami-4', 'baked-hvm', 'hadoop-2.8.0', 'jdk1.8.0')
+        self.assertEqual(manifest.get('us-west-2', 'hvm'), 'ami-4')
+        self.assertEqual(manifest.get('us-east-1', 'hvm'), 'ami-3')
+        self.assertEqual(sorted(json.load(open(self.path)).keys()),
+                         ['us-east-1/hvm', 'us-west-2/hvm', 'us-west-2/pvm'])
+
+    def test_versions_must_match(self):
+        manifest = ami_manifest.AmiManifest(self.path)
+        manifest.put('us-west-2', 'hvm', 'ami-1', 'baked-hvm', 'hadoop-2.8.0', 'jdk1.8.0')
+        self.assertEqual(manifest.get('us-west-2', 'hvm', 'hadoop-2.8.0', 'jdk1.8.0'), 'ami-1')
+        self.assertEqual(manifest.get('us-west-2', 'hvm', 'hadoop-2.9.0', 'jdk1.8.0'), None)
+        self.assertEqual(manifest.get('us-west-2', 'hvm', 'hadoop-2.8.0', 'jdk1.9.0'), None)
+
+    def test_unreadable_manifest(self):
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, 'w') as fo:
+            fo.write('{not json')
+        manifest = ami_manifest.AmiManifest(self.path)
+        self.assertEqual(manifest.get('us-west-2', 'hvm'), None)
+        manifest.put('us-west-2', 'hvm', 'ami-1', 'baked-hvm', 'hadoop-2.8.0', 'jdk1.8.0')
+        self.assertEqual(manifest.get('us-west-2', 'hvm'), 'ami-1')
+
+
+class GetAmiTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        path = os.path.join(self.tmp, 'amis.json')
+        self.manifest = ami_manifest.AmiManifest(path)
+        self.saved = yarn_ec2.ami_manifest.AmiManifest
+        yarn_ec2.ami_manifest.AmiManifest = lambda: self.manifest
+
+    def tearDown(self):
+        yarn_ec2.ami_manifest.AmiManifest = self.saved
+        shutil.rmtree(self.tmp)
+
+    def test_prefers_baked_image(self):
+        self.assertEqual(yarn_ec2.get_ami('c3.2xlarge', 'us-west-2'),
+                         yarn_ec2.get_base_ami('c3.2xlarge'))
+        self.manifest.put('us-west-2', 'hvm', 'ami-baked', 'baked-hvm',
+                          bootstrap.hadoop_dir, bootstrap.jdk_dir)
+        self.assertEqual(yarn_ec2.get_ami('c3.2xlarge', 'us-west-2'), 'ami-baked')
+        # not for another virtualization type or region
+        self.assertEqual(yarn_ec2.get_ami('m1.small', 'us-west-2'),
+                         yarn_ec2.get_base_ami('m1.small'))
+        self.assertEqual(yarn_ec2.get_ami('c3.2xlarge', 'us-east-1'),
+                         yarn_ec2.get_base_ami('c3.2xlarge'))
+
+    def test_stale_baked_image(self):
+        self.manifest.put('us-west-2', 'hvm', 'ami-baked', 'baked-hvm',
+                          'hadoop-0.1', bootstrap.jdk_dir)
+        self.assertEqual(yarn_ec2.get_ami('c3.2xlarge', 'us-west-2'),
+                         yarn_ec2.get_base_ami('c3.2xlarge'))
+
+
+class BakedImageTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.saved = (bootstrap.BAKED_MARKER, bootstrap.hadoop_dir, bootstrap.jdk_dir)
+        bootstrap.BAKED_MARKER = os.path.join(self.tmp, '.yarn-ec2-baked')
+        bootstrap.hadoop_dir = os.path.join(self.tmp, 'hadoop-2.8.0')
+        bootstrap.jdk_dir = os.path.join(self.tmp, 'jdk1.8.0')
+
+    def tearDown(self):
+        bootstrap.BAKED_MARKER, bootstrap.hadoop_dir, bootstrap.jdk_dir = self.saved
+        shutil.rmtree(self.tmp)
+
+    def mark(self, hadoop_dir=None, jdk_dir=None):
+        with open(bootstrap.BAKED_MARKER, 'w') as fo:
+            json.dump({'hadoop_dir': hadoop_dir or bootstrap.hadoop_dir,
+                       'jdk_dir': jdk_dir or bootstrap.jdk_dir, 'time': 0}, fo)
+
+    def test_marker_and_dirs(self):
+        self.assertFalse(bootstrap.baked_image())
+        self.mark()
+        self.assertFalse(bootstrap.baked_image())
+        os.mkdir(bootstrap.hadoop_dir)
+        self.assertFalse(bootstrap.baked_image())
+        os.mkdir(bootstrap.jdk_dir)
+        self.assertTrue(bootstrap.baked_image())
+        os.rmdir(bootstrap.hadoop_dir)
+        self.assertFalse(bootstrap.baked_image())
+
+    def test_other_versions(self):
+        os.mkdir(bootstrap.hadoop_dir)
+        os.mkdir(bootstrap.jdk_dir)
+        self.mark(hadoop_dir='hadoop-2.7.3')
+        self.assertFalse(bootstrap.baked_image())
+        self.mark(jdk_dir='jdk1.7.0')
+        self.assertFalse(bootstrap.baked_image())
+
+    def test_broken_marker(self):
+        os.mkdir(bootstrap.hadoop_dir)
+        os.mkdir(bootstrap.jdk_dir)
+        with open(bootstrap.BAKED_MARKER, 'w') as fo:
+            fo.write('')
+        self.assertFalse(bootstrap.baked_image())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,228 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import os
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+from boto.exception import EC2ResponseError
+import autoscale
+import ec2_util
+import yarn_util
+from fake_ec2 import FakeEC2Connection
+
+
+class ScalePolicyTest(unittest.TestCase):
+    def policy(self, **kwargs):
+        args = dict(min_slaves=0, max_slaves=20, containers_per_slave=4,
+                    scale_up_after=60, idle_after=300, cooldown=300, max_step=10)
+        args.update(kwargs)
+        return autoscale.ScalePolicy(**args)
+
+    def test_adds_after_pending_for_a_while(self):
+        policy = self.policy()
+        nodes = {'a': 4}
+        self.assertEqual(policy.decide(0, 10, nodes, 0), None)
+        self.assertEqual(policy.decide(59, 10, nodes, 0), None)
+        # enough slaves for the pending containers
+        self.assertEqual(policy.decide(60, 10, nodes, 0), ('add', 3))
+
+    def test_pending_clock_restarts(self):
+        policy = self.policy()
+        policy.decide(0, 10, {}, 0)
+        policy.decide(30, 0, {}, 0)
+        self.assertEqual(policy.decide(70, 10, {}, 0), None)
+        self.assertEqual(policy.decide(130, 10, {}, 0), ('add', 3))
+
+    def test_launching_slaves_count(self):
+        policy = self.policy()
+        policy.decide(0, 10, {}, 2)
+        self.assertEqual(policy.decide(60, 10, {}, 2), ('add', 1))
+        policy = self.policy()
+        policy.decide(0, 8, {}, 2)
+        self.assertEqual(policy.decide(60, 8, {}, 2), None)
+
+    def test_cooldown(self):
+        policy = self.policy()
+        policy.decide(0, 100, {}, 0)
+        self.assertEqual(policy.decide(60, 100, {}, 0), ('add', 10))
+        self.assertEqual(policy.decide(359, 100, {}, 10), None)
+        self.assertEqual(policy.decide(360, 100, {}, 10), ('add', 10))
+
+    def test_bounds(self):
+        policy = self.policy(min_slaves=2, max_slaves=5, max_step=2)
+        self.assertEqual(policy.decide(0, 0, {}, 0), ('add', 2))
+        policy = self.policy(max_slaves=5, max_step=10)
+        policy.decide(0, 100, {'a': 4, 'b': 4}, 0)
+        self.assertEqual(policy.decide(60, 100, {'a': 4, 'b': 4}, 0), ('add', 3))
+        policy = self.policy(max_slaves=5)
+        policy.decide(0, 100, {'a': 4}, 4)
+        self.assertEqual(policy.decide(60, 100, {'a': 4}, 4), None)
+        policy = self.policy(max_step=2)
+        policy.decide(0, 100, {}, 0)
+        self.assertEqual(policy.decide(60, 100, {}, 0), ('add', 2))
+
+    def test_removes_idle_slaves(self):
+        policy = self.policy(min_slaves=1)
+        nodes = {'a': 0, 'b': 0, 'c': 2}
+        self.assertEqual(policy.decide(0, 0, nodes, 0), None)
+        # b ran a container in the meantime, its idle clock restarts
+        policy.decide(100, 0, {'a': 0, 'b': 1, 'c': 2}, 0)
+        policy.decide(200, 0, nodes, 0)
+        self.assertEqual(policy.decide(300, 0, nodes, 0), ('remove', ['a']))
+        self.assertEqual(policy.decide(500, 0, {'b': 0, 'c': 2}, 0), None)
+        self.assertEqual(policy.decide(600, 0, {'b': 0, 'c': 2}, 0), ('remove', ['b']))
+
+    def test_keeps_min_slaves(self):
+        policy = self.policy(min_slaves=2)
+        nodes = {'a': 0, 'b': 0, 'c': 0}
+        policy.decide(0, 0, nodes, 0)
+        decision = policy.decide(300, 0, nodes, 0)
+        self.assertEqual(decision[0], 'remove')
+        self.assertEqual(len(decision[1]), 1)
+
+    def test_no_removal_while_pending(self):
+        policy = self.policy(scale_up_after=1000)
+        nodes = {'a': 0, 'b': 4}
+        policy.decide(0, 1, nodes, 0)
+        self.assertEqual(policy.decide(400, 1, nodes, 0), None)
+
+
+class SimulateTest(unittest.TestCase):
+    # an hour of no demand, a burst of 40 containers for an hour, then nothing
+    TRACE = [(0, 0), (3600, 40), (7200, 0), (10800, 0)]
+
+    def simulate(self, **kwargs):
+        policy = autoscale.ScalePolicy(min_slaves=1, max_slaves=20, containers_per_slave=4,
+                                       scale_up_after=60, idle_after=300, cooldown=120,
+                                       **kwargs)
+        return autoscale.simulate(policy, self.TRACE, 4, slaves=1, boot_time=300, interval=30)
+
+    def test_follows_the_demand(self):
+        result = self.simulate()
+        self.assertEqual(result['peak_slaves'], 10)
+        # nine slaves added at once, and removed at once when they are idle
+        self.assertEqual(result['actions'], 2)
+        # one slave all along, ten for most of the burst
+        self.assertTrue(3 < result['slave_hours'] < 3 + 10 * 1.5, result)
+        # the burst waits for the slaves to boot
+        self.assertTrue(0 < result['pending_container_hours'] < 40 * 0.25, result)
+
+    def test_static_cluster(self):
+        policy = autoscale.ScalePolicy(min_slaves=2, max_slaves=2, containers_per_slave=4)
+        result = autoscale.simulate(policy, self.TRACE, 4, slaves=2, interval=30)
+        self.assertEqual((result['peak_slaves'], result['actions']), (2, 0))
+        self.assertAlmostEqual(result['slave_hours'], 2 * (10800 + 30) / 3600.0)
+        self.assertAlmostEqual(result['pending_container_hours'], 32.0, places=0)
+
+    def test_load_trace(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            fname = os.path.join(tmp, 'trace.jsonl')
+            with open(fname, 'w') as fo:
+                fo.write('{"time": 1060, "demand": 3}\n\n{"time": 1000, "demand": 1}\n')
+            self.assertEqual(autoscale.load_trace(fname), [(0.0, 1), (60.0, 3)])
+            open(fname, 'w').close()
+            self.assertRaises(ValueError, autoscale.load_trace, fname)
+        finally:
+            shutil.rmtree(tmp)
+
+
+class StopLoop(Exception):
+    pass
+
+
+class FlakyCluster(object):
+    def __init__(self, errors):
+        self.errors = errors
+        self.observed = 0
+
+    def observe(self):
+        self.observed += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return {'pending': 0, 'allocated': 0, 'nodes': {}, 'launching': 0, 'metrics': None}
+
+
+class AutoscalerRunTest(unittest.TestCase):
+    def setUp(self):
+        self.sleep = autoscale.time.sleep
+        self.rounds = []
+        def sleep(secs):
+            self.rounds.append(secs)
+            if len(self.rounds) == 5:
+                raise StopLoop()
+        autoscale.time.sleep = sleep
+
+    def tearDown(self):
+        autoscale.time.sleep = self.sleep
+
+    def test_errors_do_not_stop_the_loop(self):
+        throttled = EC2ResponseError(503, 'Service Unavailable')
+        throttled.error_code = 'Unavailable'
+        cluster = FlakyCluster([IOError('connection refused'), throttled,
+                                ValueError('No JSON object could be decoded'),
+                                KeyError('containersAllocated')])
+        out = StringIO()
+        scaler = autoscale.Autoscaler(autoscale.ScalePolicy(), cluster, interval=30, out=out)
+        self.assertRaises(StopLoop, scaler.run)
+        self.assertEqual(cluster.observed, 5)
+        log = out.getvalue()
+        self.assertIn('cannot reach the resource manager', log)
+        self.assertIn('EC2 returned Unavailable', log)
+        self.assertEqual(log.count('unexpected answer from the resource manager'), 2)
+        self.assertIn('slaves=0 launching=0 allocated=0 pending=0', log)
+
+
+class Opts(object):
+    cluster_name = 'test'
+
+
+class Ec2ClusterTest(unittest.TestCase):
+    def setUp(self):
+        self.conn = FakeEC2Connection()
+        masters, self.slaves = self.conn.add_cluster('test', 3)
+        self.saved = (yarn_util.get_cluster_metrics, yarn_util.get_nodes, ec2_util.time.sleep)
+        self.metrics = {'containersPending': 5, 'appsPending': 2, 'containersAllocated': 7}
+        yarn_util.get_cluster_metrics = lambda master: self.metrics
+        hosts = [yarn_util.short_host(s.private_dns_name) for s in self.slaves]
+        yarn_util.get_nodes = lambda master: [
+            {'nodeHostName': hosts[0], 'state': 'RUNNING', 'numContainers': 3},
+            {'nodeHostName': hosts[1], 'state': 'DECOMMISSIONED', 'numContainers': 0}]
+        ec2_util.time.sleep = lambda secs: None
+
+    def tearDown(self):
+        yarn_util.get_cluster_metrics, yarn_util.get_nodes, ec2_util.time.sleep = self.saved
+
+    def test_observe(self):
+        obs = autoscale.Ec2Cluster(self.conn, Opts(), None).observe()
+        # pending applications wait for containers already counted as pending
+        self.assertEqual((obs['pending'], obs['allocated']), (5, 7))
+        self.assertEqual(obs['nodes'], {yarn_util.short_host(self.slaves[0].private_dns_name): 3})
+        # the slave the resource manager does not know yet is launching
+        self.assertEqual(obs['launching'], 1)
+
+    def test_throttled_lookup_is_retried(self):
+        self.conn.failures['DescribeInstances'] = ['RequestLimitExceeded']
+        obs = autoscale.Ec2Cluster(self.conn, Opts(), None).observe()
+        self.assertEqual(obs['allocated'], 7)
+        self.assertEqual(self.conn.ncalls('DescribeInstances'), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,900 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import BaseHTTPServer
+import SimpleHTTPServer
+import hashlib
+import json
+import logging
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from StringIO import StringIO
+import bootstrap
+
+MASTERS = ['ip-10-0-0-1.ec2.internal', 'ip-10-0-0-2.ec2.internal', 'ip-10-0-0-3.ec2.internal']
+
+
+class HadoopConfigTest(unittest.TestCase):
+    def render(self, masters=None, namenode_ha=False):
+        sizing = bootstrap.compute_sizing(8, 15360, False)
+        return bootstrap.hadoop_config(MASTERS[0], ['/disk/1/hadoop'], ['/disk/1/hdfs'],
+                                       sizing, masters, namenode_ha)
+
+    def test_single_master(self):
+        config = self.render()
+        core, hdfs, yarn = config['core-site.xml'], config['hdfs-site.xml'], config['yarn-site.xml']
+        self.assertEqual(core['fs.defaultFS'], 'hdfs://%s:9000/' % MASTERS[0])
+        self.assertEqual(yarn['yarn.resourcemanager.address'], '%s:8032' % MASTERS[0])
+        self.assertFalse('yarn.resourcemanager.ha.enabled' in yarn)
+        self.assertFalse('ha.zookeeper.quorum' in core)
+        self.assertFalse('dfs.nameservices' in hdfs)
+        # one master in the list is no high availability either
+        self.assertEqual(self.render(MASTERS[:1]), config)
+
+    def test_three_masters(self):
+        config = self.render(MASTERS)
+        core, hdfs, yarn = config['core-site.xml'], config['hdfs-site.xml'], config['yarn-site.xml']
+        self.assertEqual(core['fs.defaultFS'], 'hdfs://%s:9000/' % MASTERS[0])
+        self.assertFalse('dfs.nameservices' in hdfs)
+        self.assertTrue(yarn['yarn.resourcemanager.ha.enabled'])
+        self.assertEqual(yarn['yarn.resourcemanager.ha.rm-ids'], ['rm1', 'rm2', 'rm3'])
+        self.assertEqual(yarn['yarn.resourcemanager.zk-address'],
+                         ','.join('%s:2181' % m for m in MASTERS))
+        for i, m in enumerate(MASTERS):
+            self.assertEqual(yarn['yarn.resourcemanager.hostname.rm%d' % (i + 1)], m)
+            self.assertEqual(yarn['yarn.resourcemanager.address.rm%d' % (i + 1)], '%s:8032' % m)
+        # the addresses of a single resource manager would defeat the failover
+        for prop in ['resource-tracker.address', 'scheduler.address', 'address']:
+            self.assertFalse('yarn.resourcemanager.%s' % prop in yarn)
+
+    def test_namenode_ha(self):
+        config = self.render(MASTERS, namenode_ha=True)
+        core, hdfs = config['core-site.xml'], config['hdfs-site.xml']
+        self.assertEqual(core['fs.defaultFS'], 'hdfs://yarn-ec2')
+        self.assertEqual(core['ha.zookeeper.quorum'], ','.join('%s:2181' % m for m in MASTERS))
+        self.assertEqual(hdfs['dfs.nameservices'], 'yarn-ec2')
+        self.assertEqual(hdfs['dfs.ha.namenodes.yarn-ec2'], ['nn1', 'nn2'])
+        self.assertEqual(hdfs['dfs.namenode.rpc-address.yarn-ec2.nn1'], '%s:9000' % MASTERS[0])
+        self.assertEqual(hdfs['dfs.namenode.rpc-address.yarn-ec2.nn2'], '%s:9000' % MASTERS[1])
+        self.assertFalse('dfs.namenode.rpc-address.yarn-ec2.nn3' in hdfs)
+        self.assertEqual(hdfs['dfs.namenode.shared.edits.dir'],
+                         'qjournal://%s/yarn-ec2' % ';'.join('%s:8485' % m for m in MASTERS))
+        self.assertEqual(hdfs['dfs.journalnode.edits.dir'], '/disk/1/hdfs/journal')
+        self.assertTrue(hdfs['dfs.ha.automatic-failover.enabled'])
+        self.assertTrue(config['yarn-site.xml']['yarn.resourcemanager.ha.enabled'])
+
+    def test_zookeeper_config(self):
+        lines = bootstrap.zookeeper_config(MASTERS, '/home/ubuntu/zookeeper-data').splitlines()
+        self.assertTrue('dataDir=/home/ubuntu/zookeeper-data' in lines)
+        self.assertTrue('clientPort=2181' in lines)
+        self.assertEqual([l for l in lines if l.startswith('server.')],
+                         ['server.%d=%s:2888:3888' % (i + 1, m) for i, m in enumerate(MASTERS)])
+
+
+
+class SiteConfigTest(unittest.TestCase):
+    CONFIG = {'core-site.xml': {'fs.defaultFS': 'hdfs://master:9000/',
+                                'io.file.buffer.size': 65536},
+              'yarn-site.xml': {'yarn.nodemanager.resource.memory-mb': 12288,
+                                'yarn.log-aggregation-enable': True,
+                                'yarn.nodemanager.local-dirs': ['/disk/1/yarn', '/disk/2/yarn']}}
+
+    def setUp(self):
+        self.conf_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.conf_dir)
+
+    def path(self, fname):
+        return os.path.join(self.conf_dir, fname)
+
+    def age(self):
+        # make the writes visible in the modification times
+        for fname in os.listdir(self.conf_dir):
+            os.utime(self.path(fname), (0, 0))
+
+    def mtimes(self):
+        return dict((f, os.path.getmtime(self.path(f))) for f in os.listdir(self.conf_dir))
+
+    def test_render_and_diff(self):
+        changes = bootstrap.apply_site_config(self.conf_dir, self.CONFIG)
+        self.assertEqual(len(changes), 5)
+        self.assertTrue(('core-site.xml', 'fs.defaultFS', None, 'hdfs://master:9000/') in changes)
+        self.assertEqual(dict(bootstrap.read_site(self.path('yarn-site.xml'))),
+                         {'yarn.nodemanager.resource.memory-mb': '12288',
+                          'yarn.log-aggregation-enable': 'true',
+                          'yarn.nodemanager.local-dirs': '/disk/1/yarn,/disk/2/yarn'})
+        self.assertFalse([f for f in os.listdir(self.conf_dir) if f.endswith('.tmp')])
+
+    def test_unchanged_files_are_not_written(self):
+        bootstrap.apply_site_config(self.conf_dir, self.CONFIG)
+        self.age()
+        self.assertEqual(bootstrap.apply_site_config(self.conf_dir, self.CONFIG), [])
+        self.assertEqual(set(self.mtimes().values()), set([0]))
+        # a change rewrites its own file only
+        config = dict(self.CONFIG)
+        config['core-site.xml'] = dict(config['core-site.xml'], **{'io.file.buffer.size': 131072})
+        self.assertEqual(bootstrap.apply_site_config(self.conf_dir, config),
+                         [('core-site.xml', 'io.file.buffer.size', '65536', '131072')])
+        mtimes = self.mtimes()
+        self.assertNotEqual(mtimes['core-site.xml'], 0)
+        self.assertEqual(mtimes['yarn-site.xml'], 0)
+
+    def test_keeps_unmanaged_properties(self):
+        with open(self.path('core-site.xml'), 'w') as fo:
+            fo.write(bootstrap.render_site([('hadoop.tmp.dir', '/mnt/tmp'),
+                                            ('fs.defaultFS', 'file:///')]))
+        changes = bootstrap.apply_site_config(self.conf_dir, self.CONFIG)
+        self.assertTrue(('core-site.xml', 'fs.defaultFS', 'file:///', 'hdfs://master:9000/')
+                        in changes)
+        props = dict(bootstrap.read_site(self.path('core-site.xml')))
+        self.assertEqual(props['hadoop.tmp.dir'], '/mnt/tmp')
+        self.assertEqual(props['fs.defaultFS'], 'hdfs://master:9000/')
+
+    def test_drops_properties_no_longer_managed(self):
+        bootstrap.apply_site_config(self.conf_dir, self.CONFIG)
+        config = dict(self.CONFIG)
+        config['core-site.xml'] = {'fs.defaultFS': 'hdfs://master:9000/'}
+        self.assertEqual(bootstrap.apply_site_config(self.conf_dir, config),
+                         [('core-site.xml', 'io.file.buffer.size', '65536', None)])
+        self.assertEqual(bootstrap.read_site(self.path('core-site.xml')),
+                         [('fs.defaultFS', 'hdfs://master:9000/')])
+
+class SizingTest(unittest.TestCase):
+    NODES = [(1, 3840), (2, 3840), (4, 7680), (8, 15360), (16, 30720), (32, 61440),
+             (36, 60416), (40, 163840), (64, 249856)]
+
+    def test_reserved_ram(self):
+        self.assertEqual([bootstrap.reserved_ram(mb) for mb in [3840, 7680, 15360, 61440, 249856]],
+                         [256, 1024, 2048, 6144, 8192])
+
+    def test_mapreduce(self):
+        sizing = bootstrap.compute_sizing(8, 15360, False)
+        self.assertEqual((sizing['nm_memory_mb'], sizing['nm_vcores']), (13312, 8))
+        self.assertEqual((sizing['container_mb'], sizing['container_vcores'],
+                          sizing['containers']), (1536, 1, 8))
+        self.assertEqual((sizing['heap_mb'], sizing['reduce_mb'], sizing['am_mb']),
+                         (1228, 3072, 3072))
+
+    def test_profiles(self):
+        spark = bootstrap.compute_sizing(8, 15360, False, 'spark')
+        self.assertEqual((spark['container_vcores'], spark['containers']), (4, 2))
+        self.assertTrue(spark['overhead_mb'] >= 384)
+        ml = bootstrap.compute_sizing(8, 15360, False, 'ml')
+        self.assertEqual(ml['container_mb'], spark['container_mb'])
+        self.assertTrue(ml['heap_mb'] < spark['heap_mb'])
+        heavy = bootstrap.compute_sizing(8, 15360, False, 'memory-heavy')
+        self.assertEqual((heavy['containers'], heavy['container_mb']), (1, 13312))
+
+    def test_master_keeps_vcores(self):
+        self.assertEqual(bootstrap.compute_sizing(4, 15360, True)['nm_vcores'], 2)
+        # the smallest master still runs one container
+        tiny = bootstrap.compute_sizing(2, 3840, True)
+        self.assertEqual((tiny['nm_vcores'], tiny['containers']), (1, 1))
+
+    def test_containers_fit(self):
+        for profile in bootstrap.sizing_profiles:
+            for vcpu, vmem in self.NODES:
+                for is_master in [False, True]:
+                    s = bootstrap.compute_sizing(vcpu, vmem, is_master, profile)
+                    msg = '%s %d/%d %s' % (profile, vcpu, vmem, is_master)
+                    self.assertTrue(s['containers'] >= 1, msg)
+                    self.assertTrue(s['containers'] * s['container_mb'] <= s['nm_memory_mb'], msg)
+                    self.assertTrue(s['containers'] * s['container_vcores'] <= s['nm_vcores'], msg)
+                    self.assertTrue(s['nm_memory_mb'] <= vmem - bootstrap.reserved_ram(vmem), msg)
+                    for key in ['container_mb', 'reduce_mb', 'am_mb', 'max_container_mb']:
+                        self.assertEqual(s[key] % bootstrap.alloc_unit_mb, 0, msg)
+                        self.assertTrue(s[key] <= s['max_container_mb'], msg)
+                    self.assertEqual(s['heap_mb'] + s['overhead_mb'], s['container_mb'], msg)
+                    self.assertTrue(s['container_mb'] / 2 <= s['heap_mb'] < s['container_mb'], msg)
+                    self.assertTrue(s['reduce_heap_mb'] < s['reduce_mb'], msg)
+
+
+class NodeDaemonsTest(unittest.TestCase):
+    def setUp(self):
+        self.saved = (bootstrap.MASTERS, bootstrap.NAMENODE_HA, bootstrap.master_index)
+
+    def tearDown(self):
+        bootstrap.MASTERS, bootstrap.NAMENODE_HA, bootstrap.master_index = self.saved
+
+    def daemons(self, masters, namenode_ha, index):
+        bootstrap.MASTERS = masters
+        bootstrap.NAMENODE_HA = namenode_ha
+        bootstrap.master_index = lambda: index
+        return bootstrap.node_daemons(index is not None)
+
+    def test_single_master(self):
+        self.assertEqual(self.daemons([], False, 0),
+                         ['namenode', 'secondarynamenode', 'datanode', 'resourcemanager',
+                          'nodemanager', 'queues'])
+        self.assertEqual(self.daemons([], False, None), ['nodemanager'])
+
+    def test_three_masters(self):
+        common = ['datanode', 'resourcemanager', 'nodemanager', 'queues']
+        self.assertEqual(self.daemons(MASTERS, False, 0),
+                         ['zookeeper', 'namenode', 'secondarynamenode'] + common)
+        self.assertEqual(self.daemons(MASTERS, False, 1), ['zookeeper'] + common)
+        self.assertEqual(self.daemons(MASTERS, False, 2), ['zookeeper'] + common)
+        self.assertEqual(self.daemons(MASTERS, False, None), ['nodemanager'])
+
+    def test_namenode_ha(self):
+        common = ['datanode', 'resourcemanager', 'nodemanager', 'queues']
+        self.assertEqual(self.daemons(MASTERS, True, 0),
+                         ['zookeeper', 'journalnode', 'namenode', 'zkfc'] + common)
+        self.assertEqual(self.daemons(MASTERS, True, 1),
+                         ['zookeeper', 'journalnode', 'namenode', 'zkfc'] + common)
+        self.assertEqual(self.daemons(MASTERS, True, 2), ['zookeeper', 'journalnode'] + common)
+        self.assertEqual(self.daemons(MASTERS, True, None), ['nodemanager'])
+
+
+class NamenodeHostsTest(unittest.TestCase):
+    def setUp(self):
+        self.saved = (bootstrap.MASTER, bootstrap.MASTERS, bootstrap.NAMENODE_HA)
+
+    def tearDown(self):
+        bootstrap.MASTER, bootstrap.MASTERS, bootstrap.NAMENODE_HA = self.saved
+
+    def hosts(self, master, masters=(), namenode_ha=False):
+        bootstrap.MASTER = master
+        bootstrap.MASTERS = list(masters)
+        bootstrap.NAMENODE_HA = namenode_ha
+        return bootstrap.namenode_hosts()
+
+    def test_single_master(self):
+        # the copy of the script on the master does not name it
+        self.assertEqual(self.hosts(''), ['localhost'])
+        self.assertEqual(self.hosts(MASTERS[0]), [MASTERS[0]])
+
+    def test_several_masters(self):
+        self.assertEqual(self.hosts(MASTERS[0], MASTERS), MASTERS[:1])
+        self.assertEqual(self.hosts(MASTERS[0], MASTERS, True), MASTERS[:2])
+
+
+class LogRecorder(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class RunTest(unittest.TestCase):
+    def setUp(self):
+        self.log = LogRecorder()
+        root = logging.getLogger()
+        self.saved = (root.level, root.handlers, bootstrap.FAIL_FAST, sys.stdout,
+                      bootstrap.time.sleep)
+        root.handlers = [self.log]
+        root.setLevel(logging.INFO)
+        sys.stdout = StringIO()
+
+    def tearDown(self):
+        root = logging.getLogger()
+        (root.level, root.handlers, bootstrap.FAIL_FAST, sys.stdout,
+         bootstrap.time.sleep) = self.saved
+
+    def test_output_is_streamed_line_by_line(self):
+        self.assertEqual(bootstrap.run('echo one; echo two >&2; exit 3', check=False), 3)
+        lines = [m for m in self.log.messages if m.startswith('| ')]
+        self.assertEqual(lines, ['| one', '| two'])
+        self.assertEqual(sys.stdout.getvalue().splitlines()[1:], ['one', 'two'])
+        # the output is logged before the command ends
+        self.assertTrue(self.log.messages.index('| one') <
+                        [i for i, m in enumerate(self.log.messages) if 'exits with' in m][0])
+
+    def test_timing(self):
+        bootstrap.run('sleep 0.2')
+        done = [m for m in self.log.messages if m.startswith('Command sleep 0.2 exits')]
+        self.assertEqual(len(done), 1)
+        self.assertIn('exits with 0', done[0])
+        elapsed = float(done[0].split('elapsed=')[1].split()[0])
+        self.assertTrue(0.2 <= elapsed < 2, elapsed)
+
+    def test_timeout_kills_the_command(self):
+        start = time.time()
+        retcode = bootstrap.run('sleep 30; echo late', timeout=0.5, check=False)
+        self.assertNotEqual(retcode, 0)
+        self.assertLess(time.time() - start, 10)
+        self.assertNotIn('| late', self.log.messages)
+
+    def test_retries(self):
+        delays = []
+        bootstrap.time.sleep = delays.append
+        path = os.path.join(tempfile.mkdtemp(), 'tries')
+        try:
+            # fails twice, then succeeds
+            cmd = 'echo x >> %s; test $(wc -l < %s) -ge 3' % (path, path)
+            self.assertEqual(bootstrap.run(cmd, retries=3), 0)
+            self.assertEqual(len(open(path).readlines()), 3)
+            self.assertEqual(delays, [1, 2])
+            self.assertNotEqual(bootstrap.run('false', retries=1, check=False), 0)
+        finally:
+            shutil.rmtree(os.path.dirname(path))
+
+    def test_fail_fast(self):
+        bootstrap.FAIL_FAST = False
+        self.assertEqual(bootstrap.run('false'), 1)
+        bootstrap.FAIL_FAST = True
+        self.assertRaises(bootstrap.CommandError, bootstrap.run, 'false')
+        # unless the command is allowed to fail
+        self.assertEqual(bootstrap.run('false', check=False), 1)
+
+
+class TimelineReportTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.saved = (list(bootstrap.TIMELINE), bootstrap.get_metadata, bootstrap.get_devices,
+                      bootstrap.DISK_THROUGHPUT, bootstrap.BAKED_MARKER, bootstrap.LAUNCH_ID)
+        bootstrap.get_metadata = lambda path, default='': {'instance-id': 'i-1'}.get(path, default)
+        bootstrap.get_devices = lambda: ['/dev/xvdb', '/dev/xvdc']
+        bootstrap.DISK_THROUGHPUT = os.path.join(self.tmp, 'disk_throughput.txt')
+        bootstrap.BAKED_MARKER = os.path.join(self.tmp, 'baked')
+        bootstrap.LAUNCH_ID = 'launch-1'
+
+    def tearDown(self):
+        (bootstrap.TIMELINE[:], bootstrap.get_metadata, bootstrap.get_devices,
+         bootstrap.DISK_THROUGHPUT, bootstrap.BAKED_MARKER, bootstrap.LAUNCH_ID) = self.saved
+        shutil.rmtree(self.tmp)
+
+    def test_phases_relative_to_start(self):
+        bootstrap.TIMELINE[:] = [('site-xml', 130.0, 131.0), ('jdk', 101.0, 120.0),
+                                 ('start-daemons', 131.0, 140.0)]
+        report = bootstrap.timeline_report(False, 100.0, 25.0)
+        self.assertEqual([p['name'] for p in report['phases']], ['jdk', 'site-xml', 'start-daemons'])
+        self.assertEqual(report['phases'][0], {'name': 'jdk', 'start': 1.0, 'end': 20.0})
+        # the seconds the instance took to boot count in the time to join
+        self.assertEqual(report['time_to_join'], 65.0)
+        self.assertEqual((report['instance_id'], report['launch_id'], report['role']),
+                         ('i-1', 'launch-1', 'slave'))
+        self.assertEqual(report['disk_count'], 2)
+        self.assertEqual(report['disk_write_mb_s'], None)
+        self.assertFalse(report['baked_image'])
+        self.assertEqual(json.loads(json.dumps(report)), report)
+
+    def test_not_joined(self):
+        bootstrap.TIMELINE[:] = [('jdk', 101.0, 120.0)]
+        report = bootstrap.timeline_report(True, 100.0, 0.0)
+        self.assertEqual((report['role'], report['time_to_join']), ('master', None))
+
+    def test_disk_throughput(self):
+        with open(bootstrap.DISK_THROUGHPUT, 'w') as fo:
+            fo.write('256+0 records in\n256+0 records out\n'
+                     '268435456 bytes (268 MB, 256 MiB) copied, 2.0 s, 134 MB/s\n'
+                     '268435456 bytes (268 MB, 256 MiB) copied, 4.0 s, 67.1 MB/s\n')
+        # the disks are written concurrently, the slowest one bounds the time
+        self.assertAlmostEqual(bootstrap.disk_throughput(), 2 * 268435456 / 4.0 / 1e6)
+
+
+class DiskSetupTest(unittest.TestCase):
+    # stands for the commands touching the disks, they print what they would do
+    STUBS = '''
+mountpoint() { [ "$MOUNTED" == 1 ]; }
+sudo() {
+    if [ "$1" == blkid ]; then echo "$LABEL"; else echo "$@"; fi
+}
+'''
+
+    def setUp(self):
+        self.saved = (bootstrap.get_devices, bootstrap.DISK_LAYOUT, bootstrap.disk_parallel_format)
+        self.devices = ['/dev/xvdb', '/dev/xvdc', '/dev/xvdd']
+        bootstrap.get_devices = lambda: self.devices
+        bootstrap.disk_parallel_format = True
+
+    def tearDown(self):
+        bootstrap.get_devices, bootstrap.DISK_LAYOUT, bootstrap.disk_parallel_format = self.saved
+
+    def setup_lines(self):
+        return [c for c in bootstrap.disk_setup_cmds() if c.startswith('setup_disk ')]
+
+    def test_jbod_in_parallel(self):
+        bootstrap.DISK_LAYOUT = 'jbod'
+        cmds = bootstrap.disk_setup_cmds()
+        self.assertEqual(self.setup_lines(), ['setup_disk /dev/xvd%s /disk/xvd%s &' % (d, d)
+                                              for d in 'bcd'])
+        self.assertEqual(cmds[-1], 'wait')
+        self.assertFalse(any('mdadm' in c for c in cmds))
+        bootstrap.disk_parallel_format = False
+        self.assertEqual(self.setup_lines(), ['setup_disk /dev/xvd%s /disk/xvd%s' % (d, d)
+                                              for d in 'bcd'])
+
+    def test_raid0(self):
+        bootstrap.DISK_LAYOUT = 'raid0'
+        cmds = bootstrap.disk_setup_cmds()
+        self.assertEqual(self.setup_lines(), ['setup_disk /dev/md0 /disk/md0'])
+        self.assertIn('    yes | sudo mdadm --create /dev/md0 --level=0 --raid-devices=3 '
+                      '/dev/xvdb /dev/xvdc /dev/xvdd', cmds)
+        # an existing array is assembled rather than made again
+        self.assertIn('    sudo mdadm --assemble /dev/md0 /dev/xvdb /dev/xvdc /dev/xvdd', cmds)
+        self.assertEqual(bootstrap.get_data_disks(), ['/disk/md0'])
+
+    def test_raid0_needs_two_disks(self):
+        bootstrap.DISK_LAYOUT = 'raid0'
+        self.devices = ['/dev/xvdb']
+        self.assertEqual(self.setup_lines(), ['setup_disk /dev/xvdb /disk/xvdb'])
+        self.assertFalse(any('mdadm' in c for c in bootstrap.disk_setup_cmds()))
+
+    def test_no_local_disks(self):
+        self.devices = []
+        self.assertEqual(self.setup_lines(), [])
+        self.assertEqual(bootstrap.get_data_disks(), ['/disk/root'])
+
+    def run_setup(self, label, force_clean=0, mounted=0):
+        bootstrap.DISK_LAYOUT = 'jbod'
+        self.devices = ['/dev/xvdb']
+        script = '\n'.join([self.STUBS, 'FORCE_CLEAN=%d' % force_clean, 'MOUNTED=%d' % mounted,
+                            'LABEL=%s' % label] + bootstrap.disk_setup_cmds())
+        return subprocess.check_output(['bash', '-c', script]).splitlines()
+
+    def test_formats_only_foreign_disks(self):
+        mkfs = 'mkfs -t ext4 -L %s %s /dev/xvdb' % (bootstrap.DISK_LABEL, bootstrap.disk_mkfs_opts)
+        self.assertEqual(self.run_setup('ephemeral0'), [
+            'umount /dev/xvdb', mkfs, 'mkdir -p /disk/xvdb',
+            'mount -o %s /dev/xvdb /disk/xvdb' % bootstrap.disk_mount_opts])
+        # a disk formatted by a previous start keeps its data
+        self.assertNotIn(mkfs, self.run_setup(bootstrap.DISK_LABEL))
+        self.assertIn(mkfs, self.run_setup(bootstrap.DISK_LABEL, force_clean=1))
+        self.assertEqual(self.run_setup(bootstrap.DISK_LABEL, mounted=1), [])
+        self.assertIn(mkfs, self.run_setup(bootstrap.DISK_LABEL, force_clean=1, mounted=1))
+
+
+
+class StartupScriptTest(unittest.TestCase):
+    # the commands and the hadoop scripts log what they would do, pgrep finds the
+    # daemons listed in $RUNNING
+    STUBS = '''
+mountpoint() { [ "$MOUNTED" == 1 ]; }
+sudo() {
+    if [ "$1" == blkid ]; then echo "$LABEL"; else echo "sudo $*" >> $LOG; fi
+}
+pgrep() {
+    for p in $RUNNING; do [[ "${@: -1}" == *$p* ]] && return 0; done
+    return 1
+}
+nohup() { echo "nohup $*" >> $LOG; }
+dd() { echo "dd $*" >> $LOG; }
+'''
+    SCRIPTS = ['bin/hadoop', 'bin/hdfs', 'sbin/hadoop-daemon.sh', 'sbin/yarn-daemon.sh',
+               'sbin/stop-all.sh']
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.mkdtemp()
+        os.chdir(self.tmp)
+        self.saved = (bootstrap.run, bootstrap.get_devices, bootstrap.get_data_disks,
+                      bootstrap.JAVA_HOME, bootstrap.HADOOP_HOME, bootstrap.MASTERS,
+                      bootstrap.NAMENODE_HA, bootstrap.DISK_LAYOUT)
+        self.hadoop_home = os.path.join(self.tmp, 'hadoop')
+        for script in self.SCRIPTS:
+            path = os.path.join(self.hadoop_home, script)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as fo:
+                fo.write('#!/bin/bash\necho "$(basename $0) $*" >> $LOG\n')
+            os.chmod(path, 0755)
+        self.disks = [os.path.join(self.tmp, 'disk', d) for d in ['xvdb', 'xvdc']]
+        bootstrap.run = lambda cmd, **kwargs: 0
+        bootstrap.get_devices = lambda: ['/dev/xvdb', '/dev/xvdc']
+        bootstrap.get_data_disks = lambda: self.disks
+        bootstrap.JAVA_HOME = '/usr/lib/jvm/java'
+        bootstrap.HADOOP_HOME = self.hadoop_home
+        bootstrap.MASTERS = []
+        bootstrap.NAMENODE_HA = False
+        bootstrap.DISK_LAYOUT = 'jbod'
+        bootstrap.make_startup_script(True)
+
+    def tearDown(self):
+        (bootstrap.run, bootstrap.get_devices, bootstrap.get_data_disks,
+         bootstrap.JAVA_HOME, bootstrap.HADOOP_HOME, bootstrap.MASTERS,
+         bootstrap.NAMENODE_HA, bootstrap.DISK_LAYOUT) = self.saved
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp)
+
+    def startup(self, label='ephemeral0', mounted=0, running=(), force_clean=False):
+        log = os.path.join(self.tmp, 'commands.log')
+        if os.path.exists(log):
+            os.remove(log)
+        env = dict(os.environ, LOG=log, LABEL=label, MOUNTED=str(mounted),
+                   RUNNING=' '.join(running), HADOOP_HOME=self.hadoop_home)
+        script = self.STUBS + open('startup.sh').read()
+        args = ['bash', '-c', script, 'startup.sh'] + (['--force-clean'] if force_clean else [])
+        with open(os.devnull, 'w') as null:
+            subprocess.check_call(args, env=env, stderr=null)
+        return open(log).read().splitlines() if os.path.exists(log) else []
+
+    def started(self, cmds):
+        return [c.split()[-1] for c in cmds if ' start ' in c]
+
+    def formatted(self, cmds):
+        # the disks are set up concurrently
+        return sorted(c.split()[-1] for c in cmds if c.startswith('sudo mkfs '))
+
+    def warm_state(self):
+        # what the first start leaves behind
+        self.startup()
+        version = os.path.join(self.disks[0], 'hadoop/dfs/name/current/VERSION')
+        os.makedirs(os.path.dirname(version))
+        open(version, 'w').close()
+        with open(os.path.join(self.tmp, bootstrap.DISK_THROUGHPUT), 'w') as fo:
+            fo.write('268435456 bytes (268 MB, 256 MiB) copied, 2.0 s, 134 MB/s\n')
+        return version
+
+    def test_first_start(self):
+        cmds = self.startup()
+        self.assertEqual(self.formatted(cmds), ['/dev/xvdb', '/dev/xvdc'])
+        self.assertIn('hadoop namenode -format -nonInteractive', cmds)
+        self.assertEqual(self.started(cmds), ['namenode', 'secondarynamenode', 'datanode',
+                                              'resourcemanager', 'nodemanager'])
+        self.assertEqual(len([c for c in cmds if c.startswith('dd ')]), 2)
+        self.assertNotIn('stop-all.sh ', cmds)
+
+    def test_warm_restart(self):
+        version = self.warm_state()
+        running = ['proc_namenode', 'proc_datanode', 'SimpleHTTPServer', 'watch-decommission']
+        cmds = self.startup(label=bootstrap.DISK_LABEL, running=running)
+        self.assertEqual(self.formatted(cmds), [])
+        self.assertFalse([c for c in cmds if 'format' in c or c.startswith('dd ')])
+        self.assertEqual(self.started(cmds), ['secondarynamenode', 'resourcemanager',
+                                              'nodemanager'])
+        self.assertTrue(os.path.exists(version))
+        # mounted disks are left alone
+        cmds = self.startup(label=bootstrap.DISK_LABEL, mounted=1, running=running)
+        self.assertFalse([c for c in cmds if 'mount' in c])
+
+    def test_force_clean(self):
+        version = self.warm_state()
+        cmds = self.startup(label=bootstrap.DISK_LABEL, mounted=1, force_clean=True)
+        self.assertIn('stop-all.sh ', cmds)
+        self.assertEqual(self.formatted(cmds), ['/dev/xvdb', '/dev/xvdc'])
+        self.assertIn('hadoop namenode -format -nonInteractive', cmds)
+        self.assertFalse(os.path.exists(version))
+        self.assertEqual(len([c for c in cmds if c.startswith('dd ')]), 2)
+
+class RunStepsTest(unittest.TestCase):
+    def setUp(self):
+        self.saved = (bootstrap.FAIL_FAST, list(bootstrap.TIMELINE))
+        self.events = []
+        self.lock = threading.Lock()
+
+    def tearDown(self):
+        bootstrap.FAIL_FAST = self.saved[0]
+        bootstrap.TIMELINE[:] = self.saved[1]
+
+    def step(self, name, secs=0.0, fail=False):
+        def func():
+            with self.lock:
+                self.events.append(('start', name))
+            time.sleep(secs)
+            with self.lock:
+                self.events.append(('end', name))
+            if fail:
+                raise bootstrap.CommandError('%s failed' % name)
+            return name.upper()
+        return func
+
+    def test_dependencies_finish_first(self):
+        results = bootstrap.run_steps([
+            ('site', ['jdk', 'hadoop'], self.step('site')),
+            ('jdk', [], self.step('jdk', 0.2)),
+            ('hadoop', ['jdk'], self.step('hadoop', 0.1))])
+        self.assertEqual(results, {'site': 'SITE', 'jdk': 'JDK', 'hadoop': 'HADOOP'})
+        self.assertEqual(self.events, [('start', 'jdk'), ('end', 'jdk'),
+                                       ('start', 'hadoop'), ('end', 'hadoop'),
+                                       ('start', 'site'), ('end', 'site')])
+        self.assertEqual(sorted(name for name, _, _ in bootstrap.TIMELINE[-3:]),
+                         ['hadoop', 'jdk', 'site'])
+
+    def test_independent_steps_overlap(self):
+        start = time.time()
+        bootstrap.run_steps([('step%d' % i, [], self.step('step%d' % i, 0.3)) for i in range(5)])
+        self.assertLess(time.time() - start, 1.0)
+        # every step started before any ended
+        self.assertEqual([e for e, _ in self.events], ['start'] * 5 + ['end'] * 5)
+
+    def test_failure_keeps_going(self):
+        bootstrap.FAIL_FAST = False
+        results = bootstrap.run_steps([
+            ('apt', [], self.step('apt', fail=True)),
+            ('custom', ['apt'], self.step('custom'))])
+        self.assertEqual(results, {'custom': 'CUSTOM'})
+
+    def test_fail_fast(self):
+        bootstrap.FAIL_FAST = True
+        self.assertRaises(bootstrap.CommandError, bootstrap.run_steps, [
+            ('apt', [], self.step('apt', fail=True)),
+            ('custom', ['apt'], self.step('custom')),
+            ('jdk', [], self.step('jdk'))])
+        self.assertFalse(('start', 'custom') in self.events)
+        self.assertTrue(('end', 'jdk') in self.events)
+
+
+class AptTest(unittest.TestCase):
+    def setUp(self):
+        self.saved = (bootstrap.sudo, bootstrap.APT_UPDATED[0], set(bootstrap.APT_REPOSITORIES))
+        self.commands = []
+        bootstrap.sudo = lambda cmd, timeout=None, retries=0: self.commands.append(cmd)
+        bootstrap.APT_UPDATED[0] = False
+        bootstrap.APT_REPOSITORIES.clear()
+
+    def tearDown(self):
+        bootstrap.sudo = self.saved[0]
+        bootstrap.APT_UPDATED[0] = self.saved[1]
+        bootstrap.APT_REPOSITORIES.clear()
+        bootstrap.APT_REPOSITORIES.update(self.saved[2])
+
+    def test_one_update_with_custom_install(self):
+        bootstrap.run_steps([
+            ('apt-repositories', [],
+             lambda: bootstrap.add_apt_repositories(bootstrap.apt_repositories)),
+            ('apt', ['apt-repositories'], lambda: bootstrap.install_packages(['mdadm'])),
+            ('custom', ['apt'], bootstrap.custom_all_nodes_install)])
+        self.assertEqual(self.commands, [
+            'add-apt-repository -y ppa:ubuntu-toolchain-r/test',
+            'apt-get -y update',
+            'apt-get -y install mdadm',
+            'apt-get -y install g++-4.9'])
+
+    def test_new_repository_updates_again(self):
+        bootstrap.install_packages(['a'])
+        bootstrap.add_apt_repository('ppa:other/ppa')
+        bootstrap.install_packages(['b'])
+        self.assertEqual(self.commands.count('apt-get -y update'), 2)
+
+
+class StaticServer(object):
+    """
+    Serves the files of a directory on an ephemeral port of localhost,
+    and keeps the paths asked for.
+    """
+    def __init__(self, root):
+        self.root = root
+        self.requests = []
+        server = self
+        class Handler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+            def translate_path(self, path):
+                server.requests.append(path)
+                return os.path.join(server.root, path.lstrip('/'))
+            def log_message(self, *args):
+                pass
+        self.httpd = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:%d' % self.httpd.server_address[1]
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.start()
+
+    def put(self, fname, data):
+        with open(os.path.join(self.root, fname), 'w') as fo:
+            fo.write(data)
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.thread.join()
+
+
+class FakeServer(object):
+    """
+    Answers GET and DELETE requests on an ephemeral port of localhost from routes,
+    a dict of (method, path) to the list of (status, body) answers given in turn,
+    the last one over and over. Other paths get a 404.
+    """
+    def __init__(self, routes):
+        self.routes = routes
+        self.requests = []
+        server = self
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def answer(self):
+                server.requests.append((self.command, self.path))
+                answers = server.routes.get((self.command, self.path), [(404, 'Not Found')])
+                status, body = answers.pop(0) if len(answers) > 1 else answers[0]
+                self.send_response(status)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            do_GET = do_DELETE = answer
+            def log_message(self, *args):
+                pass
+        self.httpd = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), Handler)
+        self.port = self.httpd.server_address[1]
+        self.url = 'http://127.0.0.1:%d' % self.port
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.thread.join()
+
+
+class StopWatching(Exception):
+    pass
+
+
+class WatchSpotTest(unittest.TestCase):
+    def setUp(self):
+        self.commands = []
+        self.sleeps = []
+        self.server = None
+        self.saved = (bootstrap.METADATA_URL, bootstrap.run, bootstrap.spot_watch_interval,
+                      bootstrap.time.sleep)
+        bootstrap.run = lambda cmd, timeout=None, retries=0, check=True: self.commands.append(cmd)
+        bootstrap.spot_watch_interval = 0.01
+
+    def tearDown(self):
+        (bootstrap.METADATA_URL, bootstrap.run, bootstrap.spot_watch_interval,
+         bootstrap.time.sleep) = self.saved
+        if self.server is not None:
+            self.server.close()
+
+    def metadata(self, routes):
+        self.server = FakeServer(dict((('GET', '/latest/meta-data/' + path), answers)
+                                      for path, answers in routes.items()))
+        bootstrap.METADATA_URL = self.server.url + '/latest/meta-data'
+
+    def test_notice_decommissions_then_stops_nodemanager(self):
+        reclaim = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(time.time() + 120))
+        self.metadata({'instance-life-cycle': [(200, 'spot')],
+                       'spot/termination-time': [(404, 'Not Found')] * 3 + [(200, reclaim)]})
+        sleep = time.sleep
+        def record(secs):
+            self.sleeps.append(secs)
+            sleep(min(secs, 0.01))
+        bootstrap.time.sleep = record
+        bootstrap.watch_spot()
+        polls = [p for m, p in self.server.requests if p.endswith('/termination-time')]
+        self.assertEqual(len(polls), 4)
+        self.assertEqual(len(self.commands), 2)
+        flag, stop = self.commands
+        self.assertIn('-touchz %s/%s' % (bootstrap.DECOMMISSION_DIR, socket.getfqdn()), flag)
+        self.assertEqual(stop, bootstrap.daemon_cmd('nodemanager', 'stop'))
+        # the nodemanager keeps running its containers until just before the reclaim
+        self.assertTrue(100 < self.sleeps[-1] <= 120 - bootstrap.spot_nm_stop_margin,
+                        self.sleeps)
+
+    def test_instance_action_notice(self):
+        notice = json.dumps({'action': 'terminate', 'time': '2017-09-18T08:22:00Z'})
+        self.metadata({'instance-life-cycle': [(200, 'spot')],
+                       'spot/instance-action': [(200, notice)]})
+        bootstrap.watch_spot()
+        # past the reclaim time, the nodemanager stops right away
+        self.assertEqual(self.commands[-1], bootstrap.daemon_cmd('nodemanager', 'stop'))
+        self.assertFalse(any('termination-time' in p for m, p in self.server.requests))
+
+    def test_on_demand_instance(self):
+        self.metadata({'instance-life-cycle': [(200, 'on-demand')]})
+        bootstrap.watch_spot()
+        self.assertEqual(self.commands, [])
+
+
+class WatchDecommissionTest(unittest.TestCase):
+    HOST = 'ip-10-0-0-9.ec2.internal'
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.tmp, 'etc', 'hadoop'))
+        self.exclude = os.path.join(self.tmp, 'etc', 'hadoop', 'yarn.exclude')
+        with open(self.exclude, 'w') as fo:
+            fo.write('ip-10-0-0-5.ec2.internal\n')
+        flags = '/webhdfs/v1%s' % bootstrap.DECOMMISSION_DIR
+        listing = json.dumps({'FileStatuses': {'FileStatus': [{'pathSuffix': self.HOST}]}})
+        self.server = FakeServer({
+            ('GET', '/ws/v1/cluster/info'): [(200, json.dumps({'clusterInfo':
+                                                               {'haState': 'ACTIVE'}}))],
+            ('GET', '%s?op=LISTSTATUS&user.name=ubuntu' % flags): [(200, listing)],
+            ('DELETE', '%s/%s?op=DELETE&user.name=ubuntu' % (flags, self.HOST)):
+                [(200, '{"boolean": true}')]})
+        self.commands = []
+        self.saved = (bootstrap.HADOOP_HOME, bootstrap.MASTER, bootstrap.MASTERS,
+                      bootstrap.WEBHDFS_PORT, bootstrap.RM_INFO_URL, bootstrap.run,
+                      bootstrap.time.sleep)
+        bootstrap.HADOOP_HOME = self.tmp
+        bootstrap.MASTER = '127.0.0.1'
+        bootstrap.MASTERS = []
+        bootstrap.WEBHDFS_PORT = self.server.port
+        bootstrap.RM_INFO_URL = self.server.url + '/ws/v1/cluster/info'
+        bootstrap.run = lambda cmd, timeout=None, retries=0, check=True: self.commands.append(cmd)
+        def sleep(secs):
+            raise StopWatching()
+        bootstrap.time.sleep = sleep
+
+    def tearDown(self):
+        (bootstrap.HADOOP_HOME, bootstrap.MASTER, bootstrap.MASTERS, bootstrap.WEBHDFS_PORT,
+         bootstrap.RM_INFO_URL, bootstrap.run, bootstrap.time.sleep) = self.saved
+        self.server.close()
+        shutil.rmtree(self.tmp)
+
+    def test_decommissions_flagged_hosts(self):
+        self.assertRaises(StopWatching, bootstrap.watch_decommission)
+        bootstrap.time.sleep = self.saved[-1]
+        self.assertEqual(open(self.exclude).read().split(),
+                         ['ip-10-0-0-5.ec2.internal', self.HOST])
+        # the flag is taken down once handled
+        self.assertEqual([m for m, p in self.server.requests], ['GET', 'GET', 'DELETE'])
+        for i in range(100):
+            if self.commands:
+                break
+            time.sleep(0.01)
+        self.assertEqual(self.commands, ['%s/bin/yarn rmadmin -refreshNodes -g %d' %
+                                         (self.tmp, bootstrap.spot_decommission_timeout)])
+
+
+class FetchArtifactTest(unittest.TestCase):
+    FNAME = 'hadoop-2.8.0.tar.gz'
+    DATA = 'hadoop tarball\n' * 100
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        for name in ['mirror', 'upstream']:
+            os.mkdir(os.path.join(self.tmp, name))
+        self.mirror = StaticServer(os.path.join(self.tmp, 'mirror'))
+        self.upstream = StaticServer(os.path.join(self.tmp, 'upstream'))
+        self.upstream.put(self.FNAME, self.DATA)
+        self.saved = (bootstrap.artifact_dir, sys.stdout)
+        bootstrap.artifact_dir = os.path.join(self.tmp, 'artifacts')
+        sys.stdout = StringIO()
+
+    def tearDown(self):
+        bootstrap.artifact_dir, sys.stdout = self.saved
+        self.mirror.close()
+        self.upstream.close()
+        shutil.rmtree(self.tmp)
+
+    def fetch(self, mirror=True):
+        return bootstrap.fetch_artifact('%s/%s' % (self.upstream.url, self.FNAME), self.FNAME,
+                                        self.mirror.url if mirror else None, '-q')
+
+    def test_mirror_hit(self):
+        data = 'mirrored tarball\n'
+        self.mirror.put(self.FNAME, data)
+        self.mirror.put(self.FNAME + '.sha256', hashlib.sha256(data).hexdigest() + '\n')
+        path = self.fetch()
+        self.assertEqual(open(path).read(), data)
+        self.assertEqual(self.upstream.requests, [])
+
+    def test_mirror_miss(self):
+        path = self.fetch()
+        self.assertEqual(path, os.path.join(bootstrap.artifact_dir, self.FNAME))
+        self.assertEqual(open(path).read(), self.DATA)
+        self.assertEqual(self.upstream.requests, ['/' + self.FNAME])
+        # the checksum is written for the artifact server of the master
+        self.assertEqual(open(path + '.sha256').read().strip(),
+                         hashlib.sha256(self.DATA).hexdigest())
+        self.assertFalse(os.path.exists(path + '.part'))
+
+    def test_checksum_mismatch(self):
+        self.mirror.put(self.FNAME, 'truncated')
+        self.mirror.put(self.FNAME + '.sha256', hashlib.sha256(self.DATA).hexdigest() + '\n')
+        path = self.fetch()
+        self.assertEqual(self.mirror.requests, ['/%s.sha256' % self.FNAME, '/' + self.FNAME])
+        self.assertEqual(open(path).read(), self.DATA)
+        self.assertEqual(open(path + '.sha256').read().strip(),
+                         hashlib.sha256(self.DATA).hexdigest())
+
+    def test_master_uses_upstream(self):
+        path = self.fetch(mirror=False)
+        self.assertEqual(open(path).read(), self.DATA)
+        self.assertEqual(self.mirror.requests, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import os
+import shutil
+import tempfile
+import unittest
+import cluster_cache
+from fake_ec2 import FakeEC2Connection
+
+
+class ClusterCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'cache', 'cluster-cache.json')
+        self.now = [1000.0]
+        self.time = cluster_cache.time.time
+        cluster_cache.time.time = lambda: self.now[0]
+        conn = FakeEC2Connection()
+        self.masters, self.slaves = conn.add_cluster('test', 2)
+
+    def tearDown(self):
+        cluster_cache.time.time = self.time
+        shutil.rmtree(self.tmp)
+
+    def test_round_trip(self):
+        cache = cluster_cache.ClusterCache(self.path, ttl=300)
+        self.assertEqual(cache.get('us-west-2', 'test'), None)
+        cache.put('us-west-2', 'test', self.masters, self.slaves)
+        masters, slaves = cache.get('us-west-2', 'test')
+        self.assertEqual([m.public_dns_name for m in masters],
+                         [m.public_dns_name for m in self.masters])
+        self.assertEqual([s.id for s in slaves], [s.id for s in self.slaves])
+        self.assertEqual(masters[0].tags, self.masters[0].tags)
+        # another region is another cluster
+        self.assertEqual(cache.get('us-east-1', 'test'), None)
+
+    def test_ttl_expiry(self):
+        cache = cluster_cache.ClusterCache(self.path, ttl=300)
+        cache.put('us-west-2', 'test', self.masters, self.slaves)
+        self.now[0] += 299
+        self.assertNotEqual(cache.get('us-west-2', 'test'), None)
+        self.now[0] += 1
+        self.assertEqual(cache.get('us-west-2', 'test'), None)
+
+    def test_disabled(self):
+        cache = cluster_cache.ClusterCache(self.path, ttl=0)
+        cache.put('us-west-2', 'test', self.masters, self.slaves)
+        self.assertEqual(cache.get('us-west-2', 'test'), None)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_invalidate(self):
+        cache = cluster_cache.ClusterCache(self.path, ttl=300)
+        cache.put('us-west-2', 'test', self.masters, self.slaves)
+        cache.put('us-west-2', 'other', self.masters, [])
+        cache.invalidate('us-west-2', 'test')
+        self.assertEqual(cache.get('us-west-2', 'test'), None)
+        self.assertNotEqual(cache.get('us-west-2', 'other'), None)
+
+    def test_master_without_dns_is_not_cached(self):
+        cache = cluster_cache.ClusterCache(self.path, ttl=300)
+        cache.put('us-west-2', 'test', self.masters, self.slaves)
+        self.masters[0].public_dns_name = ''
+        cache.put('us-west-2', 'test', self.masters, self.slaves)
+        self.assertEqual(cache.get('us-west-2', 'test'), None)
+
+    def test_stats(self):
+        cache = cluster_cache.ClusterCache(self.path, ttl=300)
+        cache.get('us-west-2', 'test')
+        cache.put('us-west-2', 'test', self.masters, self.slaves)
+        cache.get('us-west-2', 'test')
+        cache.get('us-west-2', 'test')
+        self.assertEqual(cache.stats(), {'hits': 2, 'misses': 1,
+                                         'total_hits': 2, 'total_misses': 1})
+        # the totals add up over the runs, the counts are per run
+        again = cluster_cache.ClusterCache(self.path, ttl=300)
+        again.get('us-west-2', 'test')
+        self.assertEqual(again.stats(), {'hits': 1, 'misses': 0,
+                                         'total_hits': 3, 'total_misses': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,203 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import unittest
+from boto.exception import EC2ResponseError
+import ec2_util
+from fake_ec2 import FakeEC2Connection
+
+
+class ClusterDiscoveryTest(unittest.TestCase):
+    def setUp(self):
+        self.conn = FakeEC2Connection()
+        # unrelated instances of the account
+        self.conn.add_instances(500, ['default'])
+        self.conn.add_cluster('other', 20)
+
+    def test_finds_masters_and_slaves(self):
+        masters, slaves = self.conn.add_cluster('test', 8)
+        found_masters, found_slaves = ec2_util.get_existing_cluster(self.conn, 'test')
+        self.assertEqual([m.id for m in found_masters], [m.id for m in masters])
+        self.assertEqual(sorted(s.id for s in found_slaves), sorted(s.id for s in slaves))
+
+    def test_untagged_cluster_uses_groups(self):
+        masters, slaves = self.conn.add_cluster('old', 3, tagged=False)
+        found_masters, found_slaves = ec2_util.get_existing_cluster(self.conn, 'old')
+        self.assertEqual(len(found_masters), 1)
+        self.assertEqual(len(found_slaves), 3)
+
+    def test_by_tag(self):
+        self.conn.add_cluster('test', 4)
+        found_masters, found_slaves = ec2_util.get_existing_cluster(self.conn, 'test', by_tag=True)
+        self.assertEqual((len(found_masters), len(found_slaves)), (1, 4))
+
+    def test_skips_terminated(self):
+        masters, slaves = self.conn.add_cluster('test', 4)
+        slaves[0].state = 'terminated'
+        found_masters, found_slaves = ec2_util.get_existing_cluster(self.conn, 'test')
+        self.assertEqual(len(found_slaves), 3)
+
+    def test_masters_in_launch_order(self):
+        masters, slaves = self.conn.add_cluster('test', 0, nmasters=3)
+        self.conn.instances.remove(masters[0])
+        self.conn.instances.append(masters[0])
+        found_masters, found_slaves = ec2_util.get_existing_cluster(self.conn, 'test')
+        self.assertEqual([m.id for m in found_masters], [m.id for m in masters])
+
+    def test_lookup_cost_follows_cluster_size(self):
+        self.conn.add_cluster('test', 10)
+        self.conn.reset()
+        ec2_util.get_existing_cluster(self.conn, 'test')
+        small_account = (self.conn.ncalls(), self.conn.returned)
+        self.conn.add_instances(5000, ['default'])
+        self.conn.reset()
+        ec2_util.get_existing_cluster(self.conn, 'test')
+        self.assertEqual((self.conn.ncalls(), self.conn.returned), small_account)
+        self.assertEqual(self.conn.returned, 11)
+
+    def test_missing_master_exits(self):
+        self.assertRaises(SystemExit, ec2_util.get_existing_cluster, self.conn, 'none')
+        self.assertEqual(ec2_util.get_existing_cluster(self.conn, 'none', die_on_error=False),
+                         ([], []))
+
+
+class TaggingTest(unittest.TestCase):
+    def setUp(self):
+        self.conn = FakeEC2Connection()
+        self.sleep = ec2_util.time.sleep
+        ec2_util.time.sleep = lambda secs: None
+
+    def tearDown(self):
+        ec2_util.time.sleep = self.sleep
+
+    def test_one_call_per_batch(self):
+        slaves = self.conn.add_instances(250, ['test-slave'])
+        tags = ec2_util.get_cluster_tags('test', 'slave')
+        self.assertEqual(ec2_util.tag_instances(self.conn, slaves, tags), 3)
+        self.assertEqual(self.conn.ncalls(), 3)
+        self.assertTrue(all(i.tags == tags for i in self.conn.instances))
+
+    def test_accepts_ids(self):
+        slaves = self.conn.add_instances(3, ['test-slave'])
+        ec2_util.tag_instances(self.conn, [i.id for i in slaves], {'a': 'b'})
+        self.assertEqual(self.conn.ncalls('CreateTags'), 1)
+        self.assertEqual(slaves[2].tags, {'a': 'b'})
+
+    def test_retries_throttling(self):
+        slaves = self.conn.add_instances(3, ['test-slave'])
+        self.conn.failures['CreateTags'] = ['RequestLimitExceeded', 'InvalidInstanceID.NotFound']
+        ec2_util.tag_instances(self.conn, slaves, {'a': 'b'})
+        self.assertEqual(self.conn.ncalls('CreateTags'), 3)
+        self.assertEqual(slaves[0].tags, {'a': 'b'})
+
+    def test_other_errors_raise(self):
+        slaves = self.conn.add_instances(3, ['test-slave'])
+        self.conn.failures['CreateTags'] = ['InvalidParameterValue']
+        self.assertRaises(EC2ResponseError, ec2_util.tag_instances, self.conn, slaves, {'a': 'b'})
+
+    def test_ready_polls_in_batches(self):
+        slaves = self.conn.add_instances(250, ['test-slave'])
+        for i in slaves[:100]:
+            i.state = 'pending'
+        self.conn.reset()
+        states = {}
+        for inst in ec2_util.iter_ready_instances(self.conn, slaves, timeout=0):
+            states[inst.id] = inst.state
+        self.assertEqual(len(states), 150)
+        # one status call and one describe call per chunk of 100 instances
+        self.assertEqual(self.conn.ncalls('DescribeInstanceStatus'), 3)
+        self.assertEqual(self.conn.ncalls('DescribeInstances'), 2)
+
+
+class ReadinessTest(unittest.TestCase):
+    def setUp(self):
+        self.conn = FakeEC2Connection()
+        self.now = [0.0]
+        self.sleeps = []
+        # instances switched to running after the given number of sleeps
+        self.boot = {}
+        self.saved = (ec2_util.time.time, ec2_util.time.sleep, ec2_util.random.uniform)
+        ec2_util.time.time = lambda: self.now[0]
+        ec2_util.time.sleep = self._sleep
+        ec2_util.random.uniform = lambda a, b: b
+
+    def tearDown(self):
+        ec2_util.time.time, ec2_util.time.sleep, ec2_util.random.uniform = self.saved
+
+    def _sleep(self, secs):
+        self.sleeps.append(secs)
+        self.now[0] += secs
+        for inst in self.boot.pop(len(self.sleeps), []):
+            inst.state = 'running'
+
+    def _pending(self, count):
+        instances = self.conn.add_instances(count, ['test-slave'])
+        for inst in instances:
+            inst.state = 'pending'
+        return instances
+
+    def test_backoff_grows_to_max(self):
+        slaves = self._pending(2)
+        self.boot[6] = slaves
+        ready = ec2_util.wait_for_instances(self.conn, slaves)
+        self.assertEqual(len(ready), 2)
+        self.assertEqual(self.sleeps, [2.0, 3.0, 4.5, 6.75, 10.125, 15.1875])
+        self.sleeps = []
+        slaves = self._pending(1)
+        self.boot[12] = slaves
+        list(ec2_util.iter_ready_instances(self.conn, slaves, min_delay=10.0, max_delay=20.0))
+        self.assertEqual(self.sleeps, [10.0, 15.0] + [20.0] * 10)
+
+    def test_backoff_resets_on_progress(self):
+        slaves = self._pending(2)
+        self.boot[3] = slaves[:1]
+        self.boot[5] = slaves[1:]
+        order = [i.id for i in ec2_util.iter_ready_instances(self.conn, slaves)]
+        self.assertEqual(order, [slaves[0].id, slaves[1].id])
+        self.assertEqual(self.sleeps, [2.0, 3.0, 4.5, 2.0, 3.0])
+
+    def test_initializing_is_not_ready(self):
+        slaves = self._pending(1)
+        slaves[0].state = 'running'
+        slaves[0].system_status = 'initializing'
+        self.assertEqual(ec2_util.wait_for_instances(self.conn, slaves, timeout=0), [])
+
+    def test_deadline(self):
+        slaves = self._pending(3)
+        self.boot[2] = slaves[:1]
+        ready = ec2_util.wait_for_instances(self.conn, slaves, timeout=6)
+        self.assertEqual([i.id for i in ready], [slaves[0].id])
+        # the last sleep is cut short at the deadline
+        self.assertEqual(self.sleeps, [2.0, 3.0, 1.0])
+        self.assertEqual(self.now[0], 6.0)
+
+    def test_not_found_is_retried(self):
+        slaves = self._pending(1)
+        slaves[0].state = 'running'
+        self.conn.failures['DescribeInstanceStatus'] = ['InvalidInstanceID.NotFound']
+        ready = ec2_util.wait_for_instances(self.conn, slaves)
+        self.assertEqual(len(ready), 1)
+        self.assertEqual(self.conn.ncalls('DescribeInstanceStatus'), 2)
+
+    def test_other_errors_raise(self):
+        slaves = self._pending(1)
+        self.conn.failures['DescribeInstanceStatus'] = ['UnauthorizedOperation']
+        self.assertRaises(EC2ResponseError, ec2_util.wait_for_instances, self.conn, slaves)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from StringIO import StringIO
+import ec2_util
+import instance_catalog
+
+HEADER = '# type\tvcpu\tecu\tmem_gb\tdisks\tdisk_gb\tdisk_kind\tvirt\tnetwork\tprice\n'
+
+
+class CatalogTest(unittest.TestCase):
+    def test_parses_the_catalog(self):
+        c3 = instance_catalog.get('c3.2xlarge')
+        self.assertEqual((c3.vcpu, c3.memory_mb, c3.disks, c3.disk_gb, c3.disk_kind, c3.virt),
+                         (8, 15360, 2, 80, 'ssd', 'hvm'))
+        self.assertEqual(c3.price('us-west-2'), 0.42)
+        self.assertFalse(c3.burstable)
+        t2 = instance_catalog.get('t2.micro')
+        self.assertTrue(t2.burstable)
+        self.assertEqual((t2.disks, t2.disk_kind), (0, None))
+        self.assertEqual(instance_catalog.get('hs1.8xlarge').price(), None)
+        self.assertEqual(instance_catalog.get('x9.huge'), None)
+
+    def test_loaded_once(self):
+        self.assertTrue(instance_catalog.load() is instance_catalog.load())
+
+    def test_select(self):
+        found = instance_catalog.select(virt='hvm', min_disks=4, disk_kind='ssd')
+        self.assertTrue(found)
+        self.assertEqual(found, sorted(found, key=lambda t: t.name))
+        for t in found:
+            self.assertTrue(t.virt == 'hvm' and t.disks >= 4 and t.disk_kind == 'ssd')
+        small = instance_catalog.select(max_vcpu=2, pred=lambda t: t.burstable)
+        self.assertTrue(small and all(t.vcpu <= 2 and t.ecu is None for t in small))
+
+    def test_names_are_unique_and_consistent(self):
+        names = [l.split('\t')[0] for l in open(instance_catalog.CATALOG_FILE)
+                 if l.strip() and not l.startswith('#')]
+        self.assertEqual(len(names), len(set(names)))
+        for t in instance_catalog.load().values():
+            self.assertTrue(t.virt in ('hvm', 'pvm'), t.name)
+            self.assertTrue(t.network in ('low', 'moderate', 'high', '10g'), t.name)
+            self.assertEqual(t.disks == 0, t.disk_kind is None, t.name)
+            self.assertTrue(t.vcpu > 0 and t.memory_gb > 0, t.name)
+
+
+class CatalogFileTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.fname = os.path.join(self.tmp, 'instances.tsv')
+        with open(self.fname, 'w') as fo:
+            fo.write(HEADER + '\n')
+            fo.write('z1.large\t2\t7\t8\t1\t100\tnvme\thvm\thigh\tus-east-1=0.1,*=0.2\n')
+
+    def tearDown(self):
+        instance_catalog._CATALOG.pop(self.fname, None)
+        shutil.rmtree(self.tmp)
+
+    def test_new_family(self):
+        z1 = instance_catalog.load(self.fname)['z1.large']
+        self.assertEqual((z1.memory_mb, z1.disk_kind), (8192, 'nvme'))
+        self.assertEqual((z1.price('us-east-1'), z1.price('eu-west-1')), (0.1, 0.2))
+        # the file is read once
+        os.remove(self.fname)
+        self.assertTrue('z1.large' in instance_catalog.load(self.fname))
+        self.assertEqual(instance_catalog.get('z1.large'), None)
+
+
+class InstanceFactsTest(unittest.TestCase):
+    def setUp(self):
+        self.stderr = sys.stderr
+        sys.stderr = StringIO()
+
+    def tearDown(self):
+        sys.stderr = self.stderr
+
+    def test_known_types(self):
+        self.assertEqual(ec2_util.get_num_disks('hs1.8xlarge'), 24)
+        self.assertEqual(ec2_util.get_num_disks('t2.micro'), 0)
+        self.assertEqual(ec2_util.get_instance_type('c3.2xlarge'), 'hvm')
+        self.assertEqual(ec2_util.get_instance_type('m1.small'), 'pvm')
+        self.assertEqual(sys.stderr.getvalue(), '')
+
+    def test_unknown_types(self):
+        self.assertEqual(ec2_util.get_num_disks('x9.huge'), 1)
+        self.assertEqual(ec2_util.get_instance_type('x9.huge'), 'pvm')
+        self.assertIn('x9.huge', sys.stderr.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
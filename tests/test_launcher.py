@@ -0,0 +1,127 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import sys
+import threading
+import time
+import unittest
+from StringIO import StringIO
+import launcher
+from fake_ec2 import FakeEC2Connection
+
+SPECS = [('m3.xlarge', 'us-west-2a'), ('m3.xlarge', 'us-west-2b'), ('c3.xlarge', 'us-west-2b')]
+
+
+class SplitChunksTest(unittest.TestCase):
+    def test_split_chunks(self):
+        self.assertEqual(launcher.split_chunks(10, 4), [4, 4, 2])
+        self.assertEqual(launcher.split_chunks(3, 4), [3])
+        self.assertEqual(launcher.split_chunks(0, 4), [])
+        self.assertEqual(launcher.split_chunks(2, 0), [1, 1])
+
+
+class ChunkedLauncherTest(unittest.TestCase):
+    def setUp(self):
+        self.conn = FakeEC2Connection()
+        self.launched = []
+        self.saved = (sys.stdout, sys.stderr)
+        sys.stdout = StringIO()
+        sys.stderr = StringIO()
+
+    def tearDown(self):
+        sys.stdout, sys.stderr = self.saved
+
+    # launches like launch_slaves, accepting a partial fulfillment
+    def launch(self, spec, count):
+        itype, zone = SPECS[spec]
+        return self.conn.run_instances('ami-1', min_count=1, max_count=count,
+                                       security_groups=['test-slaves'],
+                                       instance_type=itype, placement=zone).instances
+
+    def run_chunks(self, chunks, parallel=4):
+        engine = launcher.ChunkedLauncher(self.launch, len(SPECS), parallel, self.launched.extend)
+        return engine, engine.run(chunks)
+
+    def placed(self, instances):
+        counts = {}
+        for i in instances:
+            key = (i.instance_type, i.placement)
+            counts[key] = counts.get(key, 0) + 1
+        return counts
+
+    def test_chunks(self):
+        engine, instances = self.run_chunks([(0, n) for n in launcher.split_chunks(10, 4)])
+        self.assertEqual(len(instances), 10)
+        self.assertEqual(sorted(r[3] for r in self.conn.run_requests), [2, 4, 4])
+        self.assertEqual(sorted(i.id for i in self.launched), sorted(i.id for i in instances))
+        engine.report(['%s %s' % spec for spec in SPECS])
+        self.assertTrue('m3.xlarge us-west-2a' in sys.stdout.getvalue())
+
+    def test_partial_fill(self):
+        self.conn.capacity[('m3.xlarge', 'us-west-2a')] = 3
+        engine, instances = self.run_chunks([(0, 5)])
+        self.assertEqual(self.placed(instances), {('m3.xlarge', 'us-west-2a'): 3,
+                                                  ('m3.xlarge', 'us-west-2b'): 2})
+        self.assertEqual(self.conn.run_requests, [('m3.xlarge', 'us-west-2a', 1, 5),
+                                                  ('m3.xlarge', 'us-west-2b', 1, 2)])
+        self.assertEqual([(r.spec, r.count, len(r.instances)) for r in engine.results],
+                         [(0, 5, 3), (1, 2, 2)])
+
+    def test_insufficient_capacity_cascade(self):
+        self.conn.capacity[('m3.xlarge', 'us-west-2a')] = 0
+        self.conn.capacity[('m3.xlarge', 'us-west-2b')] = 1
+        engine, instances = self.run_chunks([(0, 4)])
+        self.assertEqual(self.placed(instances), {('m3.xlarge', 'us-west-2b'): 1,
+                                                  ('c3.xlarge', 'us-west-2b'): 3})
+        self.assertEqual(engine.results[0].error, 'InsufficientInstanceCapacity')
+        self.assertEqual(self.conn.ncalls('RunInstances'), 3)
+
+    def test_no_spec_left(self):
+        for spec in SPECS:
+            self.conn.capacity[spec] = 1
+        engine, instances = self.run_chunks([(0, 5)])
+        self.assertEqual(len(instances), 3)
+        self.assertTrue('giving up on 2 instance(s)' in sys.stderr.getvalue())
+
+    def test_other_errors_are_not_retried(self):
+        self.conn.failures['RunInstances'] = ['InvalidAMIID.NotFound']
+        engine, instances = self.run_chunks([(0, 4)])
+        self.assertEqual(instances, [])
+        self.assertEqual(self.conn.ncalls('RunInstances'), 1)
+        self.assertTrue('InvalidAMIID.NotFound' in sys.stderr.getvalue())
+
+    def test_chunks_run_concurrently(self):
+        lock = threading.Lock()
+        running = [0, 0]
+        launch = self.launch
+        def slow_launch(spec, count):
+            with lock:
+                running[0] += 1
+                running[1] = max(running)
+            time.sleep(0.1)
+            with lock:
+                running[0] -= 1
+            return launch(spec, count)
+        self.launch = slow_launch
+        engine, instances = self.run_chunks([(0, 2)] * 4, parallel=4)
+        self.assertEqual(len(instances), 8)
+        # all the chunks were in flight at once
+        self.assertEqual(running[1], 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
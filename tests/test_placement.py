@@ -0,0 +1,179 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import sys
+import unittest
+from optparse import Values
+from StringIO import StringIO
+import placement
+import yarn_ec2
+from fake_ec2 import FakeEC2Connection, FakeZone
+
+
+class SplitCountsTest(unittest.TestCase):
+    def test_parse_zone_weights(self):
+        self.assertEqual(placement.parse_zone_weights('us-west-2a=2, us-west-2b=1,'),
+                         {'us-west-2a': 2.0, 'us-west-2b': 1.0})
+        self.assertRaises(ValueError, placement.parse_zone_weights, 'us-west-2a')
+        self.assertRaises(ValueError, placement.parse_zone_weights, 'us-west-2a=-1')
+
+    def test_weights(self):
+        weights = {'us-west-2a': 2, 'us-west-2b': 1, 'us-west-2c': 0}
+        self.assertEqual(placement.split_counts(9, weights), [('us-west-2a', 6), ('us-west-2b', 3)])
+        self.assertEqual(placement.split_counts(1, weights), [('us-west-2a', 1)])
+        self.assertRaises(ValueError, placement.split_counts, 3, {'us-west-2a': 0})
+
+    def test_existing_slaves(self):
+        weights = {'us-west-2a': 1, 'us-west-2b': 1}
+        # the new slaves fill the zone that is short first
+        self.assertEqual(placement.split_counts(4, weights, {'us-west-2a': 3}),
+                         [('us-west-2a', 1), ('us-west-2b', 3)])
+        self.assertEqual(placement.split_counts(2, weights, {'us-west-2a': 3}),
+                         [('us-west-2b', 2)])
+        # repeated launches of one slave follow the weights
+        existing = {}
+        weights = {'us-west-2a': 3, 'us-west-2b': 1}
+        for i in range(8):
+            for zone, count in placement.split_counts(1, weights, existing):
+                existing[zone] = existing.get(zone, 0) + count
+        self.assertEqual(existing, {'us-west-2a': 6, 'us-west-2b': 2})
+
+
+class PlanZonesTest(unittest.TestCase):
+    def setUp(self):
+        self.conn = FakeEC2Connection()
+        self.conn.zones.append(FakeZone('us-west-2d', state='impaired'))
+
+    def test_master_zone(self):
+        for strategy in ['single-az', 'cluster']:
+            self.assertEqual(placement.plan_zones(self.conn, strategy, {}, 'us-west-2b', 5),
+                             [('us-west-2b', 5)])
+        self.assertEqual(self.conn.ncalls('DescribeAvailabilityZones'), 0)
+
+    def test_spread_over_available_zones(self):
+        self.assertEqual(placement.plan_zones(self.conn, 'spread', {}, 'us-west-2b', 7),
+                         [('us-west-2a', 3), ('us-west-2b', 2), ('us-west-2c', 2)])
+
+    def test_spread_with_weights(self):
+        weights = {'us-west-2a': 1, 'us-west-2c': 1}
+        existing = self.conn.add_instances(2, ['test-slaves'], placement='us-west-2a')
+        self.assertEqual(placement.plan_zones(self.conn, 'spread', weights, 'us-west-2b', 4,
+                                              existing),
+                         [('us-west-2a', 1), ('us-west-2c', 3)])
+        self.assertEqual(self.conn.ncalls('DescribeAvailabilityZones'), 0)
+
+
+class PlacementGroupTest(unittest.TestCase):
+    def setUp(self):
+        self.conn = FakeEC2Connection()
+        self.saved = (sys.stdout, sys.stderr, placement.time)
+        sys.stdout = StringIO()
+        sys.stderr = StringIO()
+        # the instances shutting down terminate while delete_group waits for them
+        self.now = 0
+        placement.time = self
+
+    def tearDown(self):
+        sys.stdout, sys.stderr, placement.time = self.saved
+
+    def time(self):
+        return self.now
+
+    def sleep(self, secs):
+        self.now += secs
+        for inst in self.conn.instances:
+            if inst.state == 'shutting-down':
+                inst.state = 'terminated'
+
+    def test_get_or_make_group(self):
+        self.assertEqual(placement.get_or_make_group(self.conn, 'test-slaves'), 'test-slaves')
+        self.assertEqual(self.conn.placement_groups['test-slaves'].strategy, 'cluster')
+        # made once, used again by the next launches
+        self.assertEqual(placement.get_or_make_group(self.conn, 'test-slaves'), 'test-slaves')
+        self.assertEqual(self.conn.ncalls('CreatePlacementGroup'), 1)
+        placement.get_or_make_group(self.conn, 'other-slaves')
+        self.assertEqual(sorted(self.conn.placement_groups), ['other-slaves', 'test-slaves'])
+
+    def test_delete_empty_group(self):
+        placement.get_or_make_group(self.conn, 'test-slaves')
+        self.conn.add_instances(1, ['test-slaves'], state='terminated',
+                                placement_group='test-slaves')
+        self.assertTrue(placement.delete_group(self.conn, 'test-slaves', 60))
+        self.assertEqual(self.conn.placement_groups, {})
+        self.assertEqual(self.now, 0)
+
+    def test_delete_waits_for_shutting_down(self):
+        placement.get_or_make_group(self.conn, 'test-slaves')
+        self.conn.add_instances(2, ['test-slaves'], state='shutting-down',
+                                placement_group='test-slaves')
+        self.assertTrue(placement.delete_group(self.conn, 'test-slaves', 60, poll=5))
+        self.assertEqual(self.now, 5)
+        self.assertEqual(self.conn.placement_groups, {})
+
+    def test_group_in_use_is_kept(self):
+        placement.get_or_make_group(self.conn, 'test-slaves')
+        self.conn.add_instances(1, ['test-slaves'], placement_group='test-slaves')
+        self.assertFalse(placement.delete_group(self.conn, 'test-slaves', 30, poll=10))
+        self.assertEqual(self.conn.ncalls('DeletePlacementGroup'), 0)
+        self.assertTrue('still in it' in sys.stderr.getvalue())
+        self.assertEqual(self.now, 40)
+
+    def test_delete_error(self):
+        self.assertFalse(placement.delete_group(self.conn, 'test-slaves', 30))
+        self.assertTrue('InvalidPlacementGroup.Unknown' in sys.stderr.getvalue())
+
+
+class SlavePlacementTest(unittest.TestCase):
+    def setUp(self):
+        self.conn = FakeEC2Connection()
+        self.master = self.conn.add_cluster('test', 0)[0][0]
+        self.stdout = sys.stdout
+        sys.stdout = StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+
+    def opts(self, strategy, slaves, zone_weights=None):
+        return Values({'placement': strategy, 'zone_weights': zone_weights,
+                       'cluster_name': 'test', 'slaves': slaves})
+
+    def test_single_az(self):
+        self.assertEqual(yarn_ec2.get_slave_placement(self.conn, self.opts('single-az', 4),
+                                                      self.master, []),
+                         ([('us-west-2a', 4)], None))
+        self.assertEqual(self.conn.placement_groups, {})
+
+    def test_cluster(self):
+        for i in range(2):
+            self.assertEqual(yarn_ec2.get_slave_placement(self.conn, self.opts('cluster', 4),
+                                                          self.master, []),
+                             ([('us-west-2a', 4)], 'test-slaves'))
+        self.assertEqual(self.conn.placement_groups.keys(), ['test-slaves'])
+
+    def test_spread(self):
+        existing = self.conn.add_instances(3, ['test-slaves'], placement='us-west-2a')
+        zones, group = yarn_ec2.get_slave_placement(self.conn, self.opts('spread', 3),
+                                                    self.master, existing)
+        self.assertEqual((zones, group), ([('us-west-2b', 2), ('us-west-2c', 1)], None))
+        zones, group = yarn_ec2.get_slave_placement(
+            self.conn, self.opts('spread', 6, {'us-west-2b': 1, 'us-west-2c': 2}),
+            self.master, existing)
+        self.assertEqual(zones, [('us-west-2b', 2), ('us-west-2c', 4)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import sys
+import unittest
+from StringIO import StringIO
+from boto.exception import EC2ResponseError
+import ec2_util
+import spot_tracker
+from fake_ec2 import FakeEC2Connection
+
+TAGS = {'yarn-ec2-cluster': 'test'}
+
+
+class TrackerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.conn = FakeEC2Connection()
+        self.submitted = []
+        # error codes the next submissions of a launch spec fail with
+        self.rejected = {}
+        self.tracker = spot_tracker.SpotTracker(self.conn, self.submit, 2, TAGS,
+                                                open_timeout=0, min_delay=0, max_delay=0)
+
+    def submit(self, spec, count):
+        if self.rejected.get(spec):
+            e = EC2ResponseError(400, 'Bad Request')
+            e.error_code = self.rejected[spec].pop(0)
+            raise e
+        reqs = self.conn.add_spot_requests(count)
+        self.submitted.append((spec, count))
+        return reqs
+
+    def instance(self, instance_id):
+        return [i for i in self.conn.instances if i.id == instance_id][0]
+
+
+class SpotTrackerTest(TrackerTestCase):
+    def test_fulfilled_requests_are_tagged(self):
+        reqs = self.submit(0, 3)
+        self.tracker.add(reqs, 0)
+        self.conn.fulfill_spot_request(reqs[0].id)
+        self.tracker.open_timeout = 600
+        self.assertEqual(self.tracker.poll(), 1)
+        fulfilled = self.tracker.fulfilled()
+        self.assertEqual([r.request.id for r in fulfilled], [reqs[0].id])
+        self.assertEqual(self.instance(fulfilled[0].instance_id).tags, TAGS)
+        self.assertEqual(len(self.tracker.pending()), 2)
+
+    def test_open_requests_are_resubmitted(self):
+        reqs = self.submit(0, 2)
+        self.tracker.add(reqs, 0)
+        self.tracker.poll()
+        self.assertEqual(self.submitted, [(0, 2), (1, 2)])
+        self.assertEqual(set(self.conn.spot_requests[r.id].state for r in reqs), set(['cancelled']))
+
+    def test_fulfilled_while_cancelled_is_kept(self):
+        reqs = self.submit(0, 2)
+        self.tracker.add(reqs, 0)
+        self.conn.fulfill_on_cancel.add(reqs[0].id)
+        self.assertEqual(self.tracker.poll(), 1)
+        # only the request that really got cancelled is submitted again
+        self.assertEqual(self.submitted, [(0, 2), (1, 1)])
+        late = [r for r in self.tracker.requests if r.request.id == reqs[0].id][0]
+        self.assertEqual(late.outcome, 'fulfilled')
+        self.assertEqual(self.instance(late.instance_id).tags, TAGS)
+
+    def test_fulfilled_at_the_deadline_is_kept(self):
+        reqs = self.submit(1, 2)
+        self.tracker.add(reqs, 1)
+        self.tracker.open_timeout = 600
+        self.conn.fulfill_on_cancel.add(reqs[1].id)
+        self.assertEqual(self.tracker.run(0), 1)
+        outcomes = dict((r.request.id, r.outcome) for r in self.tracker.requests)
+        self.assertEqual(outcomes, {reqs[0].id: 'unfulfilled', reqs[1].id: 'fulfilled'})
+        self.assertEqual(self.instance(self.tracker.fulfilled()[0].instance_id).tags, TAGS)
+
+
+
+class RejectedSubmitTest(TrackerTestCase):
+    def setUp(self):
+        TrackerTestCase.setUp(self)
+        self.tracker.nspecs = 3
+        self.saved = (sys.stderr, ec2_util.time.sleep)
+        sys.stderr = StringIO()
+        ec2_util.time.sleep = lambda secs: None
+
+    def tearDown(self):
+        sys.stderr, ec2_util.time.sleep = self.saved
+
+    def test_rejected_spec_goes_on_with_the_next(self):
+        self.rejected[0] = ['Unsupported']
+        self.assertTrue(self.tracker.launch(0, 2))
+        self.assertEqual(self.submitted, [(1, 2)])
+        self.assertEqual([r.spec for r in self.tracker.pending()], [1, 1])
+        self.assertIn('launch spec 0 failed: Unsupported', sys.stderr.getvalue())
+
+    def test_rejected_resubmission(self):
+        reqs = self.submit(0, 2)
+        self.tracker.add(reqs, 0)
+        self.rejected[1] = ['InvalidParameterValue']
+        self.tracker.poll()
+        self.assertEqual(self.submitted, [(0, 2), (2, 2)])
+        # the fulfillment latency still counts from the first submission
+        origins = set(r.origin for r in self.tracker.requests)
+        self.assertEqual(len(origins), 1)
+
+    def test_every_spec_rejected(self):
+        self.rejected = {0: ['Unsupported'], 1: ['Unsupported'], 2: ['Unsupported']}
+        self.assertFalse(self.tracker.launch(0, 2))
+        self.assertEqual(self.tracker.requests, [])
+        self.assertIn('giving up on 2 spot request(s)', sys.stderr.getvalue())
+        self.assertEqual(self.tracker.run(0), 0)
+
+    def test_throttled_submission_is_retried(self):
+        self.rejected[0] = ['RequestLimitExceeded']
+        self.assertTrue(self.tracker.launch(0, 2))
+        self.assertEqual(self.submitted, [(0, 2)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,168 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import time
+import unittest
+from StringIO import StringIO
+import ssh_util
+
+# Stands for ssh, with the behavior picked by the host name:
+# fail-<n> fails to connect n times, sleep-<secs> sleeps before answering,
+# exit-<code> runs a command that exits with code.
+FAKE_SSH = '''#!%s
+import os, sys, time
+host = sys.argv[-2].split('@')[1]
+kind, arg = host.split('-', 1) if '-' in host else (host, '')
+if kind == 'fail':
+    tries = os.path.join(%r, host)
+    count = int(open(tries).read()) if os.path.exists(tries) else 0
+    open(tries, 'w').write(str(count + 1))
+    if count < int(arg):
+        sys.stderr.write('ssh: connect to host %%s port 22: Connection refused\\n' %% host)
+        sys.exit(255)
+if kind == 'sleep':
+    time.sleep(float(arg))
+sys.stdout.write('%%s ran %%s\\n' %% (host, sys.argv[-1]))
+for line in sys.stdin:
+    sys.stdout.write('got ' + line)
+sys.stdout.flush()
+sys.exit(int(arg) if kind == 'exit' else 0)
+'''
+
+
+class Opts(object):
+    user = 'ubuntu'
+    identity_file = None
+
+
+class ExecutorTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        fake = os.path.join(self.tmp, 'ssh')
+        with open(fake, 'w') as fo:
+            fo.write(FAKE_SSH % (sys.executable, self.tmp))
+        os.chmod(fake, stat.S_IRWXU)
+        self.saved = (ssh_util.SSH_BINARY, ssh_util.backoff_delay)
+        ssh_util.SSH_BINARY = fake
+        self.tries = []
+        def backoff_delay(tries):
+            self.tries.append(tries)
+            return 0.0
+        ssh_util.backoff_delay = backoff_delay
+
+    def tearDown(self):
+        ssh_util.SSH_BINARY, ssh_util.backoff_delay = self.saved
+        shutil.rmtree(self.tmp)
+
+    def executor(self, **kwargs):
+        self.out = StringIO()
+        return ssh_util.Executor(Opts(), control_master=False, out=self.out, **kwargs)
+
+    def test_output_is_prefixed_with_host(self):
+        results = self.executor().run(['a', 'b'], ['echo', 'hello world'], stdin='x\ny\n')
+        self.assertTrue(all(r.ok() for r in results))
+        lines = self.out.getvalue().splitlines()
+        for host in ['a', 'b']:
+            self.assertEqual([l for l in lines if l.startswith('[%s] ' % host)],
+                             ["[%s] %s ran echo 'hello world'" % (host, host),
+                              '[%s] got x' % host, '[%s] got y' % host])
+
+    def test_capture_and_per_host_command(self):
+        results = self.executor().run(['a', 'exit-3'], lambda host: 'cmd-' + host,
+                                      capture=True)
+        self.assertEqual(self.out.getvalue(), '')
+        self.assertEqual([r.host for r in results], ['a', 'exit-3'])
+        self.assertEqual(results[0].output, ['a ran cmd-a\n'])
+        self.assertEqual(results[1].returncode, 3)
+        # the command ran, so it is not retried
+        self.assertEqual(results[1].tries, 1)
+
+    def test_parallel_fan_out(self):
+        hosts = ['sleep-0.5'] * 6
+        start = time.time()
+        results = self.executor(parallel=6).run(hosts, 'true')
+        self.assertTrue(all(r.ok() for r in results))
+        self.assertLess(time.time() - start, 2.0)
+        start = time.time()
+        self.executor(parallel=2).run(hosts, 'true')
+        self.assertGreaterEqual(time.time() - start, 1.5)
+
+    def test_timeout_per_host(self):
+        start = time.time()
+        results = self.executor(timeout=1).run(['sleep-30', 'a'], 'true')
+        self.assertLess(time.time() - start, 10)
+        self.assertTrue(results[0].timed_out)
+        self.assertFalse(results[0].ok())
+        self.assertFalse(results[1].timed_out)
+        self.assertTrue(results[1].ok())
+        self.assertIn('[sleep-30] timed out after 1 seconds', self.out.getvalue())
+
+    def test_connection_failures_back_off(self):
+        result = self.executor(retries=5).run(['fail-2'], 'true')[0]
+        self.assertTrue(result.ok())
+        self.assertEqual(result.tries, 3)
+        self.assertEqual(self.tries, [0, 1])
+        self.assertEqual(self.out.getvalue().count('ssh connection failed, retrying'), 2)
+
+    def test_gives_up_after_retries(self):
+        result = self.executor(retries=1).run(['fail-5'], 'true')[0]
+        self.assertEqual(result.returncode, ssh_util.SSH_CONNECT_ERROR)
+        self.assertEqual(result.tries, 2)
+
+
+class BackoffTest(unittest.TestCase):
+    def setUp(self):
+        self.uniform = ssh_util.random.uniform
+
+    def tearDown(self):
+        ssh_util.random.uniform = self.uniform
+
+    def test_doubles_up_to_max(self):
+        ssh_util.random.uniform = lambda a, b: b
+        self.assertEqual([ssh_util.backoff_delay(t) for t in range(7)],
+                         [2.0, 4.0, 8.0, 16.0, 32.0, 60.0, 60.0])
+        ssh_util.random.uniform = lambda a, b: a
+        self.assertEqual(ssh_util.backoff_delay(1), 2.0)
+
+
+class ControlArgsTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.home = os.environ.get('HOME')
+        os.environ['HOME'] = self.tmp
+
+    def tearDown(self):
+        os.environ['HOME'] = self.home
+        shutil.rmtree(self.tmp)
+
+    def test_creates_socket_dir(self):
+        args = ssh_util.control_args()
+        dirname = os.path.join(self.tmp, '.ssh')
+        self.assertTrue(os.path.isdir(dirname))
+        self.assertEqual(stat.S_IMODE(os.stat(dirname).st_mode), 0700)
+        self.assertIn('ControlPath=%s' % os.path.join(dirname, 'yarn-ec2-%C'), args)
+        # an existing directory is kept as it is
+        self.assertEqual(ssh_util.control_args(), args)
+
+
+if __name__ == '__main__':
+    unittest.main()
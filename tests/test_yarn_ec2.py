@@ -0,0 +1,300 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import json
+import os
+import sys
+import tempfile
+import unittest
+from StringIO import StringIO
+import yarn_ec2
+from fake_ec2 import FakeEC2Connection
+from fake_yarn import FakeResourceManager
+
+
+class ArgsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.argv = sys.argv
+        self.environ = dict(os.environ)
+        self.isfile = yarn_ec2.os.path.isfile
+        # no boto config file, the credentials come from the environment
+        os.environ['HOME'] = tempfile.gettempdir()
+        os.environ['AWS_ACCESS_KEY_ID'] = 'id'
+        os.environ['AWS_SECRET_ACCESS_KEY'] = 'key'
+        yarn_ec2.os.path.isfile = lambda path: False
+
+    def tearDown(self):
+        sys.argv = self.argv
+        os.environ.clear()
+        os.environ.update(self.environ)
+        yarn_ec2.os.path.isfile = self.isfile
+
+    def parse(self, *args):
+        sys.argv = ['yarn-ec2'] + list(args)
+        return yarn_ec2.parse_args()
+
+
+class ParseArgsTest(ArgsTestCase):
+    def test_offline_actions_need_no_credentials(self):
+        del os.environ['AWS_ACCESS_KEY_ID']
+        del os.environ['AWS_SECRET_ACCESS_KEY']
+        self.assertEqual(self.parse('--profile', 'spark', 'plan-sizing').action, 'plan-sizing')
+        opts = self.parse('--simulate', 'trace.jsonl', 'autoscale')
+        self.assertEqual((opts.action, opts.cluster_name), ('autoscale', ''))
+
+    def test_aws_actions_need_credentials(self):
+        self.assertEqual(self.parse('get-master', 'test').cluster_name, 'test')
+        del os.environ['AWS_SECRET_ACCESS_KEY']
+        self.assertRaises(SystemExit, self.parse, 'get-master', 'test')
+        self.assertRaises(SystemExit, self.parse, 'autoscale', 'test')
+
+    def test_explicit_options(self):
+        opts = self.parse('--profile', 'mapreduce', 'reconfigure', 'test')
+        self.assertTrue('profile' in opts.explicit)
+        self.assertFalse('disk_layout' in opts.explicit)
+
+
+class ClusterOptionsTest(ArgsTestCase):
+    def masters(self, opts):
+        conn = FakeEC2Connection()
+        return conn.add_instances(3, ['test-master'], tags=yarn_ec2.get_options_tags(opts))
+
+    def test_recorded_options_are_kept(self):
+        masters = self.masters(self.parse('--profile', 'spark', '--include-aws-key', '1',
+                                          'launch', 'test'))
+        opts, changed = yarn_ec2.get_cluster_options(self.parse('reconfigure', 'test'), masters)
+        self.assertEqual((opts.profile, opts.disk_layout, opts.include_aws_key),
+                         ('spark', 'jbod', True))
+        self.assertFalse(changed)
+
+    def test_given_options_override(self):
+        masters = self.masters(self.parse('--profile', 'spark', 'launch', 'test'))
+        opts, changed = yarn_ec2.get_cluster_options(
+            self.parse('--profile', 'mapreduce', '--disk-layout', 'raid0', 'reconfigure', 'test'),
+            masters)
+        self.assertEqual((opts.profile, opts.disk_layout), ('mapreduce', 'raid0'))
+        self.assertTrue(changed)
+
+    def test_unrecorded_cluster_uses_command_line(self):
+        masters = FakeEC2Connection().add_instances(1, ['test-master'])
+        opts, changed = yarn_ec2.get_cluster_options(
+            self.parse('--profile', 'ml', 'reconfigure', 'test'), masters)
+        self.assertEqual(opts.profile, 'ml')
+        self.assertTrue(changed)
+
+
+class PlanInstanceMixTest(unittest.TestCase):
+    CAPACITY = {'small': (2, 4096), 'big': (8, 16384), 'fat': (4, 32768), 'none': (0, 0)}
+    PRICE = {'small': 0.1, 'big': 0.3, 'fat': 0.35, 'none': 0.01}
+
+    def plan(self, vcores, mem, capacity=None, price=None):
+        return yarn_ec2.plan_instance_mix(vcores, mem, capacity or self.CAPACITY,
+                                          price or self.PRICE)
+
+    def test_cheapest_single_type(self):
+        # 4 big cost 1.2, where 16 small cost 1.6
+        self.assertEqual(self.plan(32, 0), (1.2, [('big', 4)]))
+
+    def test_memory_bound(self):
+        cost, mix = self.plan(0, 65536)
+        self.assertEqual(mix, [('fat', 2)])
+        self.assertAlmostEqual(cost, 0.7)
+
+    def test_two_types(self):
+        # 2 big and a small reach 18 vcores for 0.7, 3 big cost 0.9
+        cost, mix = self.plan(18, 0)
+        self.assertEqual(sorted(mix), [('big', 2), ('small', 1)])
+        self.assertAlmostEqual(cost, 0.7)
+
+    def test_mix_reaches_both_targets(self):
+        for vcores, mem in [(10, 100000), (40, 20000), (17, 40000)]:
+            cost, mix = self.plan(vcores, mem)
+            self.assertTrue(sum(self.CAPACITY[t][0] * n for t, n in mix) >= vcores)
+            self.assertTrue(sum(self.CAPACITY[t][1] * n for t, n in mix) >= mem)
+            self.assertAlmostEqual(cost, sum(self.PRICE[t] * n for t, n in mix))
+
+    def test_unreachable(self):
+        self.assertEqual(self.plan(4, 0, {'none': (0, 0)}, {'none': 0.01}), None)
+
+
+class TargetCapacityTest(ArgsTestCase):
+    def setUp(self):
+        ArgsTestCase.setUp(self)
+        self.launched = []
+        self.saved = (yarn_ec2.launch_slaves, yarn_ec2.launch_spot_slaves, sys.stdout)
+        yarn_ec2.launch_slaves = lambda conn, opts: self.launched.append(('ondemand', opts))
+        yarn_ec2.launch_spot_slaves = lambda conn, opts: self.launched.append(('spot', opts))
+        sys.stdout = StringIO()
+
+    def tearDown(self):
+        yarn_ec2.launch_slaves, yarn_ec2.launch_spot_slaves, sys.stdout = self.saved
+        ArgsTestCase.tearDown(self)
+
+    def launch(self, spot, *args):
+        opts = self.parse('--target-vcores', '64', '--target-mem', '128',
+                          *(args + ('addslave', 'test')))
+        yarn_ec2.launch_target_capacity(None, opts, spot)
+        return [(kind, o.instance_type, o.slaves, o.spot_price) for kind, o in self.launched]
+
+    def capacity(self, launches):
+        capacity = yarn_ec2.get_yarn_capacity('mapreduce', 'us-east-1')
+        return (sum(capacity[t][0] * n for _, t, n, _ in launches),
+                sum(capacity[t][1] * n for _, t, n, _ in launches))
+
+    def test_reaches_target(self):
+        launches = self.launch(False)
+        vcores, mem = self.capacity(launches)
+        self.assertTrue(vcores >= 64 and mem >= 128 * 1024)
+        self.assertTrue(all(kind == 'ondemand' for kind, _, _, _ in launches))
+        # burstable types are only used when allowed
+        self.assertFalse(any(t.startswith('t2.') for _, t, _, _ in launches))
+
+    def test_allow_and_deny(self):
+        self.assertEqual(set(t for _, t, _, _ in self.launch(False, '--allow-types', 'm3.xlarge')),
+                         set(['m3.xlarge']))
+        self.launched = []
+        first = set(t for _, t, _, _ in self.launch(False))
+        self.launched = []
+        denied = set(t for _, t, _, _ in self.launch(False, '--deny-types', ','.join(first)))
+        self.assertFalse(first & denied)
+
+    def test_max_price(self):
+        # on demand, a type over its cap is left out
+        self.assertRaises(SystemExit, self.launch, False, '--allow-types', 'm3.xlarge',
+                          '--max-price', 'm3.xlarge=0.01')
+        # spot bids the cap
+        launches = self.launch(True, '--allow-types', 'm3.xlarge', '--max-price', 'm3.xlarge=0.1')
+        self.assertEqual([(kind, t, p) for kind, t, _, p in launches], [('spot', 'm3.xlarge', 0.1)])
+
+
+class RemoveSlavesTest(ArgsTestCase):
+    def setUp(self):
+        ArgsTestCase.setUp(self)
+        self.conn = FakeEC2Connection()
+        self.masters, self.slaves = self.conn.add_cluster('test', 5)
+        self.rm = FakeResourceManager(dict((s.private_dns_name, n)
+                                           for s, n in zip(self.slaves, [4, 0, 2, 0, 1])))
+        self.rm.install()
+        self.saved = (yarn_ec2.yarn_util.decommission_nodes, sys.stdout, yarn_ec2.stderr)
+        decommission_nodes = yarn_ec2.yarn_util.decommission_nodes
+        yarn_ec2.yarn_util.decommission_nodes = lambda opts, master, hosts, timeout: (
+            decommission_nodes(opts, master, hosts, timeout, poll=0.01, out=StringIO()))
+        sys.stdout = StringIO()
+        yarn_ec2.stderr = StringIO()
+
+    def tearDown(self):
+        self.rm.uninstall()
+        yarn_ec2.yarn_util.decommission_nodes, sys.stdout, yarn_ec2.stderr = self.saved
+        ArgsTestCase.tearDown(self)
+
+    def remove(self, *args):
+        yarn_ec2.remove_slaves(self.conn, self.parse(*(args + ('removeslave', 'test'))))
+        return [s for s in self.slaves if s.state == 'terminated']
+
+    def test_idle_slaves_first(self):
+        removed = self.remove('-s', '3')
+        self.assertEqual(sorted(s.id for s in removed),
+                         sorted(s.id for s in [self.slaves[1], self.slaves[3], self.slaves[4]]))
+        # the busy slaves keep running their containers
+        states = dict((n['nodeHostName'], n['state']) for n in self.rm.get_nodes('master'))
+        self.assertEqual(states[self.slaves[0].private_dns_name], 'RUNNING')
+
+    def test_given_instances(self):
+        removed = self.remove('--instance-ids', '%s,%s' % (self.slaves[0].id, self.slaves[2].id))
+        self.assertEqual([s.id for s in removed], [self.slaves[0].id, self.slaves[2].id])
+
+    def test_unknown_instance(self):
+        self.assertRaises(SystemExit, self.remove, '--instance-ids', 'i-ffffffff')
+        self.assertEqual(self.conn.ncalls('TerminateInstances'), 0)
+
+    def test_failed_drain_exits(self):
+        self.rm.fail_refresh = True
+        self.assertRaises(SystemExit, self.remove, '-s', '2')
+        self.assertEqual(self.conn.ncalls('TerminateInstances'), 0)
+
+    def test_placement_group_goes_with_the_last_slave(self):
+        self.conn.create_placement_group('test-slaves')
+        for s in self.slaves:
+            s.placement_group = 'test-slaves'
+        self.remove('-s', '3')
+        self.assertEqual(self.conn.placement_groups.keys(), ['test-slaves'])
+        self.remove('-s', '2')
+        self.assertEqual(self.conn.placement_groups, {})
+        self.assertEqual(self.conn.ncalls('DeletePlacementGroup'), 1)
+
+
+def report(itype, launch, join, phases=(), disk=None):
+    return {'instance_type': itype, 'launch_id': launch, 'time_to_join': join,
+            'disk_layout': 'jbod', 'disk_count': 2, 'disk_write_mb_s': disk,
+            'phases': [{'name': name, 'start': 0.0, 'end': secs} for name, secs in phases]}
+
+
+class StatsTest(unittest.TestCase):
+    def setUp(self):
+        self.stdout = sys.stdout
+        sys.stdout = StringIO()
+        self.executor = yarn_ec2.ssh_util.Executor
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        yarn_ec2.ssh_util.Executor = self.executor
+
+    def test_percentile(self):
+        values = range(1, 101)
+        self.assertEqual(yarn_ec2.percentile(values, 50), 50)
+        self.assertEqual(yarn_ec2.percentile(values, 95), 95)
+        self.assertEqual(yarn_ec2.percentile(values, 100), 100)
+        self.assertEqual(yarn_ec2.percentile([7, 3], 0), 3)
+        self.assertEqual(yarn_ec2.percentile([4], 95), 4)
+
+    def test_groups(self):
+        records = [report('c3.2xlarge', 'a', 60 + i, [('jdk', 10.0)], disk=200.0) for i in range(20)]
+        records += [report('m3.xlarge', 'b', 100, [('jdk', 30.0)]),
+                    report('m3.xlarge', 'b', None, [('jdk', 50.0)])]
+        yarn_ec2.print_stats(records)
+        rows = {}
+        for l in sys.stdout.getvalue().splitlines():
+            if l.strip():
+                rows.setdefault(l.split()[0], l.split()[1:])
+        self.assertEqual(rows['c3.2xlarge'], ['20', '69.0', '78.0', '79.0'])
+        # a node that never joined is left out
+        self.assertEqual(rows['m3.xlarge'], ['1', '100.0', '100.0', '100.0'])
+        self.assertEqual(rows['a'][0], '20')
+        self.assertEqual(rows['jdk'], ['21', '10.0', '10.0', '30.0'])
+        self.assertIn('c3.2xlarge jbod x2', sys.stdout.getvalue())
+
+    def test_no_reports(self):
+        yarn_ec2.print_stats([report('m3.xlarge', 'a', None)])
+        self.assertEqual(sys.stdout.getvalue(), 'No bootstrap reports found\n')
+
+    def test_reads_reports_of_master(self):
+        lines = [json.dumps(report('m3.xlarge', 'a', 42)) + '\n', 'cat: no such file\n']
+        class Executor(object):
+            def __init__(self, opts, parallel):
+                pass
+            def run_host(self, host, command, capture):
+                self.host = host
+                result = yarn_ec2.ssh_util.HostResult(host)
+                result.output = lines
+                return result
+        yarn_ec2.ssh_util.Executor = Executor
+        records = yarn_ec2.get_timelines(None, 'master')
+        self.assertEqual([r['time_to_join'] for r in records], [42])
+
+
+if __name__ == '__main__':
+    unittest.main()
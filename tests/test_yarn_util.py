@@ -0,0 +1,112 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import sys
+import unittest
+from StringIO import StringIO
+import yarn_util
+from fake_ec2 import FakeEC2Connection
+from fake_yarn import FakeResourceManager
+
+
+class PickActiveTest(unittest.TestCase):
+    def test_active_wins(self):
+        self.assertEqual(yarn_util.pick_active(['STANDBY', 'ACTIVE', 'STANDBY']), 1)
+        self.assertEqual(yarn_util.pick_active([None, 'STANDBY', 'ACTIVE']), 2)
+
+    def test_unknown_state_during_failover(self):
+        # no active one yet, a master that did not answer may be becoming it
+        self.assertEqual(yarn_util.pick_active(['STANDBY', None, 'STANDBY']), 1)
+
+    def test_all_standby_or_unknown(self):
+        self.assertEqual(yarn_util.pick_active(['STANDBY', 'STANDBY', 'STANDBY']), 0)
+        self.assertEqual(yarn_util.pick_active([None, None, None]), 0)
+
+    def test_single_master(self):
+        self.assertEqual(yarn_util.pick_active([None]), 0)
+
+
+class DecommissionTest(unittest.TestCase):
+    def setUp(self):
+        self.conn = FakeEC2Connection()
+        self.masters, self.slaves = self.conn.add_cluster('test', 4)
+        self.hosts = [s.private_dns_name for s in self.slaves]
+        self.rm = None
+        self.saved = (sys.stderr, yarn_util.decommission_nodes)
+        sys.stderr = StringIO()
+        # poll the drain quickly, and quietly
+        decommission_nodes = yarn_util.decommission_nodes
+        yarn_util.decommission_nodes = lambda opts, master, hosts, timeout: decommission_nodes(
+            opts, master, hosts, timeout, poll=0.01, out=StringIO())
+
+    def tearDown(self):
+        if self.rm is not None:
+            self.rm.uninstall()
+        sys.stderr, yarn_util.decommission_nodes = self.saved
+
+    def resource_manager(self, containers, **kwargs):
+        self.rm = FakeResourceManager(dict(zip(self.hosts, containers)), **kwargs)
+        self.rm.install()
+        return self.rm
+
+    def test_drains_then_reports(self):
+        self.resource_manager([3, 0, 5, 1])
+        out = StringIO()
+        done = self.saved[1](None, 'master', self.hosts[:2], 60, poll=0.01, out=out)
+        self.assertEqual(done, self.hosts[:2])
+        self.assertIn('container(s) left', out.getvalue())
+        states = dict((n['nodeHostName'], n['state']) for n in self.rm.get_nodes('master'))
+        self.assertEqual(states[self.hosts[2]], 'RUNNING')
+
+    def test_stuck_node_is_forced_after_timeout(self):
+        self.resource_manager([3, 2, 0, 0], stuck=[self.hosts[0]])
+        done = yarn_util.decommission_nodes(None, 'master', self.hosts[:2], 1)
+        self.assertEqual(done, self.hosts[:2])
+
+    def test_failed_refresh(self):
+        self.resource_manager([1, 1, 1, 1], fail_refresh=True)
+        self.assertEqual(yarn_util.decommission_nodes(None, 'master', self.hosts[:2], 60), [])
+        self.assertIn('refreshNodes failed', sys.stderr.getvalue())
+
+    def test_slaves_terminated_once_drained(self):
+        rm = self.resource_manager([2, 0, 1, 1])
+        # the last slave never joined the resource manager
+        del rm.nodes[self.hosts[3]]
+        chosen = [self.slaves[0], self.slaves[1], self.slaves[3]]
+        removed = yarn_util.decommission_slaves(self.conn, None, 'master', chosen, 60)
+        self.assertEqual([s.id for s in removed], [s.id for s in chosen])
+        self.assertEqual([s.state for s in self.slaves],
+                         ['terminated', 'terminated', 'running', 'terminated'])
+        self.assertEqual(self.conn.ncalls('TerminateInstances'), 1)
+        # the terminated hosts leave the exclude file
+        forget = rm.commands[-1]
+        self.assertTrue(forget.startswith('grep -Ev'))
+        self.assertIn(self.hosts[0].replace('.', '\\.'), forget)
+        self.assertNotIn(self.hosts[3].replace('.', '\\.'), forget)
+
+    def test_failed_drain_keeps_slaves(self):
+        rm = self.resource_manager([2, 0, 1, 1], fail_refresh=True)
+        del rm.nodes[self.hosts[3]]
+        removed = yarn_util.decommission_slaves(self.conn, None, 'master',
+                                                [self.slaves[0], self.slaves[3]], 60)
+        # only the slave that never joined goes away
+        self.assertEqual([s.id for s in removed], [self.slaves[3].id])
+        self.assertEqual(self.slaves[0].state, 'running')
+
+
+if __name__ == '__main__':
+    unittest.main()
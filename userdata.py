@@ -0,0 +1,207 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+Package the rendered bootstrap script as EC2 user data: gzip compressed,
+which cloud-init unpacks, or when even that is too large a small stub
+fetching the script from the HDFS of the masters, or waiting for it to
+be pushed over ssh on the masters themselves.
+"""
+import gzip
+import hashlib
+import StringIO
+import tokenize
+
+# Largest user data EC2 accepts, in bytes before the base64 encoding.
+USER_DATA_LIMIT = 16384
+# HDFS directory of the scripts the stubs fetch.
+STUB_DIR = '/yarn-ec2/bootstrap'
+WEBHDFS_PORT = 50070
+# Seconds the stub of a master waits for its script to be pushed.
+PUSH_TIMEOUT = 3600
+
+# Both stubs end by writing the script, readable by root only since the lines given
+# by secrets are put back into it, and running it.
+RUN_SCRIPT = '''
+def run(data):
+    lines = data.splitlines(True)
+    for index, line in %(secrets)r:
+        lines[index] = line
+    script = '/tmp/yarn-ec2-bootstrap-%(digest)s.py'
+    fd = os.open(script, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600)
+    os.write(fd, ''.join(lines))
+    os.close(fd)
+    os.execv(sys.executable, [sys.executable, script])
+'''
+
+FETCH_STUB = '''#!/usr/bin/env python
+import hashlib, os, sys, time, urllib2
+%(run)s
+masters = %(masters)r
+path = %(path)r
+for i in range(60):
+    for m in masters:
+        try:
+            data = urllib2.urlopen('http://%%s:%(port)d/webhdfs/v1%%s?op=OPEN' %% (m, path), timeout=30).read()
+        except IOError:
+            continue
+        if hashlib.sha1(data).hexdigest() == %(digest)r:
+            run(data)
+    time.sleep(10)
+sys.exit('cannot fetch ' + path + ' from the masters')
+'''
+
+PUSH_STUB = '''#!/usr/bin/env python
+import hashlib, os, sys, time
+%(run)s
+path = os.path.expanduser('~%(user)s/%(fname)s')
+deadline = time.time() + %(timeout)d
+while time.time() < deadline:
+    if os.path.exists(path):
+        data = open(path).read()
+        if hashlib.sha1(data).hexdigest() == %(digest)r:
+            os.remove(path)
+            run(data)
+    time.sleep(5)
+sys.exit(path + ' was not pushed')
+'''
+
+# Remove the comment lines and blank lines of a python script, leaving its first two lines
+# (the #! cloud-init runs it with and the encoding) and the content of its strings untouched.
+def strip_comments(script):
+    lines = script.splitlines(True)
+    code = set()
+    for tok in tokenize.generate_tokens(StringIO.StringIO(script).readline):
+        if tok[0] not in (tokenize.COMMENT, tokenize.NL, tokenize.ENDMARKER):
+            # the lines a token spans, several for a multi-line string
+            code.update(range(tok[2][0], tok[3][0] + 1))
+    return ''.join(l for i, l in enumerate(lines) if i < 2 or i + 1 in code)
+
+# The (index, line) of the lines of script that differ from public, which has the
+# same lines with the secrets left out.
+def secret_lines(script, public):
+    return [(i, l) for i, (l, p) in enumerate(zip(script.splitlines(True), public.splitlines(True)))
+            if l != p]
+
+# Gzip data, without a timestamp so that the same data always gives the same bytes.
+def compress(data):
+    out = StringIO.StringIO()
+    fo = gzip.GzipFile(fileobj=out, mode='wb', compresslevel=9, mtime=0)
+    fo.write(data)
+    fo.close()
+    return out.getvalue()
+
+# Script fetching the script of the given sha1 digest from STUB_DIR on the HDFS
+# of one of the masters, putting back the secret lines and running it.
+def make_fetch_stub(masters, digest, secrets=()):
+    return FETCH_STUB % {'run': RUN_SCRIPT % {'secrets': list(secrets), 'digest': digest},
+                         'masters': list(masters), 'path': stub_path(digest),
+                         'digest': digest, 'port': WEBHDFS_PORT}
+
+# Script waiting for the script of the given sha1 digest to be pushed as fname in
+# the home directory of user, and running it.
+def make_push_stub(user, fname, digest, timeout=PUSH_TIMEOUT):
+    return PUSH_STUB % {'run': RUN_SCRIPT % {'secrets': [], 'digest': digest},
+                        'user': user, 'fname': fname, 'digest': digest, 'timeout': timeout}
+
+# HDFS path of the script of the given sha1 digest.
+def stub_path(digest):
+    return '%s/%s.py' % (STUB_DIR, digest)
+
+# Name of the pushed script of the given sha1 digest.
+def push_name(digest):
+    return 'yarn-ec2-user-data-%s.py' % digest
+
+
+class UserDataTooLarge(Exception):
+    """
+    The user data of a script stays over the limit of EC2, even compressed.
+    """
+    def __init__(self, name, sizes, limit):
+        lines = ['The user data of %s is %d bytes, over the %d bytes EC2 accepts'
+                 % (name, sizes[-1][1], limit)]
+        lines += ['  %-18s %8d' % s for s in sizes]
+        Exception.__init__(self, '\n'.join(lines))
+        self.sizes = sizes
+
+
+class Packager(object):
+    """
+    Turn rendered bootstrap scripts into user data, remembering the result
+    of each script so that launching many instances packages it once.
+
+    Parameters
+    ----------
+    limit: the largest user data allowed
+    """
+    def __init__(self, limit=USER_DATA_LIMIT):
+        self.limit = limit
+        self.packages = {}
+        self.pushes = {}
+
+    def package(self, name, script, public=None, masters=(), publish=None, user=None):
+        """
+        User data of script, name says which script it is in the size report.
+        public is the script without its secrets, the lines that differ only go
+        into the user data. When the compressed script is too large, the user
+        data is a stub instead:
+        - given masters and publish, a function (path, script) putting public at
+          that HDFS path, a stub fetching it from the masters
+        - given user, a stub waiting for the script to be pushed into the home
+          directory of user once the instance is up, see pushed_script
+        Raises UserDataTooLarge when nothing fits.
+        """
+        public = script if public is None else public
+        key = (hashlib.sha1(script).hexdigest(), tuple(masters), user)
+        if key not in self.packages:
+            self.packages[key] = self._package(name, script, public, masters, publish, user)
+        return self.packages[key]
+
+    def pushed_script(self, data):
+        """
+        (file name, script) to push to the instances launched with the user data
+        data, None when it is not a stub waiting for a push.
+        """
+        return self.pushes.get(data)
+
+    def _package(self, name, script, public, masters, publish, user):
+        stripped = strip_comments(script)
+        data = compress(stripped)
+        sizes = [('script', len(script)), ('without comments', len(stripped)),
+                 ('gzip', len(data))]
+        if len(data) <= self.limit:
+            return data
+        if masters and publish is not None:
+            public = strip_comments(public)
+            digest = hashlib.sha1(public).hexdigest()
+            data = compress(make_fetch_stub(masters, digest, secret_lines(stripped, public)))
+            sizes.append(('fetch stub', len(data)))
+            if len(data) <= self.limit:
+                print "User data of %s is %d bytes compressed, sending a stub fetching it from the masters" % (
+                    name, sizes[2][1])
+                publish(stub_path(digest), public)
+                return data
+        elif user is not None:
+            digest = hashlib.sha1(stripped).hexdigest()
+            data = compress(make_push_stub(user, push_name(digest), digest))
+            sizes.append(('push stub', len(data)))
+            if len(data) <= self.limit:
+                print "User data of %s is %d bytes compressed, sending a stub waiting for it over ssh" % (
+                    name, sizes[2][1])
+                self.pushes[data] = (push_name(digest), stripped)
+                return data
+        raise UserDataTooLarge(name, sizes, self.limit)
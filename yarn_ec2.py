@@ -1,6 +1,9 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import copy
+import json
 import logging
+import math
 import os
 import random
 import string
@@ -9,8 +12,19 @@ import sys
 from sys import stderr
 import time
 from boto import ec2
-from optparse import OptionParser
+from optparse import OptionParser, Values
+import bootstrap
 import ec2_util
+import cluster_cache
+import instance_catalog
+import ssh_util
+import spot_tracker
+import autoscale
+import yarn_util
+import ami_manifest
+import placement
+import launcher
+import userdata
 
 class UsageError(Exception):
     pass
@@ -18,8 +32,17 @@ class UsageError(Exception):
 # Configure and parse our command-line arguments
 def parse_args():
     parser = OptionParser(
-        usage="mode-ec2 [options] <action> <cluster_name>"
-        + "\n\n<action> can be: launch, addslave, addspot, login, get-master, forward-port",
+        usage="mode-ec2 [options] <action> <cluster_name> [command]"
+        + "\n\n<action> can be: launch, addslave, addspot, removeslave, reconfigure, bake-ami, login, get-master, forward-port, run, stats,"
+        + " plan-sizing, autoscale"
+        + "\n\nrun executes [command] on the nodes of the cluster in parallel"
+        + "\nremoveslave drains -s slaves, the idle ones first, or --instance-ids, then terminates them"
+        + "\nreconfigure renders the hadoop configuration of the nodes again and restarts the daemons"
+        + " whose configuration changed"
+        + "\nbake-ami <name> makes an image with the software of the nodes installed, used by later launches"
+        + "\nstats summarizes the bootstrap time-to-join reported by the nodes"
+        + "\nplan-sizing prints the container sizing of every instance type, without a cluster"
+        + "\nautoscale adds and removes slaves following the YARN demand, until interrupted",
         add_help_option=False)
     parser.add_option(
         "-h", "--help", action="help",
@@ -28,8 +51,8 @@ def parse_args():
         "-s", "--slaves", type="int", default=1,
         help="Number of slaves to launch (default: 1)")
     parser.add_option(
-        "-w", "--wait", type="int", default=120,
-        help="Seconds to wait for nodes to start (default: 120)")
+        "-w", "--wait", type="int", default=600,
+        help="Seconds to wait for nodes to start (default: 600)")
     parser.add_option(
         "-k", "--key-pair",
         help="Key pair to use on instances")
@@ -47,7 +70,16 @@ def parse_args():
         "-z", "--zone", default="",
         help="Availability zone to launch instances in, or 'all' to spread " +
              "slaves across multiple (an additional $0.01/Gb for bandwidth" +
-             "between zones applies)")
+             "between zones applies), same as --placement spread")
+    parser.add_option(
+        "--placement", type="choice", choices=placement.STRATEGIES, default="single-az",
+        help="Where slaves are launched: in the zone of the master (single-az), in a " +
+             "cluster placement group there for more bandwidth between them (cluster), " +
+             "or across zones (spread) (default: single-az)")
+    parser.add_option(
+        "--zone-weights", default="",
+        help="With --placement spread, comma separated ZONE=WEIGHT shares of the slaves " +
+             "per zone (default: all the available zones evenly)")
     parser.add_option("-a", "--ami", help="Amazon Machine Image ID to use")
     parser.add_option(
         "--include-aws-key", default=False,
@@ -57,22 +89,182 @@ def parse_args():
         "--spot-price", metavar="PRICE", type="float",
         help="If specified, launch slaves as spot instances with the given " +
              "maximum price (in dollars)")
+    parser.add_option(
+        "--spot-open-timeout", type="int", default=120,
+        help="Seconds a spot request may stay open before it is re-submitted with " +
+             "the next bid, instance type or zone (default: 120)")
+    parser.add_option(
+        "--spot-rebid", type="float", default=1.2,
+        help="Factor applied to the bid of a spot request that stays open, " +
+             "capped at the on-demand or --max-price price (default: 1.2)")
+    parser.add_option(
+        "--fallback-types", "--spot-fallback-types", dest="spot_fallback_types", default="",
+        help="Comma separated instance types to try when spot requests stay open, " +
+             "or when EC2 lacks the capacity for on-demand slaves")
+    parser.add_option(
+        "--fallback-zones", "--spot-fallback-zones", dest="spot_fallback_zones", default="",
+        help="Comma separated availability zones to try when spot requests stay open, " +
+             "or when EC2 lacks the capacity for on-demand slaves")
+    parser.add_option(
+        "--launch-chunk", type="int", default=50,
+        help="Largest number of on-demand slaves asked for in one launch call (default: 50)")
+    parser.add_option(
+        "--launch-parallel", type="int", default=8,
+        help="Maximum number of concurrent launch calls (default: 8)")
+    parser.add_option(
+        "--ondemand-topup", action="store_true", default=False,
+        help="Launch on-demand slaves for the spot requests still unfulfilled after --wait")
     parser.add_option(
         "-u", "--user", default="ubuntu",
         help="The SSH user you want to connect as (default: root)")
     parser.add_option(
         "--delete-groups", action="store_true", default=False,
         help="When destroying a cluster, delete the security groups that were created")
+    parser.add_option(
+        "--cache-ttl", type="int", default=300,
+        help="Seconds the local cluster state cache stays valid for read-only actions, " +
+             "0 to disable the cache (default: 300)")
+    parser.add_option(
+        "--refresh", action="store_true", default=False,
+        help="Ignore the local cluster state cache and query EC2")
+    parser.add_option(
+        "-v", "--verbose", action="store_true", default=False,
+        help="Print extra diagnostics, such as cluster cache hit and miss counts")
+    parser.add_option(
+        "--disk-layout", type="choice", choices=["jbod", "raid0"], default="jbod",
+        help="Use the local disks of the nodes separately (jbod) or striped " +
+             "into one RAID-0 volume (raid0) (default: jbod)")
+    parser.add_option(
+        "--profile", type="choice", choices=sorted(bootstrap.sizing_profiles.keys()),
+        default="mapreduce",
+        help="Container sizing profile of the cluster: " +
+             ", ".join(sorted(bootstrap.sizing_profiles.keys())) + " (default: mapreduce)")
+    parser.add_option(
+        "--target-vcores", type="int", default=0,
+        help="With addslave/addspot, launch the cheapest mix of instance types giving " +
+             "at least this many YARN vcores, instead of -s slaves of type -t")
+    parser.add_option(
+        "--target-mem", type="float", default=0,
+        help="With addslave/addspot, launch the cheapest mix of instance types giving " +
+             "at least this much YARN memory (GB)")
+    parser.add_option(
+        "--allow-types", default="",
+        help="Comma separated instance types the target mode may choose from (default: all)")
+    parser.add_option(
+        "--deny-types", default="",
+        help="Comma separated instance types the target mode never chooses")
+    parser.add_option(
+        "--max-price", default="",
+        help="Comma separated TYPE=PRICE caps on the hourly price of instance types, " +
+             "the spot bid of addspot and an upper bound on the list price of addslave")
+    parser.add_option(
+        "--fail-fast", action="store_true", default=False,
+        help="Stop the bootstrap of a node at the first command that fails")
+    parser.add_option(
+        "--on", type="choice", choices=["all", "master", "slaves"], default="all",
+        help="Nodes the run action executes on: all, master or slaves (default: all)")
+    parser.add_option(
+        "--parallel", type="int", default=20,
+        help="Maximum number of concurrent ssh sessions (default: 20)")
+    parser.add_option(
+        "--ssh-timeout", type="int", default=0,
+        help="Seconds after which a remote command is killed, 0 for no limit (default: 0)")
+    parser.add_option(
+        "--min-slaves", type="int", default=0,
+        help="Autoscale: number of slaves never to go below (default: 0)")
+    parser.add_option(
+        "--max-slaves", type="int", default=20,
+        help="Autoscale: number of slaves never to go above (default: 20)")
+    parser.add_option(
+        "--scale-interval", type="int", default=30,
+        help="Autoscale: seconds between two looks at the resource manager (default: 30)")
+    parser.add_option(
+        "--scale-up-after", type="int", default=60,
+        help="Autoscale: seconds containers must stay pending before slaves are added " +
+             "(default: 60)")
+    parser.add_option(
+        "--idle-after", type="int", default=300,
+        help="Autoscale: seconds a slave must run no container before it is removed " +
+             "(default: 300)")
+    parser.add_option(
+        "--cooldown", type="int", default=300,
+        help="Autoscale: seconds to wait after adding or removing slaves (default: 300)")
+    parser.add_option(
+        "--max-step", type="int", default=10,
+        help="Autoscale: maximum number of slaves added or removed at once (default: 10)")
+    parser.add_option(
+        "--decommission-timeout", type="int", default=600,
+        help="Seconds the containers of a removed slave get to finish (default: 600)")
+    parser.add_option(
+        "--instance-ids", default="",
+        help="Comma separated instance ids of the slaves removeslave removes, " +
+             "instead of -s slaves running the fewest containers")
+    parser.add_option(
+        "--max-unavailable", type="float", default=0.1,
+        help="Reconfigure: largest fraction of the slaves restarted at once (default: 0.1)")
+    parser.add_option(
+        "--masters", type="int", default=1,
+        help="Number of masters to launch; with 3 or more, the masters run ZooKeeper and " +
+             "the resource manager in high availability (default: 1)")
+    parser.add_option(
+        "--namenode-ha", action="store_true", default=False,
+        help="With --masters, also run the namenode in high availability on the first " +
+             "two masters")
+    parser.add_option(
+        "--bake-timeout", type="int", default=1800,
+        help="Seconds bake-ami waits for the installation on the builder instance (default: 1800)")
+    parser.add_option(
+        "--record", metavar="FILE",
+        help="Autoscale: append the observed demand to FILE, as a trace for --simulate")
+    parser.add_option(
+        "--simulate", metavar="FILE",
+        help="Autoscale: replay the demand trace in FILE against a simulated cluster " +
+             "instead of scaling the real one")
+    parser.add_option(
+        "--boot-time", type="int", default=300,
+        help="Autoscale: seconds a new slave takes to join in the simulation (default: 300)")
 
     (opts, args) = parser.parse_args()
-    if len(args) != 2:
+    if len(args) == 1 and is_offline(args[0], opts):
+        args.append('')
+    if len(args) < 2 or (len(args) > 2 and args[0] != 'run'):
         parser.print_help()
         sys.exit(1)
-    action, cluster_name = args
+    action, cluster_name = args[:2]
+    # the options given on the command line, as opposed to left to their defaults
+    opts.explicit = set(parser.parse_args(values=Values())[0].__dict__.keys())
     opts.action = action
     opts.cluster_name = cluster_name
-    # Boto config check
-    # http://boto.cloudhackers.com/en/latest/boto_config_tut.html
+    opts.command = ' '.join(args[2:])
+    opts.launch_id = '%s-%s' % (action, time.strftime('%Y%m%d-%H%M%S'))
+    try:
+        opts.max_price = dict((k, float(v)) for k, v in
+                              [c.split('=') for c in opts.max_price.split(',') if c])
+    except ValueError:
+        parser.error("--max-price must look like c3.2xlarge=0.3,r3.xlarge=0.2")
+    try:
+        opts.zone_weights = placement.parse_zone_weights(opts.zone_weights)
+    except ValueError:
+        parser.error("--zone-weights must look like us-west-2a=2,us-west-2b=1")
+    if opts.zone == 'all':
+        opts.placement = 'spread'
+    if opts.masters < 1 or opts.masters == 2:
+        parser.error("--masters must be 1, or at least 3 for a ZooKeeper quorum that " +
+                     "survives the loss of a master")
+    if opts.namenode_ha and opts.masters < 3:
+        parser.error("--namenode-ha needs --masters 3 or more")
+    if not is_offline(action, opts):
+        check_boto_config()
+    return opts
+
+# Whether an action never connects to AWS, so that it needs neither a cluster name
+# nor credentials.
+def is_offline(action, opts):
+    return action == 'plan-sizing' or (action == 'autoscale' and bool(opts.simulate))
+
+# Boto config check
+# http://boto.cloudhackers.com/en/latest/boto_config_tut.html
+def check_boto_config():
     home_dir = os.getenv('HOME')
     if home_dir is None or not os.path.isfile(home_dir + '/.boto'):
         if not os.path.isfile('/etc/boto.cfg'):
@@ -84,42 +276,61 @@ def parse_args():
                 print >> stderr, ("ERROR: The environment variable AWS_SECRET_ACCESS_KEY " +
                                   "must be set")
                 sys.exit(1)
-    return opts
 
-def get_resource_map(fname = 'data/instance.matrix.txt'):
+# Get the vcpu count, memory (MB) and on-demand price of the instance types
+# in the catalog. Types without a known price in region are left out of price.
+def get_resource_map(region=None):
     vcpu = {}
     vram = {}
     price = {}
-    for l in open(fname):
-        if len(l.strip()) == 0:
-            continue
-        arr = l.split('\t')
-        if len(arr) != 0:
-            vcpu[arr[0]] = int(arr[1])
-            vram[arr[0]] = int(float(arr[3]) * 1024)
-            price[arr[0]] = float(arr[5].split()[0].strip('$'))
+    for itype in instance_catalog.load().values():
+        vcpu[itype.name] = itype.vcpu
+        vram[itype.name] = itype.memory_mb
+        if itype.price(region) is not None:
+            price[itype.name] = itype.price(region)
     return vcpu, vram, price
 
+# Rendered bootstrap scripts by file, master, instance type, aws key option and settings,
+# and the lines of the bootstrap scripts, read once per run.
+_USER_DATA = {}
+_SCRIPTS = {}
+# Packaged user data of the rendered scripts.
+_PACKAGER = userdata.Packager()
+
 #
 # get user data of specific instance
+# settings maps other variables of the bootstrap script to the value they get.
 #
-def get_user_data(fname, master_dns, instance_type, include_aws_key):
-    vcpu, vram, price = get_resource_map()
-    data = open(fname).readlines()
+def get_user_data(fname, master_dns, instance_type, include_aws_key, settings=None):
+    settings = settings or {}
+    key = (fname, master_dns, instance_type, include_aws_key, repr(sorted(settings.items())))
+    if key not in _USER_DATA:
+        _USER_DATA[key] = render_user_data(fname, master_dns, instance_type,
+                                           include_aws_key, settings)
+    return _USER_DATA[key]
+
+def render_user_data(fname, master_dns, instance_type, include_aws_key, settings):
+    itype = instance_catalog.get(instance_type)
+    if fname not in _SCRIPTS:
+        _SCRIPTS[fname] = open(fname).readlines()
+    data = _SCRIPTS[fname]
     ret = []
     if include_aws_key:
         print "include AWS key option is switched on..."
 
     for l in data:
         special = True
-        if l.startswith('MASTER ='):
+        name = l.split(' =')[0]
+        if name in settings and l.startswith(name + ' ='):
+            ret.append('%s = %r\n' % (name, settings[name]))
+        elif l.startswith('MASTER ='):
             ret.append('MASTER = \'%s\'\n' % master_dns)
         elif l.startswith('NODE_TYPE ='):
             ret.append('NODE_TYPE = \'%s\'\n' % instance_type)
         elif l.startswith('NODE_VMEM ='):
-            ret.append('NODE_VMEM = %d\n' % vram[instance_type])
+            ret.append('NODE_VMEM = %d\n' % itype.memory_mb)
         elif l.startswith('NODE_VCPU ='):
-            ret.append('NODE_VCPU = %d\n' % vcpu[instance_type])
+            ret.append('NODE_VCPU = %d\n' % itype.vcpu)
         elif l.startswith('AWS_KEY =') and include_aws_key:
             ret.append('AWS_KEY = \'%s\'\n' % os.getenv('AWS_SECRET_ACCESS_KEY', 'undefined'))
         elif l.startswith('AWS_ID =') and include_aws_key:
@@ -130,15 +341,216 @@ def get_user_data(fname, master_dns, instance_type, include_aws_key):
     udata = ''.join(ret)
     return udata
 
-# get ami of the machine
+# The user data launching an instance of the given type with the bootstrap script, gzipped.
+# When it is too large even then: a stub fetching it from the HDFS of master_nodes, without
+# the aws key the stub puts back, or for the masters themselves a stub waiting for
+# push_user_data. Exits with the sizes before anything is launched when it does not fit.
+def get_launch_user_data(opts, instance_type, settings, master_nodes=()):
+    master_dns = master_nodes[0].private_dns_name if master_nodes else ''
+    script = get_user_data('bootstrap.py', master_dns, instance_type,
+                           opts.include_aws_key, settings)
+    public = get_user_data('bootstrap.py', master_dns, instance_type, False, settings)
+    try:
+        return _PACKAGER.package('bootstrap.py for %s' % instance_type, script, public,
+                                 [m.private_dns_name for m in master_nodes],
+                                 lambda path, data: publish_script(opts, master_nodes, path, data),
+                                 opts.user if opts.identity_file else None)
+    except userdata.UserDataTooLarge as e:
+        print >> stderr, "ERROR: %s" % e
+        sys.exit(1)
+
+# Send the bootstrap script to the nodes launched with the user data data, once they are
+# up, when it is a stub waiting for it.
+def push_user_data(opts, nodes, data):
+    pushed = _PACKAGER.pushed_script(data)
+    if pushed is None:
+        return
+    fname, script = pushed
+    executor = ssh_util.Executor(opts, parallel=opts.parallel)
+    results = executor.run([n.public_dns_name for n in nodes],
+                           'umask 077 && cat > %s.tmp && mv %s.tmp %s' % (fname, fname, fname),
+                           stdin=script)
+    failed = [r.host for r in results if not r.ok()]
+    if failed:
+        print >> stderr, ("ERROR: Could not send the bootstrap script to %s, their bootstrap "
+                          "waits for ~/%s" % (', '.join(failed), fname))
+        sys.exit(1)
+
+# Put a script on the HDFS of the masters at path, where the user data stubs fetch it.
+def publish_script(opts, master_nodes, path, data):
+    hadoop = '$HADOOP_HOME/bin/hadoop fs'
+    executor = ssh_util.Executor(opts)
+    res = executor.run_host(master_nodes[0].public_dns_name,
+                            'source ~/.hadoop_env; %s -mkdir -p %s && %s -put -f - %s' % (
+                                hadoop, os.path.dirname(path), hadoop, path),
+                            stdin=data)
+    if not res.ok():
+        print >> stderr, "ERROR: Could not put the bootstrap script at %s on the master" % path
+        sys.exit(1)
+
+# Options the configuration of the nodes is rendered from. They are recorded on the
+# masters at launch, so that reconfigure keeps them unless they are given again.
+CLUSTER_OPTIONS = ['profile', 'disk_layout', 'include_aws_key']
+
+# Tags recording the cluster options of opts.
+def get_options_tags(opts):
+    options = dict((k, getattr(opts, k)) for k in CLUSTER_OPTIONS)
+    options['include_aws_key'] = bool(options['include_aws_key'])
+    return {ec2_util.OPTIONS_TAG: json.dumps(options, sort_keys=True)}
+
+# A copy of opts with the cluster options recorded on the masters, except the ones
+# given on the command line. Returns it and whether it differs from the recorded options.
+def get_cluster_options(opts, master_nodes):
+    recorded = [m.tags[ec2_util.OPTIONS_TAG] for m in master_nodes
+                if ec2_util.OPTIONS_TAG in (m.tags or {})]
+    cluster_opts = copy.copy(opts)
+    cluster_opts.include_aws_key = bool(opts.include_aws_key)
+    if not recorded:
+        print >> stderr, ("WARNING: the masters have no recorded options, the cluster is "
+                          "reconfigured with the options of the command line")
+        return cluster_opts, True
+    options = json.loads(recorded[0])
+    for k in CLUSTER_OPTIONS:
+        if k in options and k not in opts.explicit:
+            setattr(cluster_opts, k, options[k])
+    changed = get_options_tags(cluster_opts)[ec2_util.OPTIONS_TAG] != recorded[0]
+    print "Cluster options: profile=%s, disk_layout=%s, include_aws_key=%s%s" % (
+        cluster_opts.profile, cluster_opts.disk_layout, cluster_opts.include_aws_key,
+        ' (changed)' if changed else '')
+    return cluster_opts, changed
+
+# Variables of the bootstrap script that are set from the command line options.
+def get_bootstrap_settings(opts):
+    return {'FAIL_FAST': opts.fail_fast,
+            'LAUNCH_ID': opts.launch_id,
+            'DISK_LAYOUT': opts.disk_layout,
+            'SIZING_PROFILE': opts.profile}
+
+# Variables of the bootstrap script that give the nodes the masters of a cluster
+# that has several, for their high availability configuration.
+def get_master_settings(master_nodes):
+    if len(master_nodes) < 2:
+        return {}
+    return {'MASTERS': [m.private_dns_name for m in master_nodes],
+            'NAMENODE_HA': ec2_util.is_namenode_ha(master_nodes)}
+
+# Zones and placement group of the slaves of a launch, following --placement.
+# Returns the list of (zone, count) and the placement group name, None if there is none.
+def get_slave_placement(conn, opts, master, existing_slaves):
+    group = None
+    if opts.placement == 'cluster':
+        group = placement.get_or_make_group(conn, placement.get_group_name(opts.cluster_name))
+    zones = placement.plan_zones(conn, opts.placement, opts.zone_weights, master.placement,
+                                 opts.slaves, existing_slaves)
+    return zones, group
+
+# Launch specs (instance type, zone) tried in turn for the on-demand slaves EC2 has no
+# capacity for: -t in each zone of the placement followed by the fallback types there,
+# then the fallback zones. What the last spec of a zone cannot launch spills over to the next zone.
+# Returns the specs, and the first spec and slave count of each zone.
+def get_launch_specs(opts, zones):
+    types = [opts.instance_type] + [t for t in opts.spot_fallback_types.split(',') if t]
+    specs = []
+    firsts = []
+    for zone, count in zones:
+        firsts.append((len(specs), count))
+        specs += [(t, zone) for t in types]
+    planned = [z for z, count in zones]
+    specs += [(opts.instance_type, z) for z in opts.spot_fallback_zones.split(',')
+              if z and z not in planned]
+    return specs, firsts
+
+# Tell the masters of a high availability cluster the host names of each other, which
+# their bootstrap waits for, since they are only known once all of them are launched.
+def send_master_list(opts, master_nodes):
+    fname = bootstrap.MASTERS_FILE
+    executor = ssh_util.Executor(opts, parallel=opts.parallel)
+    results = executor.run([m.public_dns_name for m in master_nodes],
+                           'cat > %s.tmp && mv %s.tmp %s' % (fname, fname, fname),
+                           stdin=json.dumps([m.private_dns_name for m in master_nodes]))
+    failed = [r.host for r in results if not r.ok()]
+    if failed:
+        print >> stderr, ("ERROR: Could not send the master list to %s, their bootstrap "
+                          "waits for ~/%s" % (', '.join(failed), fname))
+        sys.exit(1)
+
+# get ami of the machine: the image baked with bake-ami for the region and
+# virtualization type if it has the current hadoop and jdk, the ubuntu base image otherwise
+def get_ami(instance, region=None):
+    itype = ec2_util.get_instance_type(instance)
+    baked = ami_manifest.AmiManifest().get(region, itype,
+                                           bootstrap.hadoop_dir, bootstrap.jdk_dir)
+    if baked is not None:
+        return baked
+    return get_base_ami(instance)
+
 # use ubuntu machines
-def get_ami(instance):
+def get_base_ami(instance):
     itype = ec2_util.get_instance_type(instance)
     if itype == 'pvm':
         return 'ami-6989a659'
     else:
         return 'ami-5189a661'
 
+# Bake an image for the virtualization type of -t: a builder instance runs the
+# installation part of the bootstrap and stops, the image is made from it and
+# recorded in the manifest, so that later launches in the region use it.
+def bake_ami(conn, opts):
+    virt = ec2_util.get_instance_type(opts.instance_type)
+    base = opts.ami or get_base_ami(opts.instance_type)
+    try:
+        image = conn.get_all_images(image_ids=[base])[0]
+    except:
+        print >> stderr, "Could not find AMI " + base
+        sys.exit(1)
+    settings = get_bootstrap_settings(opts)
+    settings['BAKE_IMAGE'] = True
+    settings['FAIL_FAST'] = True
+    # the image must not carry the aws key
+    bake_opts = copy.copy(opts)
+    bake_opts.include_aws_key = False
+    user_data = get_launch_user_data(bake_opts, opts.instance_type, settings)
+    res = image.run(key_name=opts.key_pair,
+                    instance_type=opts.instance_type,
+                    placement=opts.zone,
+                    block_device_map=ec2_util.get_block_device(opts.instance_type, 0),
+                    instance_initiated_shutdown_behavior='stop',
+                    user_data=user_data)
+    builder = res.instances[0]
+    ec2_util.tag_instances(conn, [builder], {'Name': '%s-ami-builder' % opts.cluster_name})
+    if _PACKAGER.pushed_script(user_data) is not None:
+        ec2_util.wait_for_instances(conn, [builder], opts.wait)
+        push_user_data(opts, [builder], user_data)
+    print "Launched builder %s from %s, waiting for the installation..." % (builder.id, base)
+    deadline = time.time() + opts.bake_timeout
+    while True:
+        time.sleep(15)
+        ec2_util.retry_ec2_call(builder.update)
+        if builder.state == 'stopped':
+            break
+        if time.time() > deadline:
+            print >> stderr, ("ERROR: builder %s did not finish in %d seconds, it is left running, "
+                              "see ~/bootstrap.log on %s" % (builder.id, opts.bake_timeout,
+                                                              builder.public_dns_name))
+            sys.exit(1)
+    name = '%s-%s-%s' % (opts.cluster_name, virt, time.strftime('%Y%m%d-%H%M%S'))
+    ami = conn.create_image(builder.id, name,
+                            description='yarn-ec2 %s %s' % (bootstrap.hadoop_dir,
+                                                            bootstrap.jdk_dir))
+    print "Creating image %s (%s)..." % (ami, name)
+    while True:
+        time.sleep(15)
+        state = ec2_util.retry_ec2_call(lambda: conn.get_all_images(image_ids=[ami])[0].state)
+        if state == 'available':
+            break
+        if state == 'failed':
+            print >> stderr, "ERROR: creating image %s failed" % ami
+            sys.exit(1)
+    builder.terminate()
+    ami_manifest.AmiManifest().put(opts.region, virt, ami, name,
+                                   bootstrap.hadoop_dir, bootstrap.jdk_dir)
+    print "Image %s is ready, new %s nodes in %s launch from it" % (ami, virt, opts.region)
+
 # Launch master of a cluster of the given name, by setting up its security groups,
 # and then starting new instances in them.
 # Returns a tuple of EC2 reservation objects for the master and slaves
@@ -184,11 +596,11 @@ def launch_master(conn, opts):
                                                                       die_on_error=False)
     if existing_slaves:
         print >> stderr, ("ERROR: There are already instances running in " +
-                          "group %s or %s" % (group.name, slave_group.name))
+                          "group %s or %s" % (master_group.name, slave_group.name))
         sys.exit(1)
 
     if opts.ami is None:
-        opts.ami = get_ami(opts.instance_type)
+        opts.ami = get_ami(opts.instance_type, opts.region)
     print "Launching instances..."
 
     try:
@@ -204,32 +616,45 @@ def launch_master(conn, opts):
             if inst.state not in ["shutting-down", "terminated"]:
                 inst.start()
         master_nodes = existing_masters
+        user_data = None
     else:
         # Create block device mapping so that we can add an EBS volume if asked to
         block_map = ec2_util.get_block_device(opts.instance_type, 0)
         master_type = opts.instance_type
         if opts.zone == 'all':
             opts.zone = random.choice(conn.get_all_zones()).name
+        settings = get_bootstrap_settings(opts)
+        if opts.masters > 1:
+            settings['NUM_MASTERS'] = opts.masters
+            settings['NAMENODE_HA'] = opts.namenode_ha
+        user_data = get_launch_user_data(opts, master_type, settings)
         master_res = image.run(key_name=opts.key_pair,
                                security_groups=[master_group],
                                instance_type=master_type,
                                placement=opts.zone,
-                               min_count=1,
-                               max_count=1,
+                               min_count=opts.masters,
+                               max_count=opts.masters,
                                block_device_map=block_map,
-                               user_data=get_user_data('bootstrap.py', '',
-                                                       master_type, opts.include_aws_key))
+                               user_data=user_data)
         master_nodes = master_res.instances
-        print "Launched master in %s, regid = %s" % (opts.zone, master_res.id)
+        print "Launched %d master(s) in %s, regid = %s" % (len(master_nodes), opts.zone,
+                                                          master_res.id)
+        if opts.namenode_ha:
+            ec2_util.tag_instances(conn, master_nodes, {ec2_util.NAMENODE_HA_TAG: 'true'})
+
+    # Give the instances descriptive names and the tags used for discovery,
+    # tagging right away since EC2 accepts tags on pending instances
+    tags = ec2_util.get_cluster_tags(cluster_name, 'master')
+    tags.update(get_options_tags(opts))
+    ec2_util.tag_instances(conn, master_nodes, tags)
 
     print 'Waiting for master to getup...'
-    ec2_util.wait_for_instances(conn, master_nodes)
+    ec2_util.wait_for_instances(conn, master_nodes, opts.wait)
+    master_nodes = ec2_util.sort_masters(master_nodes)
+    push_user_data(opts, master_nodes, user_data)
+    if len(master_nodes) > 1 and not existing_masters:
+        send_master_list(opts, master_nodes)
 
-    # Give the instances descriptive names
-    for master in master_nodes:
-        master.add_tag(
-            key='Name',
-            value='{cn}-master-{iid}'.format(cn=cluster_name, iid=master.id))
     master = master_nodes[0].public_dns_name
     print 'finishing getting master %s' % master
     # Return all the instances
@@ -257,39 +682,53 @@ def launch_slaves(conn, opts):
                           "group %s" % (master_group.name))
         sys.exit(1)
 
-    if opts.ami is None:
-        opts.ami = get_ami(opts.instance_type)
+    ami = opts.ami or get_ami(opts.instance_type, opts.region)
     print "Launching instances..."
 
     try:
-        image = conn.get_all_images(image_ids=[opts.ami])[0]
+        conn.get_all_images(image_ids=[ami])[0]
     except:
-        print >> stderr, "Could not find AMI " + opts.ami
+        print >> stderr, "Could not find AMI " + ami
         sys.exit(1)
 
     master = existing_masters[0]
-    block_map = ec2_util.get_block_device(opts.instance_type, 0)
-    zone = master.placement
-    slave_res = image.run(key_name=opts.key_pair,
-                          security_groups=[slave_group],
-                          instance_type=opts.instance_type,
-                          placement=zone,
-                          min_count=opts.slaves,
-                          max_count=opts.slaves,
-                          block_device_map=block_map,
-                          user_data=get_user_data('bootstrap.py',
-                                                  master.private_dns_name,
-                                                  opts.instance_type,
-                                                  opts.include_aws_key))
-    slave_nodes = slave_res.instances
-    print "Launched %d slaves in %s, regid = %s" % (len(slave_nodes),
-                                                    zone, slave_res.id)
+    settings = get_bootstrap_settings(opts)
+    settings.update(get_master_settings(existing_masters))
+    zones, group = get_slave_placement(conn, opts, master, existing_slaves)
+    specs, firsts = get_launch_specs(opts, zones)
+    # packaged before the launch threads start, which cannot exit on a package too large
+    user_data = dict((itype, get_launch_user_data(opts, itype, settings, existing_masters))
+                     for itype, zone in specs)
+    def launch(spec, count):
+        itype, zone = specs[spec]
+        # partial launches are fine, what is missing goes on with the next launch spec
+        res = ec2_util.retry_ec2_call(lambda: conn.run_instances(
+            opts.ami or get_ami(itype, opts.region),
+            key_name=opts.key_pair,
+            security_groups=[slave_group],
+            instance_type=itype,
+            placement=zone,
+            # the placement group lives in the zone of the master
+            placement_group=group if zone == master.placement else None,
+            min_count=1,
+            max_count=count,
+            block_device_map=ec2_util.get_block_device(itype, 0),
+            user_data=user_data[itype]))
+        print "Launched %d of %d %s slaves in %s, regid = %s" % (
+            len(res.instances), count, itype, zone, res.id)
+        return res.instances
+    tags = ec2_util.get_cluster_tags(cluster_name, 'slave')
+    engine = launcher.ChunkedLauncher(launch, len(specs), opts.launch_parallel,
+                                      lambda instances: ec2_util.tag_instances(conn, instances, tags))
+    chunks = [(spec, n) for spec, count in firsts
+              for n in launcher.split_chunks(count, opts.launch_chunk)]
+    slave_nodes = engine.run(chunks)
+    engine.report(['%s %s' % spec for spec in specs])
+    if len(slave_nodes) < opts.slaves:
+        print >> stderr, "WARNING: %d of %d slaves were launched" % (len(slave_nodes), opts.slaves)
     print 'Waiting for slave to getup...'
-    ec2_util.wait_for_instances(conn, slave_nodes)
-    for slave in slave_nodes:
-        slave.add_tag(
-            key='Name',
-            value='{cn}-slave-{iid}'.format(cn=cluster_name, iid=slave.id))
+    for slave in ec2_util.iter_ready_instances(conn, slave_nodes, opts.wait):
+        print 'Slave %s is %s at %s' % (slave.id, slave.state, slave.public_dns_name)
     print 'Done...'
 
 # Launch slaves of a cluster of the given name, by setting up its security groups,
@@ -297,12 +736,16 @@ def launch_slaves(conn, opts):
 # Returns a tuple of EC2 reservation objects for the master and slaves
 # Fails if there already instances running in the cluster's groups.
 def launch_spot_slaves(conn, opts):
-    vcpu, vram, price = get_resource_map()
+    vcpu, vram, price = get_resource_map(opts.region)
     cluster_name = opts.cluster_name
     if opts.identity_file is None:
         print >> sys.stderr, "ERROR: Must provide an identity file (-i) for ssh connections."
         sys.exit(1)
     if opts.spot_price is None:
+        if opts.instance_type not in price:
+            print >> stderr, ("ERROR: No known price for %s in %s, set --spot-price" %
+                              (opts.instance_type, opts.region))
+            sys.exit(1)
         opts.spot_price = price[opts.instance_type]
         print "Spot price is not specified, bid the full price=%g for %s" % (opts.spot_price, opts.instance_type)
 
@@ -320,68 +763,438 @@ def launch_spot_slaves(conn, opts):
                           "group %s" % (master_group.name))
         sys.exit(1)
 
-    if opts.ami is None:
-        opts.ami = get_ami(opts.instance_type)
-    print "Launching Spot instances type=%s, price=%g..." % (opts.instance_type, opts.spot_price)
-
     master = existing_masters[0]
-    block_map = ec2_util.get_block_device(opts.instance_type, 0)
-    zone = master.placement
-    slave_reqs = conn.request_spot_instances(
-        price=opts.spot_price,
-        image_id=opts.ami,
-        launch_group="launch-group-%s" % cluster_name,
-        placement=zone,
-        count=opts.slaves,
-        key_name=opts.key_pair,
-        security_groups=[slave_group],
-        instance_type=opts.instance_type,
-        block_device_map=block_map,
-        user_data=get_user_data('bootstrap.py',
-                                master.private_dns_name,
-                                opts.instance_type,
-                                opts.include_aws_key))
-    print 'Done... request is submitted'
-
-def stringify_command(parts):
-    if isinstance(parts, str):
-        return parts
+    settings = get_bootstrap_settings(opts)
+    settings.update(get_master_settings(existing_masters))
+    zones, group = get_slave_placement(conn, opts, master, existing_slaves)
+    # the launch specs of each zone follow each other, the requests that stay open
+    # in a zone go on with its fallbacks and then with the next zone
+    specs = []
+    first_specs = []
+    for zone, count in zones:
+        first_specs.append((len(specs), count))
+        specs += get_spot_specs(opts, zone, price)
+    user_data = dict((itype, get_launch_user_data(opts, itype, settings, existing_masters))
+                     for itype, zone, bid in specs)
+    def submit(spec, count):
+        itype, zone, bid = specs[spec]
+        print "Launching %d Spot instances type=%s, zone=%s, price=%g..." % (
+            count, itype, zone, bid)
+        return conn.request_spot_instances(
+            price=bid,
+            image_id=opts.ami or get_ami(itype, opts.region),
+            # only the first submission in a single zone is all or nothing
+            launch_group=("launch-group-%s" % cluster_name
+                          if spec == 0 and len(zones) == 1 else None),
+            placement=zone,
+            # the placement group lives in the zone of the master
+            placement_group=group if zone == master.placement else None,
+            count=count,
+            key_name=opts.key_pair,
+            security_groups=[slave_group],
+            instance_type=itype,
+            block_device_map=ec2_util.get_block_device(itype, 0),
+            user_data=user_data[itype])
+
+    tracker = spot_tracker.SpotTracker(conn, submit, len(specs),
+                                       ec2_util.get_cluster_tags(cluster_name, 'slave'),
+                                       open_timeout=opts.spot_open_timeout)
+    for spec, count in first_specs:
+        tracker.launch(spec, count)
+    print 'Waiting for spot requests to be fulfilled...'
+    tracker.run(opts.wait)
+    tracker.report(['%s %s $%g' % spec for spec in specs])
+    missing = opts.slaves - len(tracker.fulfilled())
+    if missing > 0 and opts.ondemand_topup:
+        print "Launching %d on-demand slaves to make up for unfulfilled spot requests" % missing
+        sub = copy.copy(opts)
+        sub.slaves = missing
+        launch_slaves(conn, sub)
+    elif missing > 0:
+        print >> stderr, "WARNING: %d of %d spot requests were not fulfilled" % (
+            missing, opts.slaves)
+    print 'Done...'
+
+# Launch specs (instance type, zone, bid) tried in turn for spot requests that are
+# not fulfilled: the requested one, a higher bid, the fallback types, the fallback zones.
+def get_spot_specs(opts, zone, price):
+    def cap(itype, bid):
+        return opts.max_price.get(itype, max(price.get(itype, bid), bid))
+    itype = opts.instance_type
+    specs = [(itype, zone, opts.spot_price)]
+    rebid = min(opts.spot_price * opts.spot_rebid, cap(itype, opts.spot_price))
+    if rebid > opts.spot_price:
+        specs.append((itype, zone, rebid))
+    for t in [t for t in opts.spot_fallback_types.split(',') if t]:
+        if t in price or t in opts.max_price:
+            specs.append((t, zone, cap(t, 0)))
+        else:
+            print >> stderr, "WARNING: no known price for fallback type %s, skipped" % t
+    for z in [z for z in opts.spot_fallback_zones.split(',') if z]:
+        specs.append((itype, z, max(rebid, opts.spot_price)))
+    return specs
+
+# Gracefully remove slaves of the cluster: the --instance-ids ones, or else the -s
+# slaves running the fewest containers. Their containers get --decommission-timeout
+# seconds to finish before the instances are terminated.
+def remove_slaves(conn, opts):
+    master_nodes, slave_nodes = ec2_util.get_existing_cluster(conn, opts.cluster_name,
+                                                              die_on_error=False)
+    if len(master_nodes) == 0:
+        print >> stderr, "ERROR: Cannot find the master of cluster %s" % opts.cluster_name
+        sys.exit(1)
+    master = yarn_util.active_master(master_nodes).public_dns_name
+    containers = dict((yarn_util.short_host(n['nodeHostName']), n['numContainers'])
+                      for n in yarn_util.get_nodes(master))
+    def running(slave):
+        return containers.get(yarn_util.short_host(slave.private_dns_name or ''), 0)
+    if opts.instance_ids:
+        ids = [i for i in opts.instance_ids.split(',') if i]
+        chosen = [s for s in slave_nodes if s.id in ids]
+        missing = set(ids) - set(s.id for s in chosen)
+        if missing:
+            print >> stderr, "ERROR: %s are not slaves of cluster %s" % (
+                ', '.join(sorted(missing)), opts.cluster_name)
+            sys.exit(1)
     else:
-        return ' '.join(map(pipes.quote, parts))
+        chosen = sorted(slave_nodes, key=lambda s: (running(s), s.id))[:opts.slaves]
+    print "Removing %d slave(s):" % len(chosen)
+    for s in chosen:
+        print "  %s %s running %d container(s)" % (s.id, s.private_dns_name, running(s))
+    removed = yarn_util.decommission_slaves(conn, opts, master, chosen,
+                                            opts.decommission_timeout)
+    print "Terminated %d of %d slave(s)" % (len(removed), len(chosen))
+    # the placement group goes away with its last slave
+    group = placement.get_group_name(opts.cluster_name)
+    removed_ids = set(s.id for s in removed)
+    in_group = [s for s in slave_nodes if getattr(s, 'placement_group', None) == group]
+    if in_group and all(s.id in removed_ids for s in in_group):
+        placement.delete_group(conn, group, opts.wait)
+    if len(removed) != len(chosen):
+        sys.exit(1)
 
-def ssh_args(opts):
-    parts = ['-o', 'StrictHostKeyChecking=no']
-    if opts.identity_file is not None:
-        parts += ['-i', opts.identity_file]
-    return parts
+# Render the hadoop configuration of every node again from bootstrap.py and the options,
+# in parallel and without touching the disks, then restart the daemons whose configuration
+# changed: the slaves in rolling batches of at most --max-unavailable of them, the master last.
+# Returns the number of nodes that failed.
+def reconfigure(opts, master_nodes, slave_nodes):
+    master = master_nodes[0]
+    master_ids = set(m.id for m in master_nodes)
+    settings = get_bootstrap_settings(opts)
+    settings.update(get_master_settings(master_nodes))
+    scripts = {}
+    def script(node):
+        master_dns = '' if node.id in master_ids else master.private_dns_name
+        key = (master_dns, node.instance_type)
+        if key not in scripts:
+            scripts[key] = get_user_data('bootstrap.py', master_dns, node.instance_type,
+                                         opts.include_aws_key, settings)
+        return scripts[key]
+    nodes = dict((n.public_dns_name, n) for n in master_nodes + slave_nodes if n.public_dns_name)
+    executor = ssh_util.Executor(opts, parallel=opts.parallel,
+                                 timeout=opts.ssh_timeout or None)
+    tstart = time.time()
+    results = executor.run(sorted(nodes.keys()), 'source ~/.hadoop_env; python - configure',
+                           stdin=lambda host: script(nodes[host]), capture=True)
+    restart = {}
+    diffs = {}
+    failed = 0
+    for r in results:
+        lines = [l for l in r.output if l.startswith(bootstrap.CONFIGURE_RESULT)]
+        if not r.ok() or not lines:
+            failed += 1
+            print >> stderr, "FAILED on %s: %s" % (r.host, ''.join(r.output[-3:]).strip())
+            continue
+        res = json.loads(lines[-1][len(bootstrap.CONFIGURE_RESULT):])
+        if res['restart']:
+            restart[r.host] = res['restart']
+        for change in res['changes']:
+            diffs.setdefault(tuple(change), []).append(r.host)
+    print "Configuration rendered on %d node(s) in %.1f seconds, %d failed" % (
+        len(results), time.time() - tstart, failed)
+    for (fname, name, old, new), hosts in sorted(diffs.items()):
+        print "  %s %s: %s -> %s (%d node(s))" % (
+            fname, name, old if old is not None else '(unset)',
+            new if new is not None else '(unset)', len(hosts))
+
+    def restart_cmd(host):
+        return 'source ~/.hadoop_env; ' + '; '.join(bootstrap.restart_cmds(restart[host]))
+    slaves = [nodes[h] for h in sorted(restart.keys()) if nodes[h].id not in master_ids]
+    active = yarn_util.active_master(master_nodes)
+    batch = max(1, int(len(slave_nodes) * opts.max_unavailable))
+    for i in range(0, len(slaves), batch):
+        group = slaves[i:i + batch]
+        hosts = [s.public_dns_name for s in group]
+        previous = dict((h, yarn_util.get_nm_start_time(h)) for h in hosts)
+        print "Restarting %d slave(s), %d of %d" % (len(group), i + len(group), len(slaves))
+        executor.run(hosts, restart_cmd)
+        restarted = [s for s in group if 'nodemanager' in restart[s.public_dns_name]]
+        left = yarn_util.wait_for_nodemanagers(active.public_dns_name, restarted,
+                                               previous, opts.wait)
+        if left:
+            print >> stderr, ("ERROR: nodemanagers of %s did not come back, stopping the "
+                              "rolling restart" % ', '.join(s.public_dns_name for s in left))
+            return failed + len(left)
+    # with several masters, the standby ones first and one at a time, so that a
+    # resource manager keeps running and the applications fail over to it
+    for m in sorted(master_nodes, key=lambda m: m.id == active.id):
+        host = m.public_dns_name
+        if host in restart:
+            print "Restarting %s on the master %s" % (', '.join(restart[host]), host)
+            if 'resourcemanager' in restart[host] and len(master_nodes) == 1:
+                print >> stderr, "WARNING: applications running on the cluster are lost"
+            executor.run([host], restart_cmd)
+            if (len(master_nodes) > 1 and 'resourcemanager' in restart[host] and
+                not yarn_util.wait_for_resourcemanager(host, opts.wait)):
+                print >> stderr, ("ERROR: the resource manager of %s did not come back, "
+                                  "stopping the rolling restart" % host)
+                return failed + 1
+    print "Reconfigured in %.1f seconds" % (time.time() - tstart)
+    return failed
 
-def ssh_command(opts):
-    return ['ssh'] + ssh_args(opts)
+ssh_command = ssh_util.ssh_command
 
-# Run a command on a host through ssh, retrying up to five times
-# and then throwing an exception if ssh continues to fail.
+# Run a command on a host through ssh, retrying up to five times with
+# exponential backoff and then throwing an exception if ssh continues to fail.
 def ssh(host, opts, command):
     tries = 0
     while True:
         try:
             return subprocess.check_call(
                 ssh_command(opts) + ['-t', '-t', '%s@%s' % (opts.user, host),
-                                     stringify_command(command)])
+                                     ssh_util.stringify_command(command)])
         except subprocess.CalledProcessError as e:
             if (tries > 5):
                 # If this was an ssh failure, provide the user with hints.
                 if e.returncode == 255:
                     raise UsageError(
-                        "Failed to SSH to remote host {0}.\n" +
-                        "Please check that you have provided the correct --identity-file and " +
-                        "--key-pair parameters and try again.".format(host))
+                        ("Failed to SSH to remote host {0}.\n" +
+                         "Please check that you have provided the correct --identity-file and " +
+                         "--key-pair parameters and try again.").format(host))
                 else:
                     raise e
+            delay = ssh_util.backoff_delay(tries)
             print >> sys.stderr, \
-                "Error executing remote command, retrying after 30 seconds: {0}".format(e)
-            time.sleep(30)
+                "Error executing remote command, retrying after {0:.1f} seconds: {1}".format(delay, e)
+            time.sleep(delay)
             tries = tries + 1
 
+# Run a command on the nodes of the cluster in parallel.
+# Returns the number of hosts on which the command failed.
+def run_on_cluster(opts, master_nodes, slave_nodes, command):
+    nodes = []
+    if opts.on in ['all', 'master']:
+        nodes += master_nodes
+    if opts.on in ['all', 'slaves']:
+        nodes += slave_nodes
+    hosts = [n.public_dns_name for n in nodes if n.public_dns_name]
+    executor = ssh_util.Executor(opts, parallel=opts.parallel,
+                                 timeout=opts.ssh_timeout or None)
+    results = executor.run(hosts, command)
+    failed = [r for r in results if not r.ok()]
+    for r in failed:
+        print >> stderr, "FAILED on %s: exit code %s%s" % (
+            r.host, r.returncode, ' (timed out)' if r.timed_out else '')
+    print "Command finished on %d host(s), %d failed" % (len(results), len(failed))
+    return len(failed)
+
+# Nearest-rank percentile of a list of numbers, q in [0, 100].
+def percentile(values, q):
+    values = sorted(values)
+    rank = int(math.ceil(q / 100.0 * len(values)))
+    return values[min(max(rank, 1), len(values)) - 1]
+
+# Read the bootstrap timing reports the nodes wrote into the master's hdfs.
+def get_timelines(opts, master):
+    executor = ssh_util.Executor(opts, parallel=1)
+    result = executor.run_host(
+        master, 'source ~/.hadoop_env; $HADOOP_HOME/bin/hadoop fs -cat /yarn-ec2/stats/*.json',
+        capture=True)
+    records = []
+    for l in result.output:
+        try:
+            records.append(json.loads(l))
+        except ValueError:
+            pass
+    return records
+
+# Print p50/p95/max time-to-join of the nodes grouped by instance type and by launch.
+def print_stats(records):
+    records = [r for r in records if r.get('time_to_join') is not None]
+    if not records:
+        print "No bootstrap reports found"
+        return
+    for key in ['instance_type', 'launch_id']:
+        groups = {}
+        for r in records:
+            groups.setdefault(r.get(key) or '-', []).append(r['time_to_join'])
+        print '%-32s %6s %8s %8s %8s' % (key, 'nodes', 'p50(s)', 'p95(s)', 'max(s)')
+        for name, values in sorted(groups.items()):
+            print '%-32s %6d %8.1f %8.1f %8.1f' % (name, len(values), percentile(values, 50),
+                                                   percentile(values, 95), max(values))
+        print
+    disks = {}
+    for r in records:
+        if r.get('disk_write_mb_s') is not None:
+            key = '%s %s x%d' % (r['instance_type'], r['disk_layout'], r['disk_count'])
+            disks.setdefault(key, []).append(r['disk_write_mb_s'])
+    if disks:
+        print '%-32s %6s %8s %8s' % ('disk layout', 'nodes', 'p50MB/s', 'minMB/s')
+        for name, values in sorted(disks.items()):
+            print '%-32s %6d %8.1f %8.1f' % (name, len(values), percentile(values, 50), min(values))
+        print
+    phases = {}
+    for r in records:
+        for p in r['phases']:
+            phases.setdefault(p['name'], []).append(p['end'] - p['start'])
+    print '%-32s %6s %8s %8s %8s' % ('phase', 'nodes', 'p50(s)', 'p95(s)', 'max(s)')
+    for name, values in sorted(phases.items()):
+        print '%-32s %6d %8.1f %8.1f %8.1f' % (name, len(values), percentile(values, 50),
+                                               percentile(values, 95), max(values))
+
+# Usable YARN capacity of a slave of each instance type, as (vcores, memory MB),
+# counting only the resources that whole containers of the profile can use.
+def get_yarn_capacity(profile, region=None):
+    vcpu, vram, price = get_resource_map(region)
+    capacity = {}
+    for itype in price:
+        sz = bootstrap.compute_sizing(vcpu[itype], vram[itype], False, profile)
+        capacity[itype] = (sz['containers'] * sz['container_vcores'],
+                           sz['containers'] * sz['container_mb'])
+    return capacity
+
+# Find the cheapest mix of at most two instance types whose total capacity reaches
+# the target vcores and memory (MB). capacity maps types to (vcores, memory MB) and
+# price maps them to the hourly price.
+# Returns (hourly cost, list of (type, count)), or None if no mix reaches the target.
+def plan_instance_mix(target_vcores, target_mem, capacity, price):
+    def count(itype, vcores, mem):
+        v, m = capacity[itype]
+        if (vcores > 0 and v == 0) or (mem > 0 and m == 0):
+            return None
+        return int(max(math.ceil(float(vcores) / v) if vcores > 0 else 0,
+                       math.ceil(float(mem) / m) if mem > 0 else 0))
+    types = sorted(capacity.keys())
+    best = None
+    for i, a in enumerate(types):
+        na_max = count(a, target_vcores, target_mem)
+        if na_max is None:
+            continue
+        for b in [None] + types[i + 1:]:
+            for na in ([na_max] if b is None else range(na_max)):
+                nb = 0
+                if b is not None:
+                    nb = count(b, target_vcores - na * capacity[a][0],
+                               target_mem - na * capacity[a][1])
+                    if nb is None:
+                        continue
+                cost = na * price[a] + nb * (price[b] if b else 0)
+                mix = [(t, n) for t, n in [(a, na), (b, nb)] if t and n > 0]
+                if mix and (best is None or cost < best[0] - 1e-9):
+                    best = (cost, mix)
+    return best
+
+# Launch the cheapest mix of slaves reaching --target-vcores and --target-mem.
+def launch_target_capacity(conn, opts, spot):
+    vcpu, vram, price = get_resource_map(opts.region)
+    capacity = get_yarn_capacity(opts.profile, opts.region)
+    allow = set(t for t in opts.allow_types.split(',') if t)
+    deny = set(t for t in opts.deny_types.split(',') if t)
+    for itype in list(capacity.keys()):
+        # burstable types cannot sustain their cpu, only use them when asked for
+        if ((allow and itype not in allow) or itype in deny or
+            (not allow and instance_catalog.get(itype).burstable)):
+            del capacity[itype]
+        elif itype in opts.max_price:
+            if spot:
+                price[itype] = min(price[itype], opts.max_price[itype])
+            elif price[itype] > opts.max_price[itype]:
+                del capacity[itype]
+    plan = plan_instance_mix(opts.target_vcores, opts.target_mem * 1024, capacity, price)
+    if plan is None:
+        print >> stderr, "ERROR: No allowed instance type can reach the target capacity"
+        sys.exit(1)
+    cost, mix = plan
+    print "Cheapest mix for %d vcores, %g GB (profile %s), $%.3f per hour:" % (
+        opts.target_vcores, opts.target_mem, opts.profile, cost)
+    for itype, n in mix:
+        print "  %d x %s: %d vcores, %d MB YARN capacity each, $%.3f per hour" % (
+            n, itype, capacity[itype][0], capacity[itype][1], price[itype])
+    for itype, n in mix:
+        sub = copy.copy(opts)
+        sub.instance_type = itype
+        sub.slaves = n
+        sub.ami = opts.ami
+        if spot:
+            if opts.spot_price is None:
+                sub.spot_price = price[itype]
+            launch_spot_slaves(conn, sub)
+        else:
+            launch_slaves(conn, sub)
+
+# Print the yarn resources and container sizes a profile gives on each instance type.
+def print_sizing_plan(profile, is_master=False):
+    vcpu, vram, price = get_resource_map()
+    print 'profile=%s, role=%s, memory in MB' % (profile, 'master' if is_master else 'slave')
+    print '%-12s %5s %7s %7s %5s %10s %5s %7s %7s %7s' % (
+        'type', 'vcpu', 'mem', 'nm-mem', 'nm-vc', 'container', 'count',
+        'heap', 'ovhd', 'am')
+    for itype in sorted(vcpu.keys()):
+        sz = bootstrap.compute_sizing(vcpu[itype], vram[itype], is_master, profile)
+        print '%-12s %5d %7d %7d %5d %5dMx%-3d %5d %7d %7d %7d' % (
+            itype, vcpu[itype], vram[itype], sz['nm_memory_mb'], sz['nm_vcores'],
+            sz['container_mb'], sz['container_vcores'], sz['containers'],
+            sz['heap_mb'], sz['overhead_mb'], sz['am_mb'])
+
+# Add and remove slaves following the YARN demand until interrupted, or with
+# --simulate replay a recorded demand trace and print how the policy did.
+def run_autoscale(opts, cache):
+    vcpu, vram, price = get_resource_map(opts.region)
+    if opts.instance_type not in vcpu:
+        print >> stderr, "ERROR: Unknown instance type %s" % opts.instance_type
+        sys.exit(1)
+    sz = bootstrap.compute_sizing(vcpu[opts.instance_type], vram[opts.instance_type],
+                                  False, opts.profile)
+    policy = autoscale.ScalePolicy(min_slaves=opts.min_slaves,
+                                   max_slaves=opts.max_slaves,
+                                   containers_per_slave=sz['containers'],
+                                   scale_up_after=opts.scale_up_after,
+                                   idle_after=opts.idle_after,
+                                   cooldown=opts.cooldown,
+                                   max_step=opts.max_step)
+    if opts.simulate:
+        result = autoscale.simulate(policy, autoscale.load_trace(opts.simulate),
+                                    sz['containers'], opts.min_slaves, opts.boot_time,
+                                    opts.scale_interval,
+                                    out=sys.stdout if opts.verbose else None)
+        print "slave hours:             %.1f" % result['slave_hours']
+        if opts.instance_type in price:
+            print "on-demand cost:          $%.2f" % (
+                result['slave_hours'] * price[opts.instance_type])
+        print "pending container hours: %.1f" % result['pending_container_hours']
+        print "peak slaves:             %d" % result['peak_slaves']
+        print "scaling actions:         %d" % result['actions']
+        return
+    conn = connect(opts)
+    def launch(count):
+        sub = copy.copy(opts)
+        sub.slaves = count
+        if opts.spot_price is not None:
+            launch_spot_slaves(conn, sub)
+        else:
+            launch_slaves(conn, sub)
+    cluster = autoscale.Ec2Cluster(
+        conn, opts, launch, opts.decommission_timeout,
+        changed=lambda: cache.invalidate(opts.region, opts.cluster_name))
+    record = open(opts.record, 'a') if opts.record else None
+    try:
+        autoscale.Autoscaler(policy, cluster, opts.scale_interval, record).run()
+    except KeyboardInterrupt:
+        print "Autoscaling stopped"
+    finally:
+        if record is not None:
+            record.close()
+
 def _check_output(*popenargs, **kwargs):
     if 'stdout' in kwargs:
         raise ValueError('stdout argument not allowed, it will be overridden.')
@@ -395,9 +1208,7 @@ def _check_output(*popenargs, **kwargs):
         raise subprocess.CalledProcessError(retcode, cmd, output=output)
     return output
 
-def main():
-    logging.basicConfig()
-    opts = parse_args()
+def connect(opts):
     try:
         conn = ec2.connect_to_region(opts.region)
     except Exception as e:
@@ -406,33 +1217,95 @@ def main():
 
     if opts.zone == '':
         opts.zone = random.choice(conn.get_all_zones()).name
+    return conn
+
+# Get the masters and slaves of the cluster, from the local cache if it is fresh.
+# refresh asks EC2 anyway, for the actions working on every node, which would miss the
+# slaves added and reach the ones removed since the cluster was cached.
+def get_cluster_nodes(opts, cache, refresh=False):
+    if not (opts.refresh or refresh):
+        nodes = cache.get(opts.region, opts.cluster_name)
+        if nodes is not None:
+            return nodes
+    conn = connect(opts)
+    (master_nodes, slave_nodes) = ec2_util.get_existing_cluster(conn, opts.cluster_name)
+    cache.put(opts.region, opts.cluster_name, master_nodes, slave_nodes)
+    return (master_nodes, slave_nodes)
+
+def main():
+    logging.basicConfig()
+    opts = parse_args()
+    cache = cluster_cache.ClusterCache(ttl=opts.cache_ttl)
 
     action = opts.action
     cluster_name = opts.cluster_name
 
-    if action == 'launch':
-        master_nodes = launch_master(conn, opts)
-    elif action == 'addslave':
-        master_nodes = launch_slaves(conn, opts)
-    elif action == 'addspot':
-        master_nodes = launch_spot_slaves(conn, opts)
+    if action == 'plan-sizing':
+        print_sizing_plan(opts.profile)
+    elif action in ['launch', 'addslave', 'addspot']:
+        conn = connect(opts)
+        # the cluster changes, drop the cached state before touching it
+        cache.invalidate(opts.region, cluster_name)
+        if action == 'launch':
+            master_nodes = launch_master(conn, opts)
+        elif opts.target_vcores > 0 or opts.target_mem > 0:
+            launch_target_capacity(conn, opts, action == 'addspot')
+        elif action == 'addslave':
+            master_nodes = launch_slaves(conn, opts)
+        else:
+            master_nodes = launch_spot_slaves(conn, opts)
+    elif action == "removeslave":
+        conn = connect(opts)
+        cache.invalidate(opts.region, cluster_name)
+        remove_slaves(conn, opts)
+    elif action == "bake-ami":
+        bake_ami(connect(opts), opts)
     elif action == "get-master":
-        (master_nodes, slave_nodes) = ec2_util.get_existing_cluster(conn, cluster_name)
-        print master_nodes[0].public_dns_name
+        (master_nodes, slave_nodes) = get_cluster_nodes(opts, cache)
+        print yarn_util.active_master(master_nodes).public_dns_name
     elif action == "login":
-        (master_nodes, slave_nodes) = ec2_util.get_existing_cluster(conn, cluster_name)
-        master = master_nodes[0].public_dns_name
+        (master_nodes, slave_nodes) = get_cluster_nodes(opts, cache)
+        master = yarn_util.active_master(master_nodes).public_dns_name
         subprocess.check_call(
             ssh_command(opts)  + ['-t', "%s@%s" % (opts.user, master)])
     elif action == "forward-port":
-        (master_nodes, slave_nodes) = ec2_util.get_existing_cluster(conn, cluster_name)
-        master = master_nodes[0].public_dns_name
+        (master_nodes, slave_nodes) = get_cluster_nodes(opts, cache)
+        master = yarn_util.active_master(master_nodes).public_dns_name
         subprocess.check_call(
             ssh_command(opts)  + ['-D', '9595'] + ['-t', "%s@%s" % (opts.user, master)])
+    elif action == "run":
+        if not opts.command:
+            print >> stderr, "ERROR: run needs a command to execute"
+            sys.exit(1)
+        (master_nodes, slave_nodes) = get_cluster_nodes(opts, cache, refresh=True)
+        if run_on_cluster(opts, master_nodes, slave_nodes, opts.command) != 0:
+            sys.exit(1)
+    elif action == "autoscale":
+        run_autoscale(opts, cache)
+    elif action == "reconfigure":
+        (master_nodes, slave_nodes) = get_cluster_nodes(opts, cache, refresh=True)
+        cluster_opts, changed = get_cluster_options(opts, master_nodes)
+        failed = reconfigure(cluster_opts, master_nodes, slave_nodes)
+        if failed == 0 and changed:
+            # the next reconfigure renders what the nodes have now
+            ec2_util.tag_instances(connect(opts), master_nodes, get_options_tags(cluster_opts))
+            cache.invalidate(opts.region, cluster_name)
+        if failed != 0:
+            sys.exit(1)
+    elif action == "stats":
+        (master_nodes, slave_nodes) = get_cluster_nodes(opts, cache, refresh=True)
+        print_stats(get_timelines(opts, master_nodes[0].public_dns_name))
     else:
         print >> sys.stderr, "Invalid action: %s" % action
         sys.exit(1)
 
+    if opts.verbose:
+        stats = cache.stats()
+        print >> stderr, ("Cluster cache: %d hit(s), %d miss(es) in this run; "
+                          "%d hit(s), %d miss(es) in total" %
+                          (stats['hits'], stats['misses'],
+                           stats['total_hits'], stats['total_misses']))
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,208 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+Talk to the YARN ResourceManager on the master: its REST API for
+metrics and nodes, and rmadmin through ssh to decommission nodes.
+"""
+import json
+import sys
+import threading
+import time
+import urllib2
+import ec2_util
+import ssh_util
+
+RM_WEB_PORT = 8088
+NM_WEB_PORT = 8042
+# exclude file of the resource manager, set up by bootstrap.py
+EXCLUDE_FILE = '$HADOOP_HOME/etc/hadoop/yarn.exclude'
+# Node states in which a node runs no more containers.
+GONE_STATES = ['DECOMMISSIONED', 'LOST', 'SHUTDOWN']
+
+# The host name without domain, the resource manager and EC2 may not
+# agree on the domain of a node.
+def short_host(host):
+    return host.split('.')[0].lower()
+
+def rm_get(master, path, timeout=10):
+    url = 'http://%s:%d/ws/v1/cluster%s' % (master, RM_WEB_PORT, path)
+    req = urllib2.Request(url, headers={'Accept': 'application/json'})
+    return json.load(urllib2.urlopen(req, timeout=timeout))
+
+# High availability state of the resource manager on master: ACTIVE, STANDBY,
+# or None if it does not answer. A resource manager without high availability
+# is always ACTIVE.
+def get_ha_state(master, timeout=5):
+    try:
+        return rm_get(master, '/info', timeout)['clusterInfo'].get('haState')
+    except (IOError, ValueError, KeyError):
+        return None
+
+# Index of the master to talk to given the high availability states of all the
+# masters: the active one, or else the first one that is not known to be standby,
+# as a failover may be going on.
+def pick_active(states):
+    for wanted in [lambda s: s == 'ACTIVE', lambda s: s != 'STANDBY']:
+        for i, state in enumerate(states):
+            if wanted(state):
+                return i
+    return 0
+
+# The master instance running the active resource manager, asking the masters
+# only when there are several of them.
+def active_master(master_nodes):
+    if len(master_nodes) < 2:
+        return master_nodes[0]
+    states = [get_ha_state(m.public_dns_name) for m in master_nodes]
+    return master_nodes[pick_active(states)]
+
+# Wait until the resource manager on master answers, returns whether it did
+# within timeout seconds.
+def wait_for_resourcemanager(master, timeout, poll=5):
+    deadline = time.time() + timeout
+    while get_ha_state(master) is None:
+        if time.time() > deadline:
+            return False
+        time.sleep(poll)
+    return True
+
+# Cluster metrics of the resource manager: pending and allocated memory,
+# vcores, containers and applications.
+def get_cluster_metrics(master):
+    return rm_get(master, '/metrics')['clusterMetrics']
+
+# The nodes known to the resource manager, as a list of dicts with
+# nodeHostName, state, numContainers, usedMemoryMB and availMemoryMB.
+def get_nodes(master):
+    nodes = rm_get(master, '/nodes')['nodes']
+    if not nodes:
+        return []
+    return nodes['node']
+
+# When the nodemanager on host started, in seconds since the epoch,
+# None if it does not answer.
+def get_nm_start_time(host, timeout=5):
+    url = 'http://%s:%d/ws/v1/node/info' % (host, NM_WEB_PORT)
+    req = urllib2.Request(url, headers={'Accept': 'application/json'})
+    try:
+        info = json.load(urllib2.urlopen(req, timeout=timeout))['nodeInfo']
+    except (IOError, ValueError, KeyError):
+        return None
+    return info['nmStartupTime'] / 1000.0
+
+# Wait until the nodemanagers of the slave instances restarted, i.e. their start
+# time differs from the one in previous (keyed by public dns name), and are
+# running in the resource manager of master.
+# Returns the slaves that are still not back after timeout seconds.
+def wait_for_nodemanagers(master, slaves, previous, timeout, poll=5):
+    deadline = time.time() + timeout
+    left = list(slaves)
+    while left:
+        try:
+            running = set(short_host(n['nodeHostName']) for n in get_nodes(master)
+                          if n['state'] == 'RUNNING')
+        except IOError:
+            running = set()
+        def restarted(s):
+            started = get_nm_start_time(s.public_dns_name)
+            return started is not None and started != previous.get(s.public_dns_name)
+        left = [s for s in left
+                if short_host(s.private_dns_name) not in running or not restarted(s)]
+        if not left or time.time() > deadline:
+            break
+        time.sleep(poll)
+    return left
+
+def _run_on_master(opts, master, command):
+    executor = ssh_util.Executor(opts, parallel=1)
+    result = executor.run_host(master, 'source ~/.hadoop_env; ' + command)
+    return result.ok()
+
+# Gracefully decommission hosts: add them to the exclude file and refresh the
+# nodes, rmadmin waits up to timeout seconds for their containers to finish
+# before it forcefully decommissions them. Prints the drain progress every
+# poll seconds meanwhile.
+# Returns the hosts that are decommissioned.
+def decommission_nodes(opts, master, hosts, timeout, poll=10, out=sys.stdout):
+    if not hosts:
+        return []
+    done = []
+    def refresh():
+        done.append(_run_on_master(
+            opts, master,
+            "printf '%s\\n' >> %s && yarn rmadmin -refreshNodes -g %d" %
+            ('\\n'.join(hosts), EXCLUDE_FILE, timeout)))
+    thread = threading.Thread(target=refresh)
+    thread.daemon = True
+    thread.start()
+    wanted = set(short_host(h) for h in hosts)
+    gone = set()
+    while True:
+        thread.join(poll)
+        finished = not thread.is_alive()
+        try:
+            nodes = [n for n in get_nodes(master) if short_host(n['nodeHostName']) in wanted]
+        except IOError as e:
+            print >> out, 'Cannot get the node states: %s' % e
+            if finished:
+                break
+            continue
+        # nodes unknown to the resource manager are gone too
+        gone = wanted - set(short_host(n['nodeHostName']) for n in nodes
+                            if n['state'] not in GONE_STATES)
+        if finished:
+            break
+        draining = [n for n in nodes if n['state'] not in GONE_STATES]
+        print >> out, 'Draining %d node(s), %d container(s) left' % (
+            len(draining), sum(n['numContainers'] for n in draining))
+    if not done or not done[0]:
+        print >> sys.stderr, 'WARNING: yarn rmadmin -refreshNodes failed on %s' % master
+        return []
+    return [h for h in hosts if short_host(h) in gone]
+
+# Remove terminated hosts from the exclude file, so a new node that gets the
+# same host name later is not excluded.
+def forget_nodes(opts, master, hosts):
+    if not hosts:
+        return True
+    pattern = '|'.join(h.replace('.', '\\.') for h in hosts)
+    return _run_on_master(
+        opts, master,
+        "grep -Ev '^(%s)$' %s > %s.tmp; mv %s.tmp %s && yarn rmadmin -refreshNodes" %
+        (pattern, EXCLUDE_FILE, EXCLUDE_FILE, EXCLUDE_FILE, EXCLUDE_FILE))
+
+# Decommission the slave instances from the resource manager of master and,
+# once their containers are drained, terminate them in bulk. Slaves that never
+# joined are terminated right away, slaves that failed to drain are kept.
+# Returns the terminated instances.
+def decommission_slaves(conn, opts, master, slaves, timeout):
+    rm_hosts = dict((short_host(n['nodeHostName']), n['nodeHostName'])
+                    for n in get_nodes(master))
+    joined = [rm_hosts[short_host(s.private_dns_name)] for s in slaves
+              if s.private_dns_name and short_host(s.private_dns_name) in rm_hosts]
+    drained = set(short_host(h) for h in decommission_nodes(opts, master, joined, timeout))
+    doomed = [s for s in slaves
+              if not s.private_dns_name or short_host(s.private_dns_name) not in rm_hosts or
+              short_host(s.private_dns_name) in drained]
+    ids = [s.id for s in doomed]
+    for chunk in ec2_util.chunks(ids, ec2_util.DESCRIBE_CHUNK_SIZE):
+        ec2_util.retry_ec2_call(lambda: conn.terminate_instances(instance_ids=chunk))
+    forget_nodes(opts, master, [rm_hosts[short_host(s.private_dns_name)] for s in doomed
+                                if s.private_dns_name and
+                                short_host(s.private_dns_name) in drained])
+    return doomed